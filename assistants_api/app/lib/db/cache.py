@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+import copy
+import os
+import threading
+import time
+from sqlalchemy import inspect
+from . import models
+
+CACHE_SIZE = int(os.getenv("ROW_CACHE_SIZE", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("ROW_CACHE_TTL_SECONDS", "60"))
+
+
+class RowCache:
+    """
+    In-process LRU cache with a TTL for rows read far more often than they
+    are written, e.g. the assistant looked up by every run. The column
+    values are cached rather than the objects, which belong to the session
+    that loaded them, and a new transient object is built on each hit from
+    a copy, so callers mutating JSON columns do not change the cache.
+    Columns written on their own by hot paths, like the lease of a thread,
+    are left out with `exclude` and are None on cached objects.
+
+    crud invalidates the entries of the rows it updates or deletes; the TTL
+    bounds how stale an entry can get if the row is written elsewhere.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_size: int = CACHE_SIZE,
+        ttl: float = CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        exclude: Iterable[str] = (),
+    ):
+        self.model = model
+        self.keys = [
+            attr.key
+            for attr in inspect(model).column_attrs
+            if attr.key not in exclude
+        ]
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        # bumped on every invalidation, so rows loaded before a write are not
+        # cached after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return self.model(**copy.deepcopy(entry[1]))
+
+    def set(
+        self, key: str, db_object, generation: Optional[int] = None
+    ) -> None:
+        loaded = db_object.__dict__
+        values = {name: loaded[name] for name in self.keys if name in loaded}
+        if len(values) < len(self.keys):
+            return  # partially loaded objects are not cached
+        values = copy.deepcopy(values)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (self.clock() + self.ttl, values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def get_or_load(self, key: str, load: Callable[[], Optional[object]]):
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        generation = self.generation
+        db_object = load()
+        if db_object is not None:
+            self.set(key, db_object, generation)
+        return db_object
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+assistant_cache = RowCache(models.Assistant)
+# the lease changes with every run, it is read from the table
+thread_cache = RowCache(models.Thread, exclude=("locked_by", "lease_until"))
@@ -1,13 +1,129 @@
 from typing import List, Optional
 from sqlalchemy.orm import Session
 import time
-from sqlalchemy import desc, asc
+from sqlalchemy import (
+    asc,
+    case,
+    cast,
+    delete,
+    desc,
+    func,
+    literal,
+    or_,
+    select,
+    true,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import JSONB, insert
 from sqlalchemy.orm.attributes import flag_modified
 
 from lib.fs.schemas import FileObject
-from . import models, schemas
-import uuid
-import json
+from . import ids, models, schemas
+from .cache import assistant_cache, thread_cache
+
+
+def paginate(
+    query,
+    model,
+    limit: int,
+    order: str,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+):
+    """
+    Keyset pagination on the primary key. Ids are generated in creation
+    order, so the cursors are compared with the ids directly and rows
+    inserted concurrently are neither skipped nor repeated.
+    """
+    if order == "asc":
+        query = query.order_by(asc(model.id))
+    else:
+        query = query.order_by(desc(model.id))
+
+    # 'after' follows the requested order, 'before' goes against it
+    if after:
+        if order == "asc":
+            query = query.filter(model.id > after)
+        else:
+            query = query.filter(model.id < after)
+    if before:
+        if order == "asc":
+            query = query.filter(model.id < before)
+        else:
+            query = query.filter(model.id > before)
+
+    return query.limit(limit).all()
+
+
+def merge_json(column, value: dict):
+    """SQL expression merging `value` into a JSONB column."""
+    return func.coalesce(column, literal({}, JSONB)).op("||")(
+        literal(value, JSONB)
+    )
+
+
+def increment_json(column, deltas: dict):
+    """SQL expression adding `deltas` to integer fields of a JSONB column."""
+    fields = []
+    for key, delta in deltas.items():
+        fields += [key, func.coalesce(column[key].as_integer(), 0) + delta]
+    return column.op("||")(func.jsonb_build_object(*fields))
+
+
+def filter_metadata(query, model, metadata: Optional[dict]):
+    """
+    Keeps the rows whose metadata contains all the given key/value pairs,
+    a containment (@>) the GIN index on metadata can answer.
+    """
+    if metadata:
+        query = query.filter(model._metadata.contains(metadata))
+    return query
+
+
+def update_values(
+    model, updates: dict, merge_metadata: bool = False, skip_falsy=False
+) -> dict:
+    """
+    Maps the fields of an update request to the model columns, skipping
+    None values (and falsy ones when `skip_falsy`, as some endpoints always
+    did). Metadata is either replaced or merged into the stored one.
+    """
+    values = {}
+    for key, value in updates.items():
+        if value is None or (skip_falsy and not value):
+            continue
+        if key == "metadata":
+            column = model._metadata
+            values[column] = (
+                merge_json(column, value) if merge_metadata else value
+            )
+        elif hasattr(model, key):
+            values[getattr(model, key)] = value
+    return values
+
+
+def update_returning(
+    db: Session, model, filters: list, values: dict, commit: bool = True
+):
+    """
+    Applies `values` to the row matching `filters` with a single
+    UPDATE ... RETURNING and commits, returning the updated row or None.
+    """
+    if not values:
+        return db.query(model).filter(*filters).first()
+    statement = (
+        update(model)
+        .where(*filters)
+        .values(values)
+        .returning(model)
+        # objects already in the session are updated from the returned row
+        .execution_options(synchronize_session="fetch")
+    )
+    db_object = db.scalars(statement).first()
+    if commit:
+        db.commit()
+    return db_object
 
 
 # ASSISTANT
@@ -22,7 +138,7 @@ def create_assistant(db: Session, assistant: schemas.AssistantCreate):
 
     # Generate a unique ID for the new assistant
     db_assistant = models.Assistant(
-        id=str(uuid.uuid4()),
+        id=ids.new_id(ids.ASSISTANT),
         object="assistant",
         name=assistant.name,
         description=assistant.description,
@@ -38,93 +154,58 @@ def create_assistant(db: Session, assistant: schemas.AssistantCreate):
     )
     db.add(db_assistant)
     db.commit()
-    db.refresh(db_assistant)
     return db_assistant
 
 
 def get_assistants(
-    db: Session, limit: int, order: str, after: str = None, before: str = None
+    db: Session,
+    limit: int,
+    order: str,
+    after: str = None,
+    before: str = None,
+    metadata: Optional[dict] = None,
 ):
-    query = db.query(models.Assistant)
-
-    # Apply ordering
-    if order == "desc":
-        query = query.order_by(
-            desc(models.Assistant.created_at), desc(models.Assistant.id)
-        )
-    else:
-        query = query.order_by(
-            asc(models.Assistant.created_at), asc(models.Assistant.id)
-        )
-
-    # Apply pagination using 'after' and 'before' cursors
-    if after:
-        last_seen_assistant = (
-            db.query(models.Assistant)
-            .filter(models.Assistant.id == after)
-            .first()
-        )
-        if last_seen_assistant:
-            query = query.filter(
-                models.Assistant.created_at >= last_seen_assistant.created_at
-            )
-
-    if before:
-        first_seen_assistant = (
-            db.query(models.Assistant)
-            .filter(models.Assistant.id == before)
-            .first()
-        )
-        if first_seen_assistant:
-            query = query.filter(
-                models.Assistant.created_at <= first_seen_assistant.created_at
-            )
-
-    return query.limit(limit).all()
+    query = filter_metadata(
+        db.query(models.Assistant), models.Assistant, metadata
+    )
+    return paginate(query, models.Assistant, limit, order, after, before)
 
 
 def get_assistant_by_id(db: Session, assistant_id: str):
     """
-    Retrieve an assistant by its ID from the database.
+    Retrieve an assistant by its ID, from the cache or the database.
     """
-    return (
-        db.query(models.Assistant)
+    return assistant_cache.get_or_load(
+        assistant_id,
+        lambda: db.query(models.Assistant)
         .filter(models.Assistant.id == assistant_id)
-        .first()
+        .first(),
     )
 
 
 def update_assistant(db: Session, assistant_id: str, assistant_update: dict):
-    db_assistant = (
-        db.query(models.Assistant)
-        .filter(models.Assistant.id == assistant_id)
-        .first()
+    db_assistant = update_returning(
+        db,
+        models.Assistant,
+        [models.Assistant.id == assistant_id],
+        update_values(
+            models.Assistant,
+            assistant_update,
+            merge_metadata=True,
+            skip_falsy=True,
+        ),
     )
-    if db_assistant:
-        for key, value in assistant_update.items():
-            if value:
-                if key == "metadata":
-                    updated_metadata = {**db_assistant._metadata, **value}
-                    setattr(db_assistant, "_metadata", updated_metadata)
-                else:
-                    setattr(db_assistant, key, value)
-        db.commit()
-        db.refresh(db_assistant)
-        return db_assistant
-    return None
+    assistant_cache.invalidate(assistant_id)
+    return db_assistant
 
 
 def delete_assistant(db: Session, assistant_id: str) -> bool:
-    assistant = (
-        db.query(models.Assistant)
-        .filter(models.Assistant.id == assistant_id)
-        .first()
+    result = db.execute(
+        delete(models.Assistant).where(models.Assistant.id == assistant_id)
     )
-    if not assistant:
-        return False
-    db.delete(assistant)
     db.commit()
-    return True
+    assistant_cache.invalidate(assistant_id)
+    return result.rowcount > 0
 
 
 # FILE
@@ -133,7 +214,6 @@ def create_file(db: Session, file: FileObject):
     db_file = models.File(**file.model_dump())
     db.add(db_file)
     db.commit()
-    db.refresh(db_file)
     return db_file
 
 
@@ -141,55 +221,114 @@ def get_file(db: Session, file_id: str):
     return db.query(models.File).filter(models.File.id == file_id).first()
 
 
+def get_files(db: Session, file_ids: Optional[List[str]] = None):
+    query = db.query(models.File)
+    if file_ids is not None:
+        query = query.filter(models.File.id.in_(file_ids))
+    return query.order_by(models.File.id).all()
+
+
 def delete_file(db: Session, file_id: str) -> bool:
-    file = db.query(models.File).filter(models.File.id == file_id).first()
-    if not file:
-        return False
-    db.delete(file)
+    result = db.execute(delete(models.File).where(models.File.id == file_id))
     db.commit()
-    return True
+    return result.rowcount > 0
 
 
 # THREAD
 def create_thread(db: Session, thread_data: schemas.ThreadCreate):
     # Assume the ThreadCreate schema and Thread model are properly defined
     new_thread = models.Thread(
-        id=str(uuid.uuid4()),
+        id=ids.new_id(ids.THREAD),
         _metadata=thread_data.metadata,
         created_at=int(time.time()),  # Using UNIX timestamp for created_at
     )
-    # If your thread includes messages, you should handle their creation here
     db.add(new_thread)
     if thread_data.messages:
-        for idx, message in enumerate(thread_data.messages):
-            create_message(db, new_thread.id, message, time_shift=idx)
+        db.flush()  # the messages reference the thread
+        create_messages(db, new_thread.id, thread_data.messages, commit=False)
     db.commit()
-    db.refresh(new_thread)
     return new_thread
 
 
 def get_thread(db: Session, thread_id: str):
-    return (
-        db.query(models.Thread).filter(models.Thread.id == thread_id).first()
+    return thread_cache.get_or_load(
+        thread_id,
+        lambda: db.query(models.Thread)
+        .filter(models.Thread.id == thread_id)
+        .first(),
     )
 
 
+def get_threads(
+    db: Session,
+    limit: int,
+    order: str,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    metadata: Optional[dict] = None,
+):
+    query = filter_metadata(db.query(models.Thread), models.Thread, metadata)
+    return paginate(query, models.Thread, limit, order, after, before)
+
+
+def claim_thread_lease(
+    db: Session, thread_id: str, holder: str, ttl: int
+) -> Optional[models.Thread]:
+    """
+    Leases a thread to `holder` for `ttl` seconds, so the runs of a thread
+    execute one at a time. The lease is granted if the thread is not leased,
+    its lease expired or `holder` already has it (renewals). A thread locked
+    by a concurrent claim is skipped rather than waited for, and the claim
+    fails like for a leased thread.
+    """
+    now = int(time.time())
+    claimable = (
+        select(models.Thread.id)
+        .where(
+            models.Thread.id == thread_id,
+            or_(
+                models.Thread.locked_by.is_(None),
+                models.Thread.lease_until < now,
+                models.Thread.locked_by == holder,
+            ),
+        )
+        .with_for_update(skip_locked=True)
+    )
+    return update_returning(
+        db,
+        models.Thread,
+        [models.Thread.id.in_(claimable)],
+        {
+            models.Thread.locked_by: holder,
+            models.Thread.lease_until: now + ttl,
+        },
+    )
+
+
+def release_thread_lease(db: Session, thread_id: str, holder: str) -> bool:
+    result = db.execute(
+        update(models.Thread)
+        .where(
+            models.Thread.id == thread_id, models.Thread.locked_by == holder
+        )
+        .values(locked_by=None, lease_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
 def update_thread(db: Session, thread_id: str, thread_data: dict):
-    db_thread = (
-        db.query(models.Thread).filter(models.Thread.id == thread_id).first()
+    db_thread = update_returning(
+        db,
+        models.Thread,
+        [models.Thread.id == thread_id],
+        update_values(
+            models.Thread, thread_data, merge_metadata=True, skip_falsy=True
+        ),
     )
-    if db_thread:
-        for key, value in thread_data.items():
-            if value:
-                if key == "metadata":
-                    updated_metadata = {**db_thread._metadata, **value}
-                    setattr(db_thread, "_metadata", updated_metadata)
-                else:
-                    setattr(db_thread, key, value)
-        db.commit()
-        db.refresh(db_thread)
-        return db_thread
-    return None
+    thread_cache.invalidate(thread_id)
+    return db_thread
 
 
 def delete_thread(db: Session, thread_id: str) -> bool:
@@ -200,39 +339,26 @@ def delete_thread(db: Session, thread_id: str) -> bool:
         return False
     db.delete(thread)
     db.commit()
+    thread_cache.invalidate(thread_id)
     return True
 
 
 # MESSAGE
-def create_message(
-    db: Session,
-    thread_id: str,
-    message_inp: schemas.MessageInput,
-    time_shift=0,
-):
-    # Create a new Message object
+def message_values(
+    thread_id: str, message_inp: schemas.MessageInput, created_at: int
+) -> dict:
     message_content = schemas.TextContentBlock(
         text=schemas.Text(annotations=[], value=message_inp.content),
         type="text",
     )  # TODO: will need to update this for
 
-    # Create a new UUID
-    original_uuid = str(uuid.uuid4())
-
-    # Convert time_shift to string and get its length
-    time_shift_str = str(time_shift)
-    time_shift_len = len(time_shift_str)
-
-    # Replace the first x characters of the UUID with time_shift
-    modified_uuid = time_shift_str + original_uuid[time_shift_len:]
-
-    db_message = models.Message(
-        id=modified_uuid,
+    return dict(
+        id=ids.new_id(ids.MESSAGE),
         thread_id=thread_id,
         object="thread.message",
         role=message_inp.role,
         content=[message_content.model_dump()],
-        created_at=int(time.time() * 1000),
+        created_at=created_at,
         attachments=message_inp.attachments if message_inp.attachments else [],
         assistant_id=None,  # Assuming this needs to be set in some other part of your application # noqa
         run_id=None,  # Same as above
@@ -240,14 +366,53 @@ def create_message(
         status='completed',  # TODO: the status should be updated over time
     )
 
+
+def create_message(
+    db: Session,
+    thread_id: str,
+    message_inp: schemas.MessageInput,
+):
+    # Create a new Message object
+    db_message = models.Message(
+        **message_values(thread_id, message_inp, int(time.time()))
+    )
+
     # Add the new message to the session and commit
     db.add(db_message)
     db.commit()
-    db.refresh(db_message)
 
     return db_message
 
 
+def create_messages(
+    db: Session,
+    thread_id: str,
+    message_inps: List[schemas.MessageInput],
+    commit: bool = True,
+) -> List[models.Message]:
+    """
+    Inserts all the messages with a single INSERT ... RETURNING statement.
+    Ids are generated in order so the messages keep the order of the input.
+    """
+    if not message_inps:
+        return []
+    created_at = int(time.time())
+    statement = (
+        insert(models.Message)
+        .values(
+            [
+                message_values(thread_id, message_inp, created_at)
+                for message_inp in message_inps
+            ]
+        )
+        .returning(models.Message)
+    )
+    db_messages = db.scalars(statement).all()
+    if commit:
+        db.commit()
+    return sorted(db_messages, key=lambda db_message: db_message.id)
+
+
 def get_messages(
     db: Session,
     thread_id: str,
@@ -255,41 +420,13 @@ def get_messages(
     order: str,
     after: str,
     before: str,
-):  # TODO: before and after work in a strange way
+    metadata: Optional[dict] = None,
+):
     query = db.query(models.Message).filter(
         models.Message.thread_id == thread_id
     )
-
-    if order == "asc":
-        query = query.order_by(
-            asc(models.Message.created_at), asc(models.Message.id)
-        )
-    else:
-        query = query.order_by(
-            desc(models.Message.created_at), desc(models.Message.id)
-        )
-
-    if after:
-        last_seen_message = (
-            db.query(models.Message).filter(models.Message.id == after).first()
-        )
-        if last_seen_message:
-            query = query.filter(
-                models.Message.created_at >= last_seen_message.created_at
-            )
-
-    if before:
-        first_seen_message = (
-            db.query(models.Message)
-            .filter(models.Message.id == before)
-            .first()
-        )
-        if first_seen_message:
-            query = query.filter(
-                models.Message.created_at <= first_seen_message.created_at
-            )
-
-    return query.limit(limit).all()
+    query = filter_metadata(query, models.Message, metadata)
+    return paginate(query, models.Message, limit, order, after, before)
 
 
 def get_message_by_id(db: Session, thread_id: str, message_id: str):
@@ -306,32 +443,25 @@ def get_message_by_id(db: Session, thread_id: str, message_id: str):
 def update_message(
     db: Session, thread_id: str, message_id: str, message_update: dict
 ):
-    db_message = (
-        db.query(models.Message)
-        .filter(
+    # Allowing updates with falsy values like 0 or False
+    return update_returning(
+        db,
+        models.Message,
+        [
             models.Message.id == message_id,
             models.Message.thread_id == thread_id,
-        )
-        .first()
+        ],
+        update_values(models.Message, message_update, merge_metadata=True),
     )
-    if db_message:
-        for key, value in message_update.items():
-            if (
-                value is not None
-            ):  # Allowing updates with falsy values like 0 or False
-                if key == "metadata":
-                    updated_metadata = {**db_message._metadata, **value}
-                    setattr(db_message, "_metadata", updated_metadata)
-                else:
-                    setattr(db_message, key, value)
-        db.commit()
-        db.refresh(db_message)
-        return db_message
-    return None
 
 
 # RUNS
-def create_run(db: Session, thread_id: str, run_params: schemas.RunContent):
+def create_run(
+    db: Session,
+    thread_id: str,
+    run_params: schemas.RunContent,
+    dispatch: bool = False,
+):
     # Check if the thread exists
     db_thread = get_thread(db, thread_id)
     if not db_thread:
@@ -361,7 +491,7 @@ def create_run(db: Session, thread_id: str, run_params: schemas.RunContent):
 
     # Create the Run instance
     db_run = models.Run(
-        id=str(uuid.uuid4()),
+        id=ids.new_id(ids.RUN),
         thread_id=thread_id,
         assistant_id=run_params.assistant_id,
         created_at=int(time.time()),
@@ -382,32 +512,161 @@ def create_run(db: Session, thread_id: str, run_params: schemas.RunContent):
 
     # Add and commit the new Run to the database
     db.add(db_run)
-    db.commit()
-    db.refresh(db_run)
+    if dispatch:
+        priority, tenant = run_dispatch_class(
+            metadata, db_assistant.id, db_assistant
+        )
+        add_run_dispatch(db, thread_id, db_run.id, priority, tenant)
+    try:
+        db.commit()
+    except IntegrityError:
+        # ix_runs_thread_active, the thread already has an active run
+        db.rollback()
+        active_run = get_active_run(db, thread_id)
+        if active_run is None:
+            raise
+        raise ValueError(
+            f"Thread {thread_id} already has an active run {active_run.id}."
+        )
 
     return db_run
 
 
-def get_run(db: Session, thread_id: str, run_id: str):
+def get_active_run(db: Session, thread_id: str):
     return (
         db.query(models.Run)
-        .filter(models.Run.id == run_id, models.Run.thread_id == thread_id)
+        .filter(
+            models.Run.thread_id == thread_id,
+            models.Run.status.in_(ACTIVE_RUN_STATUSES),
+        )
         .first()
     )
 
 
-def cancel_run(db: Session, thread_id: str, run_id: str):
-    db_run = (
+def get_run(db: Session, thread_id: str, run_id: str):
+    return (
         db.query(models.Run)
         .filter(models.Run.id == run_id, models.Run.thread_id == thread_id)
         .first()
     )
-    if db_run:
-        db_run.status = schemas.RunStatus.CANCELLING.value
-        db.commit()
-        db.refresh(db_run)
-        return db_run
-    return None
+
+
+RUN_STATUS_CHANNEL = "run_status"
+
+
+def notify_run_status(db: Session, run_id: str):
+    """
+    Notifies the requests waiting on a run that its status changed. The
+    notification is only delivered once the transaction commits.
+    """
+    db.execute(select(func.pg_notify(RUN_STATUS_CHANNEL, run_id)))
+
+
+# runs that can be cancelled, the others are already finished
+CANCELLABLE_RUN_STATUSES = [
+    schemas.RunStatus.QUEUED.value,
+    schemas.RunStatus.IN_PROGRESS.value,
+    schemas.RunStatus.REQUIRES_ACTION.value,
+]
+
+
+def cancel_run(db: Session, thread_id: str, run_id: str):
+    """
+    Cancels a run. Runs in progress are cancelling until their worker stops
+    them, queued runs and runs requiring action are not being executed and
+    are cancelled right away. Raises a ValueError for a finished run.
+    """
+    in_progress = models.Run.status == schemas.RunStatus.IN_PROGRESS.value
+    db_run = update_returning(
+        db,
+        models.Run,
+        [
+            models.Run.id == run_id,
+            models.Run.thread_id == thread_id,
+            models.Run.status.in_(CANCELLABLE_RUN_STATUSES),
+        ],
+        {
+            models.Run.status: case(
+                (in_progress, schemas.RunStatus.CANCELLING.value),
+                else_=schemas.RunStatus.CANCELLED.value,
+            ),
+            models.Run.cancelled_at: case(
+                (in_progress, None), else_=int(time.time())
+            ),
+        },
+        commit=False,
+    )
+    if db_run is None:
+        db.rollback()
+        db_run = get_run(db, thread_id, run_id)
+        if db_run is not None:
+            raise ValueError(
+                f"Cannot cancel run with status '{db_run.status}'."
+            )
+        return None
+    if db_run.status == schemas.RunStatus.CANCELLED.value:
+        # not claimed by a worker yet, its dispatch is dropped
+        db.execute(
+            delete(models.RunDispatch).where(
+                models.RunDispatch.run_id == run_id,
+                models.RunDispatch.claimed_by.is_(None),
+            )
+        )
+    notify_run_status(db, run_id)
+    db.commit()
+    return db_run
+
+
+# runs in these statuses are being worked on, a thread has at most one
+ACTIVE_RUN_STATUSES = [
+    schemas.RunStatus.QUEUED.value,
+    schemas.RunStatus.IN_PROGRESS.value,
+    schemas.RunStatus.REQUIRES_ACTION.value,
+    schemas.RunStatus.CANCELLING.value,
+]
+
+# runs not finished by their expires_at are expired by the sweeper, which
+# also catches the runs of workers that died while executing them. Runs
+# still cancelling by then are cancelled instead.
+EXPIRABLE_RUN_STATUSES = [
+    schemas.RunStatus.QUEUED.value,
+    schemas.RunStatus.IN_PROGRESS.value,
+    schemas.RunStatus.REQUIRES_ACTION.value,
+    schemas.RunStatus.CANCELLING.value,
+]
+
+
+def expire_runs(db: Session, now: int) -> List[str]:
+    """
+    Expires every run past its expires_at, or cancels it if it was being
+    cancelled, with a single UPDATE, notifying the requests waiting on them,
+    and returns their IDs.
+    """
+    cancelling = models.Run.status == schemas.RunStatus.CANCELLING.value
+    run_ids = db.scalars(
+        update(models.Run)
+        .where(
+            models.Run.status.in_(EXPIRABLE_RUN_STATUSES),
+            models.Run.expires_at <= now,
+        )
+        .values(
+            status=case(
+                (cancelling, schemas.RunStatus.CANCELLED.value),
+                else_=schemas.RunStatus.EXPIRED.value,
+            ),
+            cancelled_at=case(
+                (cancelling, now), else_=models.Run.cancelled_at
+            ),
+        )
+        .returning(models.Run.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if run_ids:
+        db.execute(
+            select(func.pg_notify(RUN_STATUS_CHANNEL, func.unnest(run_ids)))
+        )
+    db.commit()
+    return run_ids
 
 
 def get_run_steps(
@@ -418,52 +677,36 @@ def get_run_steps(
     order: str,
     after: str = None,
     before: str = None,
-):  # TODO: before and after work in a strange way
+):
     query = db.query(models.RunStep).filter(
         models.RunStep.thread_id == thread_id, models.RunStep.run_id == run_id
     )
-    if order == "asc":
-        query = query.order_by(asc(models.RunStep.created_at))
-    else:
-        query = query.order_by(desc(models.RunStep.created_at))
-    if after:
-        query = query.filter(models.RunStep.id > after)
-    if before:
-        query = query.filter(models.RunStep.id < before)
-    return query.limit(limit).all()
+    return paginate(query, models.RunStep, limit, order, after, before)
 
 
 ###########################################################
 #                        OPS                              #
 ###########################################################
 def update_run(db: Session, thread_id: str, run_id: str, run_update: dict):
-    db_run = (
-        db.query(models.Run)
-        .filter(models.Run.id == run_id, models.Run.thread_id == thread_id)
-        .first()
+    # Allowing updates with falsy values like 0 or False
+    db_run = update_returning(
+        db,
+        models.Run,
+        [models.Run.id == run_id, models.Run.thread_id == thread_id],
+        update_values(models.Run, run_update),
+        commit=False,
     )
-    if db_run:
-        for key, value in run_update.items():
-            if (
-                value is not None
-            ):  # Allowing updates with falsy values like 0 or False
-                if key == "metadata":
-                    setattr(db_run, "_metadata", value)
-                else:
-                    setattr(db_run, key, value)
-
-        db.add(db_run)
-        db.commit()
-        db.refresh(db_run)
-        return db_run
-    return None
+    if db_run is not None and run_update.get("status") is not None:
+        notify_run_status(db, run_id)
+    db.commit()
+    return db_run
 
 
 def create_run_step(
     db: Session, thread_id: str, run_id: str, run_step: schemas.RunStepCreate
 ):
     new_run_step = models.RunStep(
-        id=str(uuid.uuid4()),
+        id=ids.new_id(ids.RUN_STEP),
         assistant_id=run_step.assistant_id,
         step_details=run_step.step_details.model_dump(),
         type=run_step.type,
@@ -476,7 +719,6 @@ def create_run_step(
 
     db.add(new_run_step)
     db.commit()
-    db.refresh(new_run_step)
     return new_run_step
 
 
@@ -487,84 +729,61 @@ def update_run_step(
     step_id: str,
     run_step_update: dict,
 ):
-    db_run_step = (
-        db.query(models.RunStep)
-        .filter(
+    # Allow updates with falsy values like 0 or False
+    return update_returning(
+        db,
+        models.RunStep,
+        [
             models.RunStep.id == step_id,
             models.RunStep.run_id == run_id,
             models.RunStep.thread_id == thread_id,
-        )
-        .first()
+        ],
+        update_values(models.RunStep, run_step_update),
     )
 
-    if db_run_step:
-        for key, value in run_step_update.items():
-            if (
-                value is not None
-            ):  # Allow updates with falsy values like 0 or False
-                # Check if the attribute exists within the model before updating
-                if hasattr(db_run_step, key):
-                    setattr(db_run_step, key, value)
-                elif key == "metadata":  # Special handling for metadata
-                    setattr(db_run_step, "_metadata", value)
-
-        db.add(db_run_step)
-        db.commit()
-        db.refresh(db_run_step)
-        return db_run_step
-
-    return None
-
 
 def create_vector_store(db: Session, vector_store: schemas.VectorStoreCreate):
     # Convert expiration details to JSON if necessary
     expiration_after = (
         vector_store.expires_after if vector_store.expires_after else None
     )
+    vector_store_id = ids.new_id(ids.VECTOR_STORE)
+    added_file_ids = insert_vector_store_files(
+        db, vector_store_id, vector_store.file_ids
+    )
     file_counts = schemas.FileCounts(
         cancelled=0,
         completed=0,
         failed=0,
-        in_progress=len(vector_store.file_ids),
-        total=0,
+        in_progress=len(added_file_ids),
+        total=len(added_file_ids),
     )
 
     # if in FileCounts in progress then status is in_progress else status is completed
     status = "in_progress" if (file_counts.in_progress > 0) else "completed"
 
     db_vector_store = models.VectorStore(
-        id="vs_" + str(uuid.uuid4()),
+        id=vector_store_id,
         name=vector_store.name,
         expires_after=expiration_after,
         file_counts=file_counts.model_dump(),
         status=status,
         usage_bytes=0,
-        _metadata={**vector_store.metadata, "_file_ids": json.dumps([])},
+        _metadata=vector_store.metadata,
         created_at=int(time.time()),
     )
     db.add(db_vector_store)
     db.commit()
-    db.refresh(db_vector_store)
     return db_vector_store
 
 
 def update_vector_store(db: Session, vector_store_id: str, updates: dict):
-    db_vector_store = (
-        db.query(models.VectorStore)
-        .filter(models.VectorStore.id == vector_store_id)
-        .first()
+    return update_returning(
+        db,
+        models.VectorStore,
+        [models.VectorStore.id == vector_store_id],
+        update_values(models.VectorStore, updates),
     )
-    if db_vector_store:
-        for key, value in updates.items():
-            if value:
-                if key == "metadata":
-                    setattr(db_vector_store, "_metadata", value)
-                else:
-                    setattr(db_vector_store, key, value)
-        db.commit()
-        db.refresh(db_vector_store)
-        return db_vector_store
-    return None
 
 
 def get_vector_store(db: Session, vector_store_id: str):
@@ -581,85 +800,224 @@ def get_vector_stores(
     order: str,
     after: Optional[str] = None,
     before: Optional[str] = None,
+    metadata: Optional[dict] = None,
 ):
-    query = db.query(models.VectorStore)
-
-    # Order the query based on the created_at timestamp and ID
-    if order == "asc":
-        query = query.order_by(
-            asc(models.VectorStore.created_at), asc(models.VectorStore.id)
-        )
-    else:
-        query = query.order_by(
-            desc(models.VectorStore.created_at), desc(models.VectorStore.id)
-        )
-
-    # Apply pagination filters
-    if after:
-        # Get the 'after' vector store to determine the pagination start
-        last_seen_store = (
-            db.query(models.VectorStore)
-            .filter(models.VectorStore.id == after)
-            .first()
-        )
-        if last_seen_store:
-            query = query.filter(
-                (models.VectorStore.created_at, models.VectorStore.id)
-                > (last_seen_store.created_at, last_seen_store.id)
-            )
-
-    if before:
-        # Get the 'before' vector store to determine the pagination end
-        first_seen_store = (
-            db.query(models.VectorStore)
-            .filter(models.VectorStore.id == before)
-            .first()
-        )
-        if first_seen_store:
-            query = query.filter(
-                (models.VectorStore.created_at, models.VectorStore.id)
-                < (first_seen_store.created_at, first_seen_store.id)
-            )
-
-    return query.limit(limit).all()
+    query = filter_metadata(
+        db.query(models.VectorStore), models.VectorStore, metadata
+    )
+    return paginate(query, models.VectorStore, limit, order, after, before)
 
 
 def create_file_batch(db: Session, vector_store_id: str, file_ids: List[str]):
+    batch_id = ids.new_id(ids.VECTOR_STORE_FILE_BATCH)
+    added_file_ids = insert_vector_store_files(
+        db, vector_store_id, file_ids, batch_id
+    )
+    if added_file_ids:
+        db.execute(
+            update(models.VectorStore)
+            .where(models.VectorStore.id == vector_store_id)
+            .values(
+                {
+                    models.VectorStore.file_counts: increment_json(
+                        models.VectorStore.file_counts,
+                        {
+                            "in_progress": len(added_file_ids),
+                            "total": len(added_file_ids),
+                        },
+                    ),
+                    models.VectorStore.status: "in_progress",
+                }
+            )
+            .execution_options(synchronize_session=False)
+        )
     file_counts = schemas.FileCounts(
         cancelled=0,
         completed=0,
         failed=0,
-        in_progress=len(file_ids),
-        total=0,
+        in_progress=len(added_file_ids),
+        total=len(added_file_ids),
     )
     new_batch = models.VectorStoreFileBatch(
-        id="vsfb_" + str(uuid.uuid4()),
+        id=batch_id,
         created_at=int(time.time()),
         vector_store_id=vector_store_id,
-        status="in_progress",
+        status="in_progress" if added_file_ids else "completed",
         file_counts=file_counts.model_dump(),
         object="vector_store.files_batch",
     )
     db.add(new_batch)
     db.commit()
-    db.refresh(new_batch)
     return new_batch
 
 
-def update_file_batch(db: Session, file_batch_id: str, updates: dict):
-    db_vector_store = (
+def get_file_batch(db: Session, vector_store_id: str, file_batch_id: str):
+    return (
         db.query(models.VectorStoreFileBatch)
-        .filter(models.VectorStoreFileBatch.id == file_batch_id)
+        .filter(
+            models.VectorStoreFileBatch.id == file_batch_id,
+            models.VectorStoreFileBatch.vector_store_id == vector_store_id,
+        )
         .first()
     )
-    if db_vector_store:
-        for key, value in updates.items():
-            if value:
-                setattr(db_vector_store, key, value)
-        db.commit()
-        db.refresh(db_vector_store)
-        return db_vector_store
-    return None
+
+
+def update_file_batch(db: Session, file_batch_id: str, updates: dict):
+    return update_returning(
+        db,
+        models.VectorStoreFileBatch,
+        [models.VectorStoreFileBatch.id == file_batch_id],
+        update_values(models.VectorStoreFileBatch, updates),
+    )
+
+
+def insert_vector_store_files(
+    db: Session,
+    vector_store_id: str,
+    file_ids: List[str],
+    batch_id: Optional[str] = None,
+) -> List[str]:
+    """
+    Adds files to a vector store as in progress, without committing. Files
+    already in the store are skipped so they are not indexed twice, the ids
+    of the added ones are returned.
+    """
+    file_ids = list(dict.fromkeys(file_ids))
+    if not file_ids:
+        return []
+    created_at = int(time.time())
+    statement = (
+        insert(models.VectorStoreFile)
+        .values(
+            [
+                {
+                    "vector_store_id": vector_store_id,
+                    "id": file_id,
+                    "batch_id": batch_id,
+                    "created_at": created_at,
+                    "status": "in_progress",
+                    "usage_bytes": 0,
+                }
+                for file_id in file_ids
+            ]
+        )
+        .on_conflict_do_nothing()
+        .returning(models.VectorStoreFile.id)
+    )
+    return list(db.scalars(statement).all())
+
+
+def get_vector_store_file_ids(
+    db: Session,
+    vector_store_id: str,
+    batch_id: Optional[str] = None,
+    status: Optional[str] = None,
+) -> List[str]:
+    query = db.query(models.VectorStoreFile.id).filter(
+        models.VectorStoreFile.vector_store_id == vector_store_id,
+        models.VectorStoreFile.batch_id == batch_id,
+    )
+    if status:
+        query = query.filter(models.VectorStoreFile.status == status)
+    return [row.id for row in query.order_by(models.VectorStoreFile.id)]
+
+
+def get_vector_store_files(
+    db: Session,
+    vector_store_id: str,
+    limit: int,
+    order: str,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    query = db.query(models.VectorStoreFile).filter(
+        models.VectorStoreFile.vector_store_id == vector_store_id
+    )
+    if batch_id:
+        query = query.filter(models.VectorStoreFile.batch_id == batch_id)
+    if status:
+        query = query.filter(models.VectorStoreFile.status == status)
+    return paginate(query, models.VectorStoreFile, limit, order, after, before)
+
+
+def get_vector_store_file(db: Session, vector_store_id: str, file_id: str):
+    return (
+        db.query(models.VectorStoreFile)
+        .filter(
+            models.VectorStoreFile.vector_store_id == vector_store_id,
+            models.VectorStoreFile.id == file_id,
+        )
+        .first()
+    )
+
+
+def file_counts_values(model, status: str) -> dict:
+    """
+    Moves one file from in progress to `status` in the file counts of a
+    vector store or batch, completing it with its last file.
+    """
+    in_progress = model.file_counts["in_progress"].as_integer()
+    return {
+        model.file_counts: increment_json(
+            model.file_counts, {"in_progress": -1, status: 1}
+        ),
+        model.status: cast(
+            case((in_progress > 1, "in_progress"), else_="completed"),
+            model.status.type,
+        ),
+    }
+
+
+def finish_vector_store_file(
+    db: Session,
+    vector_store_id: str,
+    file_id: str,
+    status: str,
+    usage_bytes: int = 0,
+    last_error: Optional[dict] = None,
+) -> bool:
+    """
+    Records the outcome of indexing a file and updates the counts of its
+    vector store and batch in the same transaction. Counts are incremented
+    in SQL so that concurrent batches on a store do not overwrite each
+    other. Returns False if the file was no longer in progress.
+    """
+    db_file = db.execute(
+        update(models.VectorStoreFile)
+        .where(
+            models.VectorStoreFile.vector_store_id == vector_store_id,
+            models.VectorStoreFile.id == file_id,
+            models.VectorStoreFile.status == "in_progress",
+        )
+        .values(status=status, usage_bytes=usage_bytes, last_error=last_error)
+        .returning(models.VectorStoreFile.batch_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if db_file is None:
+        db.rollback()
+        return False
+
+    values = file_counts_values(models.VectorStore, status)
+    values[models.VectorStore.usage_bytes] = (
+        models.VectorStore.usage_bytes + usage_bytes
+    )
+    db.execute(
+        update(models.VectorStore)
+        .where(models.VectorStore.id == vector_store_id)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    if db_file.batch_id:
+        db.execute(
+            update(models.VectorStoreFileBatch)
+            .where(models.VectorStoreFileBatch.id == db_file.batch_id)
+            .values(file_counts_values(models.VectorStoreFileBatch, status))
+            .execution_options(synchronize_session=False)
+        )
+    db.commit()
+    return True
 
 
 def submit_tool_outputs(
@@ -667,6 +1025,7 @@ def submit_tool_outputs(
     thread_id: str,
     run_id: str,
     tool_outputs: List[schemas.ToolOutput],
+    dispatch: bool = False,
 ):
     run = (
         db.query(models.Run)
@@ -691,17 +1050,11 @@ def submit_tool_outputs(
             f"Expected tool outputs for call_ids {list(required_tool_calls)}, got {list(provided_tool_calls)}"  # noqa
         )
 
-    # Update run status
-    run.status = 'queued'
-    run.required_action = None
-    db.commit()
-    db.refresh(run)
-
     # Find the latest run step
     run_step = (
         db.query(models.RunStep)
         .filter(models.RunStep.run_id == run_id)
-        .order_by(models.RunStep.created_at.desc())
+        .order_by(models.RunStep.id.desc())
         .first()
     )
     if not run_step:
@@ -737,7 +1090,433 @@ def submit_tool_outputs(
     run_step.step_details['tool_calls'] = [*new_tool_calls]
 
     flag_modified(run_step, 'step_details')  # Mark step_details as modified
+
+    # Update run status, in the same transaction as the step
+    run.status = 'queued'
+    run.required_action = None
+    notify_run_status(db, run_id)
+    if dispatch:
+        priority, tenant = run_dispatch_class(
+            run._metadata,
+            run.assistant_id,
+            get_assistant_by_id(db, run.assistant_id),
+        )
+        add_run_dispatch(db, thread_id, run_id, priority, tenant)
     db.commit()
-    db.refresh(run_step)
 
     return run
+
+
+# RUN DISPATCHES
+def run_dispatch_class(
+    metadata: Optional[dict], assistant_id: str, db_assistant
+) -> tuple:
+    """
+    Priority and tenant of a run, from the "priority" and "tenant" keys of
+    its metadata or else of its assistant's. Runs are interactive unless
+    marked "batch", and runs without a tenant are grouped by assistant.
+    """
+    sources = [metadata or {}]
+    if db_assistant is not None:
+        sources.append(db_assistant._metadata or {})
+    priorities = [priority.value for priority in schemas.RunPriority]
+    priority = next(
+        (
+            source["priority"]
+            for source in sources
+            if source.get("priority") in priorities
+        ),
+        schemas.RunPriority.INTERACTIVE.value,
+    )
+    tenant = next(
+        (str(source["tenant"]) for source in sources if source.get("tenant")),
+        assistant_id,
+    )
+    return priority, tenant
+
+
+def add_run_dispatch(
+    db: Session,
+    thread_id: str,
+    run_id: str,
+    priority: str = schemas.RunPriority.INTERACTIVE.value,
+    tenant: str = "",
+):
+    """
+    Adds the dispatch of a run to the session, it is committed with the run
+    so a run is never dispatched without being saved, or the reverse. The
+    table is the outbox relayed to RabbitMQ, or the queue workers claim from
+    when RUN_DISPATCH is "postgres".
+    """
+    now = int(time.time())
+    db.add(
+        models.RunDispatch(
+            run_id=run_id,
+            thread_id=thread_id,
+            priority=priority,
+            tenant=tenant,
+            created_at=now,
+            visible_at=now,
+            attempts=0,
+        )
+    )
+
+
+def fair_order(dispatches: List[models.RunDispatch]):
+    """Sorts dispatches taking turns between tenants, oldest first."""
+    turns = {}
+    ranked = []
+    for dispatch in sorted(dispatches, key=lambda dispatch: dispatch.id):
+        turns[dispatch.tenant] = turns.get(dispatch.tenant, 0) + 1
+        ranked.append((turns[dispatch.tenant], dispatch.id, dispatch))
+    return [dispatch for _, _, dispatch in sorted(ranked)]
+
+
+# dispatches considered on top of the claimed ones, so claims racing for the
+# same dispatches skip to the next ones instead of coming back empty
+CLAIM_HEADROOM = 32
+
+
+def claim_run_dispatches(
+    db: Session,
+    worker: str,
+    limit: int,
+    lease: int,
+    priority: Optional[str] = None,
+) -> List[models.RunDispatch]:
+    """
+    Claims up to `limit` visible dispatches of `priority` for `worker`, or
+    of any priority, interactive first, and hides them for `lease` seconds.
+    Tenants take turns: the oldest dispatch of each tenant is claimed first,
+    then their second oldest and so on, so a tenant with a large backlog
+    does not hold up the others. Dispatches locked by concurrent claims are
+    skipped, so workers never wait on each other and never claim the same
+    dispatch. Dispatches not acked within their lease are claimed again.
+    """
+    if priority is None:
+        dispatches = []
+        for run_priority in schemas.RunPriority:
+            if len(dispatches) < limit:
+                dispatches += claim_run_dispatches(
+                    db,
+                    worker,
+                    limit - len(dispatches),
+                    lease,
+                    run_priority.value,
+                )
+        return dispatches
+
+    now = int(time.time())
+    dispatch = models.RunDispatch
+    # the tenants with dispatches, one index lookup each (skip scan)
+    first_tenant = (
+        select(dispatch.tenant)
+        .where(dispatch.priority == priority)
+        .order_by(dispatch.tenant)
+        .limit(1)
+        .subquery()
+    )
+    tenants = select(first_tenant.c.tenant).cte("tenants", recursive=True)
+    next_tenant = (
+        select(dispatch.tenant)
+        .where(
+            dispatch.priority == priority, dispatch.tenant > tenants.c.tenant
+        )
+        .order_by(dispatch.tenant)
+        .limit(1)
+        .scalar_subquery()
+    )
+    tenants = tenants.union_all(
+        select(next_tenant).where(tenants.c.tenant.isnot(None))
+    )
+    # the oldest visible dispatches of each tenant, numbered by their turn
+    heads = (
+        select(
+            dispatch.id,
+            func.row_number().over(order_by=dispatch.id).label("turn"),
+        )
+        .where(
+            dispatch.priority == priority,
+            dispatch.tenant == tenants.c.tenant,
+            dispatch.visible_at <= now,
+        )
+        .order_by(dispatch.id)
+        .limit(limit + CLAIM_HEADROOM)
+        .lateral("heads")
+    )
+    candidates = (
+        select(heads.c.id, heads.c.turn)
+        .select_from(tenants)
+        .join(heads, true())
+        .order_by(heads.c.turn, heads.c.id)
+        .limit(limit + CLAIM_HEADROOM)
+        .subquery()
+    )
+    claimable = (
+        select(dispatch.id)
+        .join(candidates, candidates.c.id == dispatch.id)
+        # checked again on the locked rows, in case a concurrent claim
+        # committed in between
+        .where(dispatch.visible_at <= now)
+        .order_by(candidates.c.turn, dispatch.id)
+        .limit(limit)
+        .with_for_update(of=dispatch, skip_locked=True)
+    )
+    statement = (
+        update(dispatch)
+        .where(dispatch.id.in_(claimable))
+        .values(claimed_by=worker, visible_at=now + lease)
+        .returning(dispatch)
+        .execution_options(synchronize_session=False)
+    )
+    dispatches = db.scalars(statement).all()
+    db.commit()
+    return fair_order(dispatches)
+
+
+def get_run_dispatch_stats(db: Session) -> List[schemas.RunQueueStats]:
+    """Dispatches waiting in Postgres, per priority."""
+    now = int(time.time())
+    visible = models.RunDispatch.visible_at <= now
+    rows = db.execute(
+        select(
+            models.RunDispatch.priority,
+            func.count().filter(visible),
+            func.count().filter(
+                ~visible, models.RunDispatch.claimed_by.is_(None)
+            ),
+            func.count().filter(
+                ~visible, models.RunDispatch.claimed_by.isnot(None)
+            ),
+            func.count(models.RunDispatch.tenant.distinct()),
+            func.min(models.RunDispatch.created_at).filter(visible),
+        ).group_by(models.RunDispatch.priority)
+    ).all()
+    stats = {
+        priority: schemas.RunQueueStats(
+            priority=priority,
+            pending=pending,
+            delayed=delayed,
+            claimed=claimed,
+            tenants=tenants,
+            oldest_pending_age=None if oldest is None else now - oldest,
+        )
+        for priority, pending, delayed, claimed, tenants, oldest in rows
+    }
+    return [
+        stats.get(
+            priority.value, schemas.RunQueueStats(priority=priority.value)
+        )
+        for priority in schemas.RunPriority
+    ]
+
+
+def ack_run_dispatches(
+    db: Session, dispatch_ids: List[int], worker: str
+) -> int:
+    """
+    Deletes the dispatches executed or relayed by `worker`, skipping those
+    whose claim it lost. Returns the number deleted.
+    """
+    result = db.execute(
+        delete(models.RunDispatch).where(
+            models.RunDispatch.id.in_(dispatch_ids),
+            models.RunDispatch.claimed_by == worker,
+        )
+    )
+    db.commit()
+    return result.rowcount
+
+
+def nack_run_dispatches(
+    db: Session,
+    dispatch_ids: List[int],
+    worker: str,
+    delay: int,
+    failed: bool = False,
+) -> int:
+    """
+    Gives up the claims of `worker`, visible again after `delay` seconds.
+    Runs that `failed` are counted in their dispatch's attempts.
+    """
+    values = {
+        models.RunDispatch.claimed_by: None,
+        models.RunDispatch.visible_at: int(time.time()) + delay,
+    }
+    if failed:
+        values[models.RunDispatch.attempts] = models.RunDispatch.attempts + 1
+    result = db.execute(
+        update(models.RunDispatch)
+        .where(
+            models.RunDispatch.id.in_(dispatch_ids),
+            models.RunDispatch.claimed_by == worker,
+        )
+        .values(values)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def get_web_page(db: Session, url: str) -> Optional[schemas.WebPageState]:
+    db_web_page = (
+        db.query(models.WebPage).filter(models.WebPage.url == url).first()
+    )
+    if not db_web_page:
+        return None
+    return schemas.WebPageState(
+        url=db_web_page.url,
+        etag=db_web_page.etag,
+        last_modified=db_web_page.last_modified,
+        content_hash=db_web_page.content_hash,
+        links=db_web_page.links or [],
+    )
+
+
+def upsert_web_page(db: Session, web_page: schemas.WebPageState):
+    values = {**web_page.model_dump(), "crawled_at": int(time.time())}
+    statement = insert(models.WebPage).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[models.WebPage.url], set_=values
+    )
+    db.execute(statement)
+    db.commit()
+
+
+def delete_web_pages(db: Session):
+    db.query(models.WebPage).delete()
+    db.commit()
+
+
+def create_crawl_job(
+    db: Session, data: schemas.WebRetrievalCreate, max_pages: int
+):
+    now = int(time.time())
+    db_crawl_job = models.CrawlJob(
+        id=ids.new_id(ids.CRAWL_JOB),
+        created_at=now,
+        heartbeat_at=now,
+        status="queued",
+        root_urls=data.root_urls,
+        constrain_to_root_domain=data.constrain_to_root_domain,
+        max_depth=data.max_depth,
+        max_pages=max_pages,
+        description=data.description,
+        pages_crawled=0,
+        pages_failed=0,
+    )
+    db.add(db_crawl_job)
+    db.commit()
+    return db_crawl_job
+
+
+def get_crawl_job(db: Session, job_id: str):
+    return (
+        db.query(models.CrawlJob).filter(models.CrawlJob.id == job_id).first()
+    )
+
+
+def update_crawl_job(
+    db: Session,
+    job_id: str,
+    updates: dict,
+    from_statuses: Optional[List[str]] = None,
+):
+    """
+    Updates a crawl job, if from_statuses is given only while the job is in
+    one of them so that concurrent cancellations and completions do not
+    overwrite each other.
+    """
+    filters = [models.CrawlJob.id == job_id]
+    if from_statuses:
+        filters.append(models.CrawlJob.status.in_(from_statuses))
+    db_crawl_job = update_returning(db, models.CrawlJob, filters, updates)
+    # the job is returned as is when it was not in from_statuses
+    return db_crawl_job or get_crawl_job(db, job_id)
+
+
+ACTIVE_CRAWL_JOB_STATUSES = ["queued", "in_progress"]
+
+
+def heartbeat_crawl_jobs(db: Session, job_ids: List[str], now: int):
+    """Renews the heartbeat of the active jobs run by this process."""
+    if job_ids:
+        db.execute(
+            update(models.CrawlJob)
+            .where(
+                models.CrawlJob.id.in_(job_ids),
+                models.CrawlJob.status.in_(ACTIVE_CRAWL_JOB_STATUSES),
+            )
+            .values(heartbeat_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+
+def fail_orphaned_crawl_jobs(
+    db: Session, now: int, stale_before: int
+) -> List[str]:
+    """
+    Fails the active jobs whose heartbeat is older than `stale_before`, left
+    behind by a process that died or restarted, and returns their IDs.
+    """
+    job_ids = db.scalars(
+        update(models.CrawlJob)
+        .where(
+            models.CrawlJob.status.in_(ACTIVE_CRAWL_JOB_STATUSES),
+            func.coalesce(
+                models.CrawlJob.heartbeat_at, models.CrawlJob.created_at
+            )
+            < stale_before,
+        )
+        .values(
+            status="failed",
+            failed_at=now,
+            last_error="The crawl job was interrupted",
+        )
+        .returning(models.CrawlJob.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return job_ids
+
+
+def add_crawl_pages(
+    db: Session, job_id: str, crawl_infos: List[schemas.CrawlInfo]
+):
+    crawled_at = int(time.time())
+    db.execute(
+        insert(models.CrawlPage),
+        [
+            {
+                "job_id": job_id,
+                "url": crawl_info.url,
+                "depth": crawl_info.depth,
+                "error": crawl_info.error,
+                "crawled_at": crawled_at,
+            }
+            for crawl_info in crawl_infos
+        ],
+    )
+    failed = sum(1 for crawl_info in crawl_infos if crawl_info.error)
+    return update_returning(
+        db,
+        models.CrawlJob,
+        [models.CrawlJob.id == job_id],
+        {
+            models.CrawlJob.pages_crawled: models.CrawlJob.pages_crawled
+            + len(crawl_infos),
+            models.CrawlJob.pages_failed: models.CrawlJob.pages_failed
+            + failed,
+        },
+    )
+
+
+def get_crawl_pages(
+    db: Session, job_id: str, limit: int, after: Optional[int] = None
+):
+    query = db.query(models.CrawlPage).filter(
+        models.CrawlPage.job_id == job_id
+    )
+    if after is not None:
+        query = query.filter(models.CrawlPage.id > after)
+    return query.order_by(asc(models.CrawlPage.id)).limit(limit).all()
@@ -1,5 +1,7 @@
+from contextvars import ContextVar
+from typing import Optional
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -15,11 +17,33 @@ databse_url = (
 )
 
 engine = create_engine(databse_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# writes return their rows (INSERT/UPDATE ... RETURNING), so objects do not
+# have to be reloaded after a commit
+SessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine
+)
 
 Base = declarative_base()
 
 
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+
+# set per request to count the SQL statements it runs
+statement_counter: ContextVar[Optional[StatementCounter]] = ContextVar(
+    "statement_counter", default=None
+)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, many):
+    counter = statement_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+
 # Dependency
 def get_db():
     db = SessionLocal()
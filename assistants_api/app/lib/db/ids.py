@@ -0,0 +1,60 @@
+import secrets
+import threading
+import time
+import uuid
+
+_COUNTER_BITS = 74  # rand_a (12 bits) and rand_b (62 bits) of a UUIDv7
+_COUNTER_MAX = (1 << _COUNTER_BITS) - 1
+
+ASSISTANT = "asst_"
+THREAD = "thread_"
+MESSAGE = "msg_"
+RUN = "run_"
+RUN_STEP = "step_"
+FILE = "file-"
+VECTOR_STORE = "vs_"
+VECTOR_STORE_FILE_BATCH = "vsfb_"
+CRAWL_JOB = "crawl_"
+
+_lock = threading.Lock()
+_last_ms = 0
+_last_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Time ordered UUID (RFC 9562 version 7). Within the same millisecond the
+    random part is incremented instead of redrawn, so ids generated by this
+    process are strictly increasing and sort like their creation order.
+    """
+    global _last_ms, _last_counter
+
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            # leave headroom in the counter for ids in the same millisecond
+            counter = secrets.randbits(_COUNTER_BITS - 1)
+        else:
+            ms = _last_ms
+            counter = _last_counter + 1
+            if counter > _COUNTER_MAX:
+                ms += 1
+                counter = secrets.randbits(_COUNTER_BITS - 1)
+        _last_ms, _last_counter = ms, counter
+
+    value = (
+        (ms & 0xFFFFFFFFFFFF) << 80
+        | 0x7 << 76  # version
+        | (counter >> 62) << 64
+        | 0b10 << 62  # variant
+        | counter & 0x3FFFFFFFFFFFFFFF
+    )
+    return uuid.UUID(int=value)
+
+
+def new_id(prefix: str) -> str:
+    """
+    Prefixed id that sorts in creation order, so a primary key index alone
+    orders rows by time and inserts land at the end of the b-tree.
+    """
+    return prefix + uuid7().hex
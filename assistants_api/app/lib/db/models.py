@@ -1,20 +1,33 @@
 from sqlalchemy import (
     ARRAY,
     BigInteger,
+    Boolean,
     Column,
     Float,
     ForeignKey,
+    Index,
     String,
     Integer,
     JSON,
     Enum,
+    text,
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from .database import Base
 
 
 class Assistant(Base):
     __tablename__ = "assistants"
+    __table_args__ = (
+        # metadata filters of the list endpoints (containment, @>)
+        Index(
+            "ix_assistants_metadata",
+            "metadata",
+            postgresql_using="gin",
+            postgresql_ops={"metadata": "jsonb_path_ops"},
+        ),
+    )
 
     id = Column(String, primary_key=True)
     object = Column(String, nullable=False, default="assistant")
@@ -23,8 +36,8 @@ class Assistant(Base):
     description = Column(String(512))
     model = Column(String(256), nullable=False)
     instructions = Column(String(32768), default="")
-    tools = Column(JSON)
-    _metadata = Column("metadata", JSON, nullable=True)
+    tools = Column(JSONB)
+    _metadata = Column("metadata", JSONB, nullable=True)
     response_format = Column(
         String(256)
     )  # Assuming simple string to represent the format
@@ -73,21 +86,36 @@ class File(Base):
 
 class Thread(Base):
     __tablename__ = "threads"
+    __table_args__ = (
+        # metadata filters of the list endpoints (containment, @>)
+        Index(
+            "ix_threads_metadata",
+            "metadata",
+            postgresql_using="gin",
+            postgresql_ops={"metadata": "jsonb_path_ops"},
+        ),
+    )
 
     id = Column(String, primary_key=True, index=True)
     created_at = Column(Integer, nullable=False)
     object = Column(String, nullable=False, default="thread")
-    _metadata = Column("metadata", JSON, nullable=True)
+    _metadata = Column("metadata", JSONB, nullable=True)
+    # lease of the worker executing a run of the thread, not part of the API
+    # object
+    locked_by = Column(String, nullable=True)
+    lease_until = Column(Integer, nullable=True)
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # keyset pagination of a thread's messages
+        Index("ix_messages_thread_page", "thread_id", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True)
     object = Column(String, nullable=False, default="thread.message")
-    created_at = Column(
-        BigInteger, nullable=False
-    )  # BigInteger to ensure no repreating timestamps
+    created_at = Column(BigInteger, nullable=False)
     thread_id = Column(String, ForeignKey('threads.id'))
     role = Column(Enum('user', 'assistant', name='role_types'), nullable=False)
     content = Column(
@@ -96,7 +124,7 @@ class Message(Base):
     attachments = Column(JSON, nullable=True)
     assistant_id = Column(String, nullable=True)
     run_id = Column(String, nullable=True)
-    _metadata = Column("metadata", JSON, nullable=True)
+    _metadata = Column("metadata", JSONB, nullable=True)
     status = Column(
         Enum('in_progress', 'incomplete', 'completed', name='status_types'),
         nullable=False,
@@ -110,12 +138,33 @@ class Message(Base):
 
 
 Thread.messages = relationship(
-    "Message", order_by=Message.created_at, back_populates="thread"
+    "Message", order_by=Message.id, back_populates="thread"
 )
 
 
 class Run(Base):
     __tablename__ = 'runs'
+    __table_args__ = (
+        # expiry sweep, over the runs that are not finished yet
+        Index(
+            "ix_runs_expires_at_unfinished",
+            "expires_at",
+            postgresql_where=text(
+                "status IN "
+                "('queued', 'in_progress', 'requires_action', 'cancelling')"
+            ),
+        ),
+        # a thread has at most one active run
+        Index(
+            "ix_runs_thread_active",
+            "thread_id",
+            unique=True,
+            postgresql_where=text(
+                "status IN "
+                "('queued', 'in_progress', 'requires_action', 'cancelling')"
+            ),
+        ),
+    )
 
     id = Column(String, primary_key=True, index=True)
     assistant_id = Column(String, index=False)
@@ -132,7 +181,7 @@ class Run(Base):
     max_completion_tokens = Column(Integer, nullable=True)  # Added field
     max_prompt_tokens = Column(Integer, nullable=True)  # Added field
     _metadata = Column(
-        "metadata", JSON, nullable=True
+        "metadata", JSONB, nullable=True
     )  # Renamed _metadata to metadata
     model = Column(String, nullable=False)
     object = Column(String, nullable=False, default="thread.run")
@@ -143,7 +192,7 @@ class Run(Base):
     thread_id = Column(String, ForeignKey('threads.id'))
     tool_choice = Column(JSON, nullable=True)  # Added field
     tools = Column(
-        JSON, nullable=True, default=[]
+        JSONB, nullable=True, default=[]
     )  # Modified default to match list in Pydantic schema
     truncation_strategy = Column(JSON, nullable=True)  # Added field
     usage = Column(JSON, nullable=True)
@@ -153,13 +202,43 @@ class Run(Base):
     thread = relationship("Thread", back_populates="runs")
 
 
-Thread.runs = relationship(
-    "Run", order_by=Run.created_at, back_populates="thread"
-)
+Thread.runs = relationship("Run", order_by=Run.id, back_populates="thread")
+
+
+class RunDispatch(Base):
+    """
+    A run waiting for a worker, when runs are dispatched through Postgres
+    instead of RabbitMQ. Inserted with the run, claimed by workers and
+    deleted once executed.
+    """
+
+    __tablename__ = "run_dispatches"
+    __table_args__ = (
+        # claims, the tenants of a priority and their oldest dispatches
+        Index("ix_run_dispatches_tenant", "priority", "tenant", "id"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    run_id = Column(String, nullable=False)
+    thread_id = Column(String, nullable=False)
+    priority = Column(String, nullable=False, default="interactive")
+    # claims take turns between tenants
+    tenant = Column(String, nullable=False)
+    created_at = Column(Integer, nullable=False)
+    # the dispatch can be claimed from then on, claims push it forward by
+    # their lease so unacked dispatches are claimed again
+    visible_at = Column(Integer, nullable=False)
+    claimed_by = Column(String, nullable=True)
+    # failed executions, the run is retried until the worker gives up
+    attempts = Column(Integer, nullable=False, default=0)
 
 
 class RunStep(Base):
     __tablename__ = "run_steps"
+    __table_args__ = (
+        # keyset pagination of a run's steps
+        Index("ix_run_steps_run_page", "run_id", "id"),
+    )
 
     id = Column(String, primary_key=True, index=True)
     assistant_id = Column(String, ForeignKey('assistants.id'))
@@ -169,7 +248,7 @@ class RunStep(Base):
     expired_at = Column(Integer, nullable=True)
     failed_at = Column(Integer, nullable=True)
     last_error = Column(JSON, nullable=True)
-    _metadata = Column("metadata", JSON, nullable=True)
+    _metadata = Column("metadata", JSONB, nullable=True)
     object = Column(String, nullable=False, default="thread.run.step")
     run_id = Column(String, ForeignKey('runs.id'))
     status = Column(
@@ -184,7 +263,7 @@ class RunStep(Base):
         nullable=False,
     )
     step_details = Column(
-        JSON, nullable=False
+        JSONB, nullable=False
     )  # To store details refer to https://github.com/OpenGPTs-platform/assistants-api/issues/12 # noqa
     thread_id = Column(String, ForeignKey('threads.id'))
     type = Column(
@@ -199,17 +278,26 @@ class RunStep(Base):
 
 
 Thread.run_steps = relationship(
-    "RunStep", order_by=RunStep.created_at, back_populates="thread"
+    "RunStep", order_by=RunStep.id, back_populates="thread"
 )
 
 
 class VectorStore(Base):
     __tablename__ = 'vector_stores'
+    __table_args__ = (
+        # metadata filters of the list endpoints (containment, @>)
+        Index(
+            "ix_vector_stores_metadata",
+            "metadata",
+            postgresql_using="gin",
+            postgresql_ops={"metadata": "jsonb_path_ops"},
+        ),
+    )
 
     id = Column(String, primary_key=True, index=True)
     created_at = Column(Integer, nullable=False)
     last_active_at = Column(Integer, nullable=True)
-    _metadata = Column("metadata", JSON, nullable=True)
+    _metadata = Column("metadata", JSONB, nullable=True)
     name = Column(String(256), nullable=False)
     object = Column(String, nullable=False, default="vector_store")
     status = Column(
@@ -222,7 +310,7 @@ class VectorStore(Base):
         nullable=False,
     )
     usage_bytes = Column(Integer, nullable=False)
-    file_counts = Column(JSON, nullable=False)
+    file_counts = Column(JSONB, nullable=False)
     expires_after = Column(JSON, nullable=True)
     expires_at = Column(Integer, nullable=True)
 
@@ -244,4 +332,89 @@ class VectorStoreFileBatch(Base):
         ),
         default="in_progress",
     )
-    file_counts = Column(JSON, nullable=False)
+    file_counts = Column(JSONB, nullable=False)
+
+
+class VectorStoreFile(Base):
+    __tablename__ = "vector_store_files"
+
+    # listing the files of a store is a primary key range scan
+    vector_store_id = Column(String, primary_key=True)
+    id = Column(String, primary_key=True)  # id of the file
+    batch_id = Column(String, index=True, nullable=True)
+    object = Column(String, nullable=False, default="vector_store.file")
+    created_at = Column(Integer, nullable=False)
+    status = Column(
+        Enum(
+            "in_progress",
+            "completed",
+            "cancelled",
+            "failed",
+            name="vector_store_file_status",
+        ),
+        nullable=False,
+        default="in_progress",
+    )
+    usage_bytes = Column(Integer, nullable=False, default=0)
+    last_error = Column(JSON, nullable=True)
+
+
+class WebPage(Base):
+    __tablename__ = "web_pages"
+
+    url = Column(String, primary_key=True)
+    etag = Column(String, nullable=True)
+    last_modified = Column(String, nullable=True)
+    content_hash = Column(String(64), nullable=True)
+    links = Column(JSON, nullable=True)
+    crawled_at = Column(Integer, nullable=False)
+
+
+class CrawlJob(Base):
+    __tablename__ = "crawl_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    object = Column(String, nullable=False, default="crawl_job")
+    created_at = Column(Integer, nullable=False)
+    status = Column(
+        Enum(
+            "queued",
+            "in_progress",
+            "completed",
+            "cancelled",
+            "failed",
+            name="crawl_job_status",
+        ),
+        nullable=False,
+        default="queued",
+    )
+    root_urls = Column(JSON, nullable=False)
+    constrain_to_root_domain = Column(Boolean, nullable=False)
+    max_depth = Column(Integer, nullable=True)
+    max_pages = Column(Integer, nullable=False)
+    description = Column(String, nullable=True)
+    pages_crawled = Column(Integer, nullable=False, default=0)
+    pages_failed = Column(Integer, nullable=False, default=0)
+    started_at = Column(Integer, nullable=True)
+    completed_at = Column(Integer, nullable=True)
+    cancelled_at = Column(Integer, nullable=True)
+    failed_at = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
+    # renewed by the process running the job, not part of the API object
+    heartbeat_at = Column(Integer, nullable=True)
+
+
+class CrawlPage(Base):
+    __tablename__ = "crawl_pages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(
+        String,
+        ForeignKey("crawl_jobs.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    url = Column(String, nullable=False)
+    depth = Column(Integer, nullable=False)
+    error = Column(String, nullable=True)
+    crawled_at = Column(Integer, nullable=False)
@@ -0,0 +1,187 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+import asyncio
+import logging
+import os
+import time
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from . import crud, database, models, schemas
+
+# runs in these statuses are still being worked on, waiting requests return
+# as soon as a run leaves them
+ACTIVE_STATUSES = {
+    schemas.RunStatus.QUEUED.value,
+    schemas.RunStatus.IN_PROGRESS.value,
+    schemas.RunStatus.CANCELLING.value,
+}
+# waiting runs are re-read at least this often, in case a notification was
+# missed while the listener reconnected
+RECHECK_SECONDS = 5.0
+SWEEP_INTERVAL_SECONDS = float(os.getenv("RUN_SWEEP_INTERVAL_SECONDS", 60))
+LISTEN_CONNECT_TIMEOUT_SECONDS = 5
+MAX_LISTEN_BACKOFF_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+
+class RunStatusListener:
+    """
+    LISTENs for the run status notifications sent by crud on a dedicated
+    connection, read by the event loop, and wakes up the requests waiting on
+    the notified runs. The connection is opened off the event loop when the
+    app starts and reopened when lost; meanwhile waiting requests fall back
+    to re-reading their run every RECHECK_SECONDS.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.disconnected: Optional[asyncio.Event] = None
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    @staticmethod
+    def connect():
+        connection = psycopg2.connect(
+            database.databse_url,
+            connect_timeout=LISTEN_CONNECT_TIMEOUT_SECONDS,
+        )
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {crud.RUN_STATUS_CHANNEL}")
+        except psycopg2.Error:
+            connection.close()
+            raise
+        return connection
+
+    async def run(self):
+        """Keeps the listener connected for the lifetime of the app."""
+        self.loop = asyncio.get_running_loop()
+        self.disconnected = asyncio.Event()
+        backoff = 0
+        while True:
+            try:
+                connection = await run_in_threadpool(self.connect)
+            except psycopg2.Error as e:
+                backoff = min(max(backoff * 2, 1), MAX_LISTEN_BACKOFF_SECONDS)
+                logger.error(
+                    "Error listening for run status notifications, "
+                    "retrying in %ss: %s",
+                    backoff,
+                    e,
+                )
+                await asyncio.sleep(backoff)
+                continue
+            backoff = 0
+            self.connection = connection
+            self.disconnected.clear()
+            self.loop.add_reader(connection, self.read_notifications)
+            try:
+                await self.disconnected.wait()
+            finally:
+                self.stop()
+
+    def stop(self):
+        if self.connection is None:
+            return
+        if not self.loop.is_closed():
+            self.loop.remove_reader(self.connection)
+        self.connection.close()
+        self.connection = None
+        self.disconnected.set()
+
+    def read_notifications(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error as e:
+            logger.error("Run status listener disconnected: %s", e)
+            self.stop()
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            for event in self.waiters.get(notify.payload, ()):
+                event.set()
+
+    @contextmanager
+    def subscribe(self, run_id: str) -> Iterator[asyncio.Event]:
+        """Event set whenever the status of the run is notified."""
+        event = asyncio.Event()
+        self.waiters.setdefault(run_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            waiters = self.waiters[run_id]
+            waiters.discard(event)
+            if not waiters:
+                del self.waiters[run_id]
+
+
+run_status_listener = RunStatusListener()
+
+
+async def wait_for_run(
+    db: Session, thread_id: str, run_id: str, timeout: float
+) -> Optional[models.Run]:
+    """
+    Returns the run once it leaves the active statuses, or as it is after
+    `timeout` seconds. The run is re-read when its status is notified, or
+    every RECHECK_SECONDS, and the database connection is released in
+    between.
+    """
+
+    def read_run() -> Optional[models.Run]:
+        try:
+            return crud.get_run(db, thread_id, run_id)
+        finally:
+            # releases the connection while waiting; the run is detached, so
+            # it is loaded again on the next read
+            db.close()
+
+    if timeout <= 0:
+        return await run_in_threadpool(read_run)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    with run_status_listener.subscribe(run_id) as notified:
+        while True:
+            notified.clear()
+            db_run = await run_in_threadpool(read_run)
+            remaining = deadline - loop.time()
+            if (
+                db_run is None
+                or db_run.status not in ACTIVE_STATUSES
+                or remaining <= 0
+            ):
+                return db_run
+            try:
+                await asyncio.wait_for(
+                    notified.wait(), min(remaining, RECHECK_SECONDS)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+def expire_runs() -> List[str]:
+    db = database.SessionLocal()
+    try:
+        return crud.expire_runs(db, int(time.time()))
+    finally:
+        db.close()
+
+
+async def sweep_expired_runs(interval: float = SWEEP_INTERVAL_SECONDS):
+    """
+    Expires the runs past their expires_at every `interval` seconds, for
+    the lifetime of the app. Workers stop the runs they execute themselves
+    once expired, this catches the runs no worker is executing.
+    """
+    while True:
+        try:
+            run_ids = await run_in_threadpool(expire_runs)
+            if run_ids:
+                logger.info("Expired %s runs", len(run_ids))
+        except Exception as e:
+            logger.error("Error expiring runs: %s", e)
+        await asyncio.sleep(interval)
@@ -12,6 +12,9 @@ from openai.types.beta.vector_store import (
     FileCounts,
     ExpiresAfter,
 )
+from openai.types.beta.vector_stores.vector_store_file import (
+    VectorStoreFile,
+)
 from openai.types.beta.vector_stores.vector_store_file_batch import (
     VectorStoreFileBatch,
 )
@@ -55,6 +58,7 @@ RunStep
 VectorStore
 FileCounts,
 ExpiresAfter,
+VectorStoreFile
 VectorStoreFileBatch
 TextContentBlock
 Text
@@ -100,6 +104,10 @@ class MessageInput(BaseModel):  # Input for message data
     attachments: Optional[List[Attachment]] = Field(default_factory=list)
 
 
+class MessageBatchCreate(BaseModel):
+    messages: List[MessageInput] = Field(..., min_length=1, max_length=1000)
+
+
 class ThreadCreate(BaseModel):
     messages: Optional[List[MessageInput]] = Field(default=[])
     metadata: Optional[Dict[str, str]] = Field(default={})
@@ -110,6 +118,17 @@ class ThreadUpdate(BaseModel):
     metadata: Optional[Dict[str, str]] = Field(default={})
 
 
+class ThreadLeaseRequest(BaseModel):
+    holder: str = Field(..., min_length=1, max_length=256)
+    ttl: int = Field(default=60, gt=0, le=3600)
+
+
+class ThreadLease(BaseModel):
+    thread_id: str
+    locked_by: str
+    lease_until: int
+
+
 class MessageUpdate(BaseModel):
     metadata: Optional[Dict[str, str]] = Field(default={})
 
@@ -149,6 +168,64 @@ class RunStatus(str, Enum):
     EXPIRED = "expired"
 
 
+class RunPriority(str, Enum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+class RunDispatchClaim(BaseModel):
+    worker: str = Field(..., min_length=1, max_length=256)
+    limit: int = Field(default=1, gt=0, le=100)
+    lease: int = Field(default=600, gt=0, le=3600)
+    # any priority when not given
+    priority: Optional[RunPriority] = None
+
+
+class RunDispatchAck(BaseModel):
+    worker: str = Field(..., min_length=1, max_length=256)
+
+
+class RunDispatchNack(BaseModel):
+    worker: str = Field(..., min_length=1, max_length=256)
+    delay: int = Field(default=0, ge=0, le=3600)
+    # the run failed and is retried, counted in the dispatch's attempts
+    failed: bool = False
+
+
+class RunDispatch(BaseModel):
+    id: int
+    run_id: str
+    thread_id: str
+    priority: str
+    tenant: str
+    created_at: int
+    visible_at: int
+    claimed_by: Optional[str] = None
+    attempts: int = 0
+
+
+class RunDispatchList(BaseModel):
+    data: List[RunDispatch]
+
+
+class RunQueueStats(BaseModel):
+    priority: str
+    # dispatches waiting in Postgres, visible or delayed, and claimed ones
+    pending: int = 0
+    delayed: int = 0
+    claimed: int = 0
+    tenants: int = 0
+    oldest_pending_age: Optional[int] = None
+    # the RabbitMQ queue of the priority, as last seen by the relay
+    queue: Optional[str] = None
+    queued: Optional[int] = None
+    consumers: Optional[int] = None
+
+
+class RunQueueStatsList(BaseModel):
+    data: List[RunQueueStats]
+
+
 class RunUpdate(BaseModel):
     assistant_id: Optional[str] = None
     cancelled_at: Optional[int] = None
@@ -222,3 +299,45 @@ class WebRetrievalCreate(BaseModel):
     constrain_to_root_domain: bool
     max_depth: int
     description: Optional[str] = None
+    max_pages: Optional[int] = Field(
+        None, gt=0, description="Maximum number of pages to crawl."
+    )
+
+
+class WebPageState(BaseModel):
+    url: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    links: List[str] = []
+
+
+class CrawlJob(BaseModel):
+    id: str
+    object: Literal["crawl_job"] = "crawl_job"
+    created_at: int
+    status: Literal[
+        "queued", "in_progress", "completed", "cancelled", "failed"
+    ]
+    root_urls: List[str]
+    constrain_to_root_domain: bool
+    max_depth: Optional[int] = None
+    max_pages: int
+    description: Optional[str] = None
+    pages_crawled: int = 0
+    pages_failed: int = 0
+    started_at: Optional[int] = None
+    completed_at: Optional[int] = None
+    cancelled_at: Optional[int] = None
+    failed_at: Optional[int] = None
+    last_error: Optional[str] = None
+
+
+class CrawlPage(BaseModel):
+    id: int
+    object: Literal["crawl_job.page"] = "crawl_job.page"
+    job_id: str
+    url: str
+    depth: int
+    error: Optional[str] = None
+    crawled_at: int
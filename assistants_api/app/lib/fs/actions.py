@@ -1,18 +1,25 @@
+from typing import List, Optional
 from fastapi import UploadFile
-from minio import Minio
+from minio import Minio, S3Error
 from .schemas import FileObject
+from lib.db import ids
+import hashlib
+import gzip
+import json
 import time
-import uuid
 import io
 
+CHUNK_CACHE_PREFIX = "_chunks"
+
 
 def upload_file(
     minio_client: Minio, bucket_name: str, file: UploadFile, file_data: bytes
 ) -> FileObject:
-    file_id = str(uuid.uuid4())  # Generate a unique file ID
+    file_id = ids.new_id(ids.FILE)  # Generate a unique, time ordered ID
     file_name = file.filename
     file_size = len(file_data)
     file_stream = io.BytesIO(file_data)  # Create a stream from the byte data
+    content_hash = hashlib.sha256(file_data).hexdigest()
 
     # Save file to MinIO
     minio_client.put_object(
@@ -20,7 +27,7 @@ def upload_file(
         file_id,
         file_stream,
         file_size,
-        metadata={"filename": file_name},
+        metadata={"filename": file_name, "sha256": content_hash},
     )
 
     return FileObject(
@@ -60,7 +67,55 @@ def get_file(
 def get_file_binary(
     minio_client: Minio, bucket_name: str, file_id: str
 ) -> bytes:
-    return minio_client.get_object(bucket_name, file_id).read()
+    response = minio_client.get_object(bucket_name, file_id)
+    try:
+        return response.read()
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def get_file_hash(
+    minio_client: Minio, bucket_name: str, file_id: str
+) -> Optional[str]:
+    """
+    Returns the sha256 of the file content recorded at upload time, or None
+    for files uploaded before hashes were stored.
+    """
+    file_stat = minio_client.stat_object(bucket_name, file_id)
+    return file_stat.metadata.get("x-amz-meta-sha256")
+
+
+def chunk_cache_key(content_hash: str, loader: str, params: str) -> str:
+    return f"{CHUNK_CACHE_PREFIX}/{content_hash}/{loader}-{params}.json.gz"
+
+
+def get_cached_chunks(
+    minio_client: Minio, bucket_name: str, cache_key: str
+) -> Optional[List[str]]:
+    try:
+        data = get_file_binary(minio_client, bucket_name, cache_key)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise e
+    return json.loads(gzip.decompress(data))
+
+
+def put_cached_chunks(
+    minio_client: Minio,
+    bucket_name: str,
+    cache_key: str,
+    chunks: List[str],
+) -> None:
+    data = gzip.compress(json.dumps(chunks).encode("utf-8"))
+    minio_client.put_object(
+        bucket_name,
+        cache_key,
+        io.BytesIO(data),
+        len(data),
+        content_type="application/gzip",
+    )
 
 
 def delete_file(minio_client: Minio, bucket_name: str, file_id: str) -> None:
@@ -1,4 +1,6 @@
 from openai.types import FileObject, FileDeleted
+from openai.pagination import SyncPage
 
 FileObject
 FileDeleted
+SyncPage
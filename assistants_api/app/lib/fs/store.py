@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from minio import Minio
 
 ACCESS_KEY = os.getenv('MINIO_ACCESS_KEY')
@@ -8,8 +9,10 @@ MINIO_ENDPOINT = os.getenv('MINIO_ENDPOINT')
 BUCKET_NAME = "store"
 
 
-# dependency
-def minio_client():
+@lru_cache(maxsize=None)
+def get_minio_client() -> Minio:
+    # The client is thread safe, share it (and its connection pool) instead
+    # of creating it and checking the bucket on every request
     minio_client = Minio(
         "minio:9000",
         access_key=ACCESS_KEY,
@@ -21,3 +24,8 @@ def minio_client():
     if not found:
         minio_client.make_bucket(BUCKET_NAME)
     return minio_client
+
+
+# dependency
+def minio_client():
+    return get_minio_client()
@@ -1,3 +1,4 @@
+from typing import List, Tuple
 import pika
 import os
 
@@ -5,6 +6,14 @@ RABBITMQ_DEFAULT_USER = os.getenv("RABBITMQ_DEFAULT_USER")
 RABBITMQ_DEFAULT_PASS = os.getenv("RABBITMQ_DEFAULT_PASS")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = os.getenv("RABBITMQ_PORT")
+# runs are dispatched through the run_dispatches table, "rabbitmq" relays
+# them to the runs queue, "postgres" leaves them for workers to claim
+RUN_DISPATCH = os.getenv("RUN_DISPATCH", "rabbitmq")
+# one queue per run priority, interactive runs keep the original queue
+RUN_QUEUES = {
+    "interactive": "runs_queue",
+    "batch": "runs_queue.batch",
+}
 
 
 class RabbitMQBroker:
@@ -21,6 +30,7 @@ class RabbitMQBroker:
             )
         )
         self.channel = self.connection.channel()
+        self.confirming = False
 
     def publish(self, queue_name: str, message: str):
         self.channel.queue_declare(queue=queue_name, durable=True)
@@ -33,9 +43,31 @@ class RabbitMQBroker:
             ),
         )
 
-    def close_connection(self):
-        self.connection.close()
+    def publish_confirmed(self, queue_name: str, messages: List[str]):
+        """
+        Publishes persistent messages, each confirmed by the broker before
+        returning, so they survive a broker restart once this returns.
+        """
+        if not self.confirming:
+            self.channel.confirm_delivery()
+            self.confirming = True
+        self.channel.queue_declare(queue=queue_name, durable=True)
+        for message in messages:
+            self.channel.basic_publish(
+                exchange='',
+                routing_key=queue_name,
+                body=message,
+                properties=pika.BasicProperties(
+                    delivery_mode=pika.DeliveryMode.Persistent,
+                ),
+            )
 
+    def queue_depth(self, queue_name: str) -> Tuple[int, int]:
+        """Messages ready in the queue and number of consumers."""
+        method = self.channel.queue_declare(
+            queue=queue_name, durable=True
+        ).method
+        return method.message_count, method.consumer_count
 
-def get_broker():
-    return RabbitMQBroker()
+    def close_connection(self):
+        self.connection.close()
@@ -0,0 +1,133 @@
+from typing import Callable, Dict, List, Optional
+import asyncio
+import json
+import os
+import socket
+import pika
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from lib.db import crud, database, models
+from .broker import RUN_QUEUES, RabbitMQBroker
+
+BATCH_SIZE = int(os.getenv("RUN_RELAY_BATCH_SIZE", 100))
+# runs are only published while fewer are ready in their queue, the rest
+# wait in Postgres where claims take turns between tenants
+MAX_QUEUE_DEPTH = int(os.getenv("RUN_QUEUE_MAX_DEPTH", 20))
+# dispatches committed by other API processes, or given back after a failed
+# publish, are picked up at least this often
+POLL_SECONDS = float(os.getenv("RUN_RELAY_POLL_SECONDS", 1))
+# dispatches claimed by a relay that died before publishing them are
+# relayed again after this
+LEASE_SECONDS = 30
+MAX_BACKOFF_SECONDS = 30
+
+
+class RunDispatchRelay:
+    """
+    Relays the run_dispatches outbox to the queues of the run priorities:
+    claims batches of dispatches, publishes them with publisher confirms and
+    deletes them. Requests only commit the dispatch with their run and wake
+    the relay up. Delivery is at least once, a batch that failed half way
+    through is published again.
+    """
+
+    def __init__(self):
+        self.worker = f"relay:{socket.gethostname()}:{os.getpid()}"
+        self.broker: Optional[RabbitMQBroker] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        # ready messages and consumers per priority, as last seen
+        self.queue_depths: Dict[str, tuple] = {}
+
+    def wake(self):
+        """Relays the dispatches just committed, called from any thread."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def call_broker(self, call: Callable[[RabbitMQBroker], object]):
+        # the connection may have been closed by the broker while idle, it
+        # is opened again once before giving up
+        for attempt in range(2):
+            try:
+                if self.broker is None:
+                    self.broker = RabbitMQBroker()
+                return call(self.broker)
+            except pika.exceptions.AMQPConnectionError:
+                self.close_broker()
+                if attempt:
+                    raise
+
+    def close_broker(self):
+        if self.broker is None:
+            return
+        try:
+            self.broker.close_connection()
+        except pika.exceptions.AMQPError:
+            pass
+        self.broker = None
+
+    def relay_priority(self, db: Session, priority: str, queue: str) -> int:
+        """Relays the dispatches of a priority its queue has room for."""
+        depth = self.call_broker(lambda broker: broker.queue_depth(queue))
+        self.queue_depths[priority] = depth
+        room = min(MAX_QUEUE_DEPTH - depth[0], BATCH_SIZE)
+        if room <= 0:
+            return 0
+        dispatches: List[models.RunDispatch] = crud.claim_run_dispatches(
+            db, self.worker, room, LEASE_SECONDS, priority
+        )
+        if not dispatches:
+            return 0
+        dispatch_ids = [dispatch.id for dispatch in dispatches]
+        messages = [
+            json.dumps(
+                {"thread_id": dispatch.thread_id, "run_id": dispatch.run_id}
+            )
+            for dispatch in dispatches
+        ]
+        try:
+            self.call_broker(
+                lambda broker: broker.publish_confirmed(queue, messages)
+            )
+        except Exception:
+            self.close_broker()
+            crud.nack_run_dispatches(db, dispatch_ids, self.worker, 0)
+            raise
+        crud.ack_run_dispatches(db, dispatch_ids, self.worker)
+        return len(dispatches)
+
+    def relay_batch(self) -> int:
+        """Relays a batch of dispatches, returns the number relayed."""
+        db = database.SessionLocal()
+        try:
+            return sum(
+                self.relay_priority(db, priority, queue)
+                for priority, queue in RUN_QUEUES.items()
+            )
+        finally:
+            db.close()
+
+    async def run(self):
+        """Relays dispatches for the lifetime of the app."""
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        backoff = 0
+        while True:
+            self.wakeup.clear()
+            try:
+                relayed = await run_in_threadpool(self.relay_batch)
+                backoff = 0
+            except Exception as e:
+                backoff = min(max(backoff * 2, 1), MAX_BACKOFF_SECONDS)
+                print(f"Error relaying runs, retrying in {backoff}s: {e}")
+                await asyncio.sleep(backoff)
+                continue
+            if relayed:
+                continue  # more may be waiting
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+run_dispatch_relay = RunDispatchRelay()
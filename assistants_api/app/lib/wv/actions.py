@@ -1,8 +1,17 @@
+from typing import List
+import hashlib
+import os
 import weaviate.classes as wvc
+from minio import Minio
 from lib.wv.client import client as weaviate_client
+from lib.fs import actions as fs_actions
+from lib.fs.store import BUCKET_NAME
 from utils.document_loader import DocumentLoader
 from weaviate.collections import Collection
 
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 100
+
 
 def id_to_string(id: int) -> str:
     # need to remove all the - from the uuid
@@ -23,13 +32,58 @@ def delete_collection(name: str) -> None:
     weaviate_client.collections.delete(name=id_to_string(name))
 
 
-def upload_file_chunks(
-    file_data: bytes, file_name: str, file_id: str, vector_store_id: str
-) -> int:
+def split_file(
+    file_data: bytes,
+    file_name: str,
+    text_length: int = CHUNK_SIZE,
+    text_overlap: int = CHUNK_OVERLAP,
+) -> List[str]:
     document = DocumentLoader(file_data=file_data, file_name=file_name)
     document.read()
-    chunks = document.split(text_length=300, text_overlap=100)
+    return document.split(text_length=text_length, text_overlap=text_overlap)
 
+
+def get_file_chunks(
+    minio_client: Minio,
+    file_id: str,
+    file_name: str,
+    text_length: int = CHUNK_SIZE,
+    text_overlap: int = CHUNK_OVERLAP,
+) -> List[str]:
+    """
+    Returns the chunks of a file, parsing and splitting it only the first
+    time a given content is seen with these chunking parameters. Results are
+    cached next to the files in MinIO, keyed by the content hash so that
+    attaching a file to more vector stores skips download and parsing.
+    """
+    file_data = None
+    content_hash = fs_actions.get_file_hash(minio_client, BUCKET_NAME, file_id)
+    if content_hash is None:  # uploaded before hashes were recorded
+        file_data = fs_actions.get_file_binary(
+            minio_client, BUCKET_NAME, file_id
+        )
+        content_hash = hashlib.sha256(file_data).hexdigest()
+
+    loader = os.path.splitext(file_name)[1].lstrip(".") or "raw"
+    cache_key = fs_actions.chunk_cache_key(
+        content_hash, loader, f"{text_length}-{text_overlap}"
+    )
+    chunks = fs_actions.get_cached_chunks(minio_client, BUCKET_NAME, cache_key)
+    if chunks is not None:
+        return chunks
+
+    if file_data is None:
+        file_data = fs_actions.get_file_binary(
+            minio_client, BUCKET_NAME, file_id
+        )
+    chunks = split_file(file_data, file_name, text_length, text_overlap)
+    fs_actions.put_cached_chunks(minio_client, BUCKET_NAME, cache_key, chunks)
+    return chunks
+
+
+def upload_file_chunks(
+    chunks: List[str], file_id: str, vector_store_id: str
+) -> int:
     collection = weaviate_client.collections.get(
         name=id_to_string(vector_store_id)
     )
@@ -1,4 +1,6 @@
+import asyncio
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from routers import (
     assistant_router,
     file_router,
@@ -9,12 +11,18 @@ from routers import (
     vectorstore_router,
 )
 from routers.ops import (
+    cache_ops_router,
+    run_dispatch_ops_router,
     run_ops_router,
     runsteps_ops_router,
+    thread_ops_router,
     web_retrieval_ops_router,
 )
-from lib.db.database import engine
+from lib.db.database import StatementCounter, engine, statement_counter
 from lib.db import models
+from lib.db.run_events import run_status_listener, sweep_expired_runs
+from lib.mb.broker import RUN_DISPATCH
+from lib.mb.relay import run_dispatch_relay
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -22,22 +30,45 @@ from lib.wv.client import client as wv_client
 import weaviate
 
 
+MAX_LOGGED_BODY_BYTES = 1024
+
+
 class RawBodyMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        body = await request.body()
-        print(f"Raw body: {body}")
+        # file uploads can be large, printing them would block the event loop
+        if not request.headers.get("content-type", "").startswith(
+            "multipart/form-data"
+        ):
+            body = await request.body()
+            print(f"Raw body: {body[:MAX_LOGGED_BODY_BYTES]}")
         response = await call_next(request)
         return response
 
 
+class SQLStatementCountMiddleware(BaseHTTPMiddleware):
+    """Reports the number of SQL statements of a request in a header."""
+
+    async def dispatch(self, request: Request, call_next):
+        counter = StatementCounter()
+        token = statement_counter.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            statement_counter.reset(token)
+        response.headers["X-SQL-Statements"] = str(counter.count)
+        return response
+
+
 load_dotenv()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     RawBodyMiddleware,
 )
 
+app.add_middleware(SQLStatementCountMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -79,6 +110,35 @@ models.Base.metadata.drop_all(bind=engine)
 # Create the database tables
 models.Base.metadata.create_all(bind=engine)
 
+
+@app.on_event("startup")
+async def start_run_sweeper():
+    # referenced so the task is not garbage collected
+    app.state.run_sweeper = asyncio.create_task(sweep_expired_runs())
+
+
+@app.on_event("startup")
+async def start_run_status_listener():
+    app.state.run_status_listener = asyncio.create_task(
+        run_status_listener.run()
+    )
+
+
+@app.on_event("startup")
+async def start_crawl_job_watcher():
+    app.state.crawl_job_watcher = asyncio.create_task(
+        web_retrieval_ops_router.watch_crawl_jobs()
+    )
+
+
+@app.on_event("startup")
+async def start_run_dispatch_relay():
+    if RUN_DISPATCH == "rabbitmq":
+        app.state.run_dispatch_relay = asyncio.create_task(
+            run_dispatch_relay.run()
+        )
+
+
 app.include_router(assistant_router.router)
 app.include_router(file_router.router)
 app.include_router(threads_router.router)
@@ -91,3 +151,6 @@ app.include_router(vectorstore_router.router)
 app.include_router(run_ops_router.router)
 app.include_router(runsteps_ops_router.router)
 app.include_router(web_retrieval_ops_router.router)
+app.include_router(cache_ops_router.router)
+app.include_router(thread_ops_router.router)
+app.include_router(run_dispatch_ops_router.router)
@@ -1,6 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional
-from utils.tranformers import db_to_pydantic_assistant
+from utils.tranformers import (
+    page_response,
+    row_response,
+    serialize_assistant,
+)
+from utils.metadata_filter import metadata_filter
 
 from lib.db.database import get_db
 from sqlalchemy.orm import Session
@@ -26,7 +31,7 @@ def create_assistant(
     """
 
     db_assistant = crud.create_assistant(db=db, assistant=assistant)
-    return db_to_pydantic_assistant(db_assistant)
+    return row_response(db_assistant, serialize_assistant)
 
 
 @router.get(
@@ -38,6 +43,7 @@ def list_assistants(
     order: str = Query(default="desc", regex="^(asc|desc)$"),
     after: Optional[str] = None,
     before: Optional[str] = None,
+    metadata: dict = Depends(metadata_filter),
 ):
     """
     List assistants with optional pagination and ordering.
@@ -45,17 +51,18 @@ def list_assistants(
     - **order**: Sort order based on the creation time ('asc' or 'desc').
     - **after**: ID to start the list from (for pagination).
     - **before**: ID to list up to (for pagination).
+    - **metadata[key]**: Only return objects with this metadata value.
     """
     db_assistants = crud.get_assistants(
-        db=db, limit=limit, order=order, after=after, before=before
+        db=db,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+        metadata=metadata,
     )
 
-    assistants = [
-        db_to_pydantic_assistant(assistant) for assistant in db_assistants
-    ]
-    paginated_assistants = schemas.SyncCursorPage(data=assistants)
-
-    return paginated_assistants
+    return page_response(db_assistants, serialize_assistant)
 
 
 @router.get("/assistants/{assistant_id}", response_model=schemas.Assistant)
@@ -68,7 +75,7 @@ def get_assistant(assistant_id: str, db: Session = Depends(get_db)):
     db_assistant = crud.get_assistant_by_id(db=db, assistant_id=assistant_id)
     if db_assistant is None:
         raise HTTPException(status_code=404, detail="No assistant found")
-    return db_to_pydantic_assistant(db_assistant)
+    return row_response(db_assistant, serialize_assistant)
 
 
 @router.post("/assistants/{assistant_id}", response_model=schemas.Assistant)
@@ -99,7 +106,7 @@ def update_assistant(
     if updated_assistant is None:
         raise HTTPException(status_code=404, detail="No assistant found")
 
-    return db_to_pydantic_assistant(updated_assistant)
+    return row_response(updated_assistant, serialize_assistant)
 
 
 @router.delete(
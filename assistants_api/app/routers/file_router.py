@@ -1,8 +1,18 @@
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, Path
+from typing import Optional
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    HTTPException,
+    UploadFile,
+    Path,
+    Query,
+)
+from fastapi.concurrency import run_in_threadpool
 from minio import Minio, S3Error
 from lib.fs import actions
 from lib.fs.store import minio_client, BUCKET_NAME
-from lib.fs.schemas import FileObject, FileDeleted
+from lib.fs.schemas import FileObject, FileDeleted, SyncPage
 from lib.db.database import get_db
 from typing_extensions import Literal
 from sqlalchemy.orm import Session
@@ -10,6 +20,10 @@ from lib.db import crud
 
 router = APIRouter()
 
+# NOTE: the minio SDK and the SQLAlchemy session are blocking, every call to
+# them from these async handlers goes through run_in_threadpool so a large
+# upload does not stall the event loop for other requests
+
 
 @router.post("/files", response_model=FileObject)
 async def create_file(
@@ -28,40 +42,58 @@ async def create_file(
     if not file_data_bytes:
         raise HTTPException(status_code=400, detail="File is empty")
 
-    uploaded_file = actions.upload_file(
+    uploaded_file = await run_in_threadpool(
+        actions.upload_file,
         minio_client=minio_client,
         bucket_name=BUCKET_NAME,
         file=file,
         file_data=file_data_bytes,
     )
 
-    crud.create_file(db=db, file=uploaded_file)
-
-    # # File data is passed here after ensuring it's not empty
-    # wv_actions.upload_file_chunks(
-    #     file_data=file_data_bytes,
-    #     file_name=file.filename,
-    #     file_id=uploaded_file.id,
-    # )
+    await run_in_threadpool(crud.create_file, db=db, file=uploaded_file)
 
     return uploaded_file
 
 
+MAX_FILE_IDS = 100  # keeps the query string of a lookup short
+
+
+@router.get("/files", response_model=SyncPage[FileObject])
+async def list_files(
+    ids: Optional[str] = Query(
+        default=None,
+        description="Comma separated ids, to look up many files at once",
+    ),
+    db: Session = Depends(get_db),
+):
+    file_ids = ids.split(",") if ids else None
+    if file_ids and len(file_ids) > MAX_FILE_IDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_FILE_IDS} ids can be looked up at once",
+        )
+    files = await run_in_threadpool(crud.get_files, db=db, file_ids=file_ids)
+    return SyncPage(
+        data=[
+            FileObject.model_validate(file, from_attributes=True)
+            for file in files
+        ],
+        object="list",
+    )
+
+
 @router.get("/files/{file_id}", response_model=FileObject)
 async def get_file(
     file_id: str = Path(..., description="The ID of the file to retrieve"),
     db: Session = Depends(get_db),
-    minio_client: Minio = Depends(minio_client),
 ):
     # Retrieve file metadata from the database
-    file_metadata = crud.get_file(db=db, file_id=file_id)
+    file_metadata = await run_in_threadpool(
+        crud.get_file, db=db, file_id=file_id
+    )
     if not file_metadata:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # # Optional: Retrieve file contents from MinIO
-    # response = minio_client.get_object(BUCKET_NAME, file_id)
-    # file_content = response.read()
-
     # Return file metadata
     return file_metadata
 
@@ -73,14 +105,19 @@ async def delete_file(
     minio_client: Minio = Depends(minio_client),
 ):
     # Verify if the file exists in the database
-    file_metadata = crud.get_file(db=db, file_id=file_id)
+    file_metadata = await run_in_threadpool(
+        crud.get_file, db=db, file_id=file_id
+    )
     if not file_metadata:
         raise HTTPException(status_code=404, detail="File not found")
 
     # Attempt to delete the file from MinIO
     try:
-        actions.delete_file(
-            minio_client=minio_client, bucket_name=BUCKET_NAME, file_id=file_id
+        await run_in_threadpool(
+            actions.delete_file,
+            minio_client=minio_client,
+            bucket_name=BUCKET_NAME,
+            file_id=file_id,
         )
     except S3Error as e:
         raise HTTPException(
@@ -88,6 +125,6 @@ async def delete_file(
         )
 
     # Delete the file metadata from the database
-    crud.delete_file(db=db, file_id=file_id)
+    await run_in_threadpool(crud.delete_file, db=db, file_id=file_id)
 
     return FileDeleted(id=file_id, deleted=True, object="file")
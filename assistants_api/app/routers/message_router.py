@@ -2,7 +2,8 @@ from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query
 from typing import Optional
 from sqlalchemy.orm import Session
 from lib.db import crud, schemas, database
-from utils.tranformers import db_to_pydantic_message
+from utils.tranformers import page_response, row_response, serialize_message
+from utils.metadata_filter import metadata_filter
 
 router = APIRouter()
 
@@ -20,7 +21,31 @@ def create_message_in_thread(
     db_message = crud.create_message(
         db=db, thread_id=thread_id, message_inp=message_inp
     )
-    return db_to_pydantic_message(db_message)
+    return row_response(db_message, serialize_message)
+
+
+# registered before /threads/{thread_id}/messages/{message_id}
+@router.post(
+    "/threads/{thread_id}/messages/batch",
+    response_model=schemas.SyncCursorPage[schemas.Message],
+)
+def create_messages_in_thread(
+    thread_id: str,
+    message_batch: schemas.MessageBatchCreate,
+    db: Session = Depends(database.get_db),
+):
+    """
+    Create several messages in a thread in a single transaction, in the
+    order they are given.
+    """
+    db_thread = crud.get_thread(db, thread_id=thread_id)
+    if db_thread is None:
+        raise HTTPException(status_code=404, detail="No thread found")
+
+    db_messages = crud.create_messages(
+        db=db, thread_id=thread_id, message_inps=message_batch.messages
+    )
+    return page_response(db_messages, serialize_message)
 
 
 @router.get(
@@ -34,6 +59,7 @@ def get_messages_in_thread(
     order: str = Query(default="desc", regex="^(asc|desc)$"),
     after: Optional[str] = None,
     before: Optional[str] = None,
+    metadata: dict = Depends(metadata_filter),
 ):
     """
     List messages in a thread with optional pagination and ordering.
@@ -41,6 +67,7 @@ def get_messages_in_thread(
     - **order**: Sort order based on the creation time ('asc' or 'desc').
     - **after**: ID to start the list from (for pagination).
     - **before**: ID to list up to (for pagination).
+    - **metadata[key]**: Only return objects with this metadata value.
     """
     db_messages = crud.get_messages(
         db=db,
@@ -49,12 +76,10 @@ def get_messages_in_thread(
         order=order,
         after=after,
         before=before,
+        metadata=metadata,
     )
 
-    messages = [db_to_pydantic_message(message) for message in db_messages]
-    paginated_messages = schemas.SyncCursorPage(data=messages)
-
-    return paginated_messages
+    return page_response(db_messages, serialize_message)
 
 
 @router.get(
@@ -76,7 +101,7 @@ def get_message(
     )
     if not message_db:
         raise HTTPException(status_code=404, detail="Message not found")
-    return db_to_pydantic_message(message_db)
+    return row_response(message_db, serialize_message)
 
 
 @router.post(
@@ -104,4 +129,4 @@ def modify_message(
     )
     if db_message is None:
         raise HTTPException(status_code=404, detail="Message not found")
-    return db_to_pydantic_message(db_message)
+    return row_response(db_message, serialize_message)
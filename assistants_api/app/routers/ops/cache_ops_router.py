@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from lib.db.cache import assistant_cache, thread_cache
+
+router = APIRouter()
+
+
+@router.get("/ops/cache")
+def read_cache_stats():
+    """Hit, miss and eviction counts of the row caches."""
+    return {
+        "assistants": assistant_cache.stats(),
+        "threads": thread_cache.stats(),
+    }
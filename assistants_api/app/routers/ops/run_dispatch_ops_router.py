@@ -0,0 +1,91 @@
+from fastapi import APIRouter, Body, Depends, HTTPException, Path
+from sqlalchemy.orm import Session
+from lib.db import crud, schemas, database
+from lib.mb.broker import RUN_DISPATCH, RUN_QUEUES
+from lib.mb.relay import run_dispatch_relay
+from utils.routing import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+
+
+@router.post(
+    "/ops/run_dispatches/claim", response_model=schemas.RunDispatchList
+)
+def claim_run_dispatches(
+    claim: schemas.RunDispatchClaim = Body(..., title="Claiming worker"),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Claims runs to execute, of a priority or any, when runs are dispatched
+    through Postgres. The claimed runs are hidden from other workers for
+    `lease` seconds and must be acked once executed, or they are claimed
+    again.
+    """
+    dispatches = crud.claim_run_dispatches(
+        db,
+        worker=claim.worker,
+        limit=claim.limit,
+        lease=claim.lease,
+        priority=claim.priority.value if claim.priority else None,
+    )
+    return schemas.RunDispatchList(
+        data=[
+            schemas.RunDispatch.model_validate(dispatch, from_attributes=True)
+            for dispatch in dispatches
+        ]
+    )
+
+
+@router.post(
+    "/ops/run_dispatches/{dispatch_id}/ack",
+    response_model=schemas.DeleteResponse,
+)
+def ack_run_dispatch(
+    dispatch_id: int = Path(..., title="The ID of the claimed dispatch"),
+    ack: schemas.RunDispatchAck = Body(..., title="Claiming worker"),
+    db: Session = Depends(database.get_db),
+):
+    if not crud.ack_run_dispatches(db, [dispatch_id], ack.worker):
+        raise HTTPException(
+            status_code=404, detail="Run dispatch not claimed by this worker"
+        )
+    return schemas.DeleteResponse(message="Run dispatch acked")
+
+
+@router.post(
+    "/ops/run_dispatches/{dispatch_id}/nack",
+    response_model=schemas.DeleteResponse,
+)
+def nack_run_dispatch(
+    dispatch_id: int = Path(..., title="The ID of the claimed dispatch"),
+    nack: schemas.RunDispatchNack = Body(..., title="Claiming worker"),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Gives a claimed run back, to be claimed again after `delay` seconds, as
+    a retry when it `failed`.
+    """
+    if not crud.nack_run_dispatches(
+        db, [dispatch_id], nack.worker, nack.delay, failed=nack.failed
+    ):
+        raise HTTPException(
+            status_code=404, detail="Run dispatch not claimed by this worker"
+        )
+    return schemas.DeleteResponse(message="Run dispatch released")
+
+
+@router.get("/ops/run_queues", response_model=schemas.RunQueueStatsList)
+def get_run_queue_stats(db: Session = Depends(database.get_db)):
+    """
+    Depth of the run queues per priority: the dispatches waiting in Postgres
+    and, when runs are relayed to RabbitMQ, the messages ready in the queue
+    of the priority as last seen by the relay of this process.
+    """
+    stats = crud.get_run_dispatch_stats(db)
+    if RUN_DISPATCH == "rabbitmq":
+        for queue_stats in stats:
+            queue_stats.queue = RUN_QUEUES[queue_stats.priority]
+            depth = run_dispatch_relay.queue_depths.get(queue_stats.priority)
+            if depth is not None:
+                queue_stats.queued, queue_stats.consumers = depth
+    return schemas.RunQueueStatsList(data=stats)
@@ -6,9 +6,10 @@ from lib.db import (
     schemas,
     database,
 )  # Import your CRUD handlers, schemas, and models
-from utils.tranformers import db_to_pydantic_run
+from utils.routing import ORJSONRoute
+from utils.tranformers import row_response, serialize_run
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
 
 
 @router.post(
@@ -28,4 +29,4 @@ def update_run(
     )
     if db_run is None:
         raise HTTPException(status_code=404, detail="Run not found")
-    return db_to_pydantic_run(db_run)
+    return row_response(db_run, serialize_run)
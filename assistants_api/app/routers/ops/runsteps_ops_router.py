@@ -6,9 +6,10 @@ from lib.db import (
     schemas,
     database,
 )  # Import your CRUD handlers, schemas, and models
-from utils.tranformers import db_to_pydantic_runstep
+from utils.routing import ORJSONRoute
+from utils.tranformers import row_response, serialize_runstep
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
 
 
 # TODO: improve test to actually inspect the run steps
@@ -28,7 +29,7 @@ def create_run_step(
     )
     if db_run_step is None:
         raise HTTPException(status_code=500, detail="Run step creation failed")
-    return db_to_pydantic_runstep(db_run_step)
+    return row_response(db_run_step, serialize_runstep)
 
 
 @router.post(
@@ -53,4 +54,4 @@ def update_run_step(
     )
     if db_run_step is None:
         raise HTTPException(status_code=404, detail="Run step not found")
-    return db_to_pydantic_runstep(db_run_step)
+    return row_response(db_run_step, serialize_runstep)
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Body, Depends, HTTPException, Path
+from sqlalchemy.orm import Session
+from lib.db import crud, schemas, database
+from utils.routing import ORJSONRoute
+
+router = APIRouter(route_class=ORJSONRoute)
+
+
+@router.post(
+    "/ops/threads/{thread_id}/lease", response_model=schemas.ThreadLease
+)
+def claim_thread_lease(
+    thread_id: str = Path(..., title="The ID of the thread to lease"),
+    lease: schemas.ThreadLeaseRequest = Body(..., title="Lease holder"),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Leases a thread to the worker executing one of its runs, or renews its
+    lease. Fails with a 409 while another holder has the thread leased.
+    """
+    db_thread = crud.claim_thread_lease(
+        db, thread_id, holder=lease.holder, ttl=lease.ttl
+    )
+    if db_thread is None:
+        if crud.get_thread(db, thread_id) is None:
+            raise HTTPException(status_code=404, detail="Thread not found")
+        raise HTTPException(status_code=409, detail="Thread is leased")
+    return schemas.ThreadLease(
+        thread_id=db_thread.id,
+        locked_by=db_thread.locked_by,
+        lease_until=db_thread.lease_until,
+    )
+
+
+@router.post(
+    "/ops/threads/{thread_id}/lease/release",
+    response_model=schemas.DeleteResponse,
+)
+def release_thread_lease(
+    thread_id: str = Path(..., title="The ID of the leased thread"),
+    lease: schemas.ThreadLeaseRequest = Body(..., title="Lease holder"),
+    db: Session = Depends(database.get_db),
+):
+    released = crud.release_thread_lease(db, thread_id, lease.holder)
+    if not released:
+        raise HTTPException(
+            status_code=404, detail="Thread lease not held by this holder"
+        )
+    return schemas.DeleteResponse(message="Thread lease released")
@@ -1,45 +1,93 @@
 # ops/web_retrieval.py
-from fastapi import APIRouter, Body, HTTPException
-from utils.crawling import (
-    crawl_websites,
-    content_preprocess,
-)
+from typing import Dict, Iterator, List, Optional
+import asyncio
+import time
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from utils.crawling import DEFAULT_MAX_PAGES, crawl_websites
 from lib.wv.client import client
 import weaviate
-from lib.db import schemas
+from lib.db import crud, database, schemas
+from lib.db.database import SessionLocal
+from utils.routing import ORJSONRoute
+from utils.tranformers import (
+    db_to_pydantic_crawl_job,
+    db_to_pydantic_crawl_page,
+)
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
 
 COLLECTION_NAME = "web_retrieval"
+INSERT_BATCH_SIZE = 100
 DEFAULT_WEB_RETRIEVAL_DESCRIPTION = "web_retrieval has not been initiated yet. Do not use this tool. To initiate it use `client.ops.web_retrieval.crawl_and_upsert(...)`"  # noqa
 
 
-async def success_callback(
-    crawl_info: schemas.CrawlInfo, collection: weaviate.collections.Collection
+def index_page(
+    crawl_info: schemas.CrawlInfo,
+    chunks: Iterator[str],
+    collection: weaviate.collections.Collection,
 ):
-    print(f"Callback for URL: {crawl_info.url}\n")
-    try:
-        collection.data.delete_many(
-            where=weaviate.classes.query.Filter.by_property("url").equal(
-                crawl_info.url
-            )
+    collection.data.delete_many(
+        where=weaviate.classes.query.Filter.by_property("url").equal(
+            crawl_info.url
         )
-        processed_data = content_preprocess(crawl_info)
-        data_to_insert = [
-            {"url": info.url, "content": info.content, "depth": info.depth}
-            for info in processed_data
-        ]
-        collection.data.insert_many(data_to_insert)
-    except Exception as e:
-        print(f"Error during callback for URL {crawl_info.url}: {e}")
+    )
+    batch = []
+    for chunk in chunks:
+        batch.append(
+            {
+                "url": crawl_info.url,
+                "content": chunk,
+                "depth": crawl_info.depth,
+            }
+        )
+        if len(batch) >= INSERT_BATCH_SIZE:
+            collection.data.insert_many(batch)
+            batch = []
+    if batch:
+        collection.data.insert_many(batch)
 
 
-@router.post("/ops/web_retrieval", response_model=schemas.WebRetrievalResponse)
-async def start_crawl(
-    data: schemas.WebRetrievalCreate = Body(
-        ..., title="Root URLs and max depth"
-    ),
+async def success_callback(
+    crawl_info: schemas.CrawlInfo,
+    chunks: Iterator[str],
+    collection: weaviate.collections.Collection,
 ):
+    # errors are raised to the crawler so the page is not recorded as indexed
+    print(f"Callback for URL: {crawl_info.url}\n")
+    # the Weaviate client blocks while the chunks are vectorized
+    await run_in_threadpool(index_page, crawl_info, chunks, collection)
+
+
+# The crawler calls these concurrently, each call gets its own session
+def _get_web_page(url: str) -> Optional[schemas.WebPageState]:
+    with SessionLocal() as db:
+        return crud.get_web_page(db, url)
+
+
+def _upsert_web_page(web_page: schemas.WebPageState):
+    with SessionLocal() as db:
+        crud.upsert_web_page(db, web_page)
+
+
+def _delete_web_pages():
+    with SessionLocal() as db:
+        crud.delete_web_pages(db)
+
+
+async def load_page_state(url: str) -> Optional[schemas.WebPageState]:
+    return await run_in_threadpool(_get_web_page, url)
+
+
+async def save_page_state(web_page: schemas.WebPageState):
+    await run_in_threadpool(_upsert_web_page, web_page)
+
+
+def get_collection(
+    data: schemas.WebRetrievalCreate,
+) -> weaviate.collections.Collection:
     if data.description == DEFAULT_WEB_RETRIEVAL_DESCRIPTION:
         data.description = "Web Retrieval contains information scraped from specific website domains. Use this when precise information in a website may need to be retrieved."  # noqa
         print(
@@ -48,6 +96,16 @@ async def start_crawl(
     collection = client.collections.get(name=COLLECTION_NAME)
     if data.description:
         collection.config.update(description=data.description)
+    return collection
+
+
+@router.post("/ops/web_retrieval", response_model=schemas.WebRetrievalResponse)
+async def start_crawl(
+    data: schemas.WebRetrievalCreate = Body(
+        ..., title="Root URLs and max depth"
+    ),
+):
+    collection = get_collection(data)
 
     print("Starting web retrieval...")
     try:
@@ -55,7 +113,10 @@ async def start_crawl(
             data.root_urls,
             data.constrain_to_root_domain,
             data.max_depth,
-            lambda x: success_callback(x, collection),
+            lambda x, chunks: success_callback(x, chunks, collection),
+            max_pages=data.max_pages or DEFAULT_MAX_PAGES,
+            load_page_state=load_page_state,
+            save_page_state=save_page_state,
         )
 
         print(f"\n\nTotal crawls: {len(crawl_infos)}")
@@ -73,6 +134,273 @@ async def start_crawl(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+ACTIVE_CRAWL_JOB_STATUSES = crud.ACTIVE_CRAWL_JOB_STATUSES
+MAX_CONCURRENT_CRAWL_JOBS = 1  # jobs share the web_retrieval collection
+CRAWL_PAGE_BATCH_SIZE = 50
+CRAWL_PAGE_FLUSH_INTERVAL = 1.0  # seconds
+CRAWL_PAGE_POLL_INTERVAL = 1.0  # seconds
+CRAWL_JOB_HEARTBEAT_INTERVAL = 10  # seconds
+# jobs not heartbeated for this long were left behind by a dead process
+CRAWL_JOB_STALE_SECONDS = 60
+
+crawl_job_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CRAWL_JOBS)
+crawl_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _crawl_job_call(fn, *args, **kwargs) -> Optional[schemas.CrawlJob]:
+    with SessionLocal() as db:
+        db_crawl_job = fn(db, *args, **kwargs)
+        if db_crawl_job is None:
+            return None
+        return db_to_pydantic_crawl_job(db_crawl_job)
+
+
+async def crawl_job_call(fn, *args, **kwargs) -> Optional[schemas.CrawlJob]:
+    return await run_in_threadpool(_crawl_job_call, fn, *args, **kwargs)
+
+
+class CrawlPageRecorder:
+    """
+    Buffers the pages visited by a crawl job and writes them in batches,
+    stopping the job when it was cancelled from another process.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.pages: List[schemas.CrawlInfo] = []
+        self.flushed_at = time.monotonic()
+
+    async def add(self, crawl_info: schemas.CrawlInfo):
+        self.pages.append(
+            schemas.CrawlInfo(
+                url=crawl_info.url,
+                content="",
+                error=crawl_info.error,
+                depth=crawl_info.depth,
+            )
+        )
+        if (
+            len(self.pages) >= CRAWL_PAGE_BATCH_SIZE
+            or time.monotonic() - self.flushed_at >= CRAWL_PAGE_FLUSH_INTERVAL
+        ):
+            await self.flush()
+
+    async def flush(self):
+        pages, self.pages = self.pages, []
+        self.flushed_at = time.monotonic()
+        if not pages:
+            return
+        crawl_job = await crawl_job_call(
+            crud.add_crawl_pages, self.job_id, pages
+        )
+        # cancelled from another process, or failed as orphaned
+        if crawl_job and crawl_job.status not in ACTIVE_CRAWL_JOB_STATUSES:
+            task = crawl_tasks.get(self.job_id)
+            if task:
+                task.cancel()
+
+
+async def run_crawl_job(job_id: str, data: schemas.WebRetrievalCreate):
+    recorder = CrawlPageRecorder(job_id)
+    try:
+        async with crawl_job_semaphore:
+            crawl_job = await crawl_job_call(
+                crud.update_crawl_job,
+                job_id,
+                {"status": "in_progress", "started_at": int(time.time())},
+                from_statuses=["queued"],
+            )
+            if crawl_job is None or crawl_job.status != "in_progress":
+                return  # cancelled while queued
+            collection = await run_in_threadpool(get_collection, data)
+
+            print(f"Starting crawl job {job_id}...")
+            await crawl_websites(
+                crawl_job.root_urls,
+                crawl_job.constrain_to_root_domain,
+                crawl_job.max_depth,
+                lambda x, chunks: success_callback(x, chunks, collection),
+                max_pages=crawl_job.max_pages,
+                load_page_state=load_page_state,
+                save_page_state=save_page_state,
+                page_callback=recorder.add,
+                keep_results=False,
+            )
+            await recorder.flush()
+            await crawl_job_call(
+                crud.update_crawl_job,
+                job_id,
+                {"status": "completed", "completed_at": int(time.time())},
+                from_statuses=["in_progress"],
+            )
+    except asyncio.CancelledError:
+        print(f"Crawl job {job_id} cancelled")
+        await recorder.flush()
+        await crawl_job_call(
+            crud.update_crawl_job,
+            job_id,
+            {"status": "cancelled", "cancelled_at": int(time.time())},
+            from_statuses=ACTIVE_CRAWL_JOB_STATUSES,
+        )
+    except Exception as e:
+        print(f"Crawl job {job_id} failed: {e}")
+        await recorder.flush()
+        await crawl_job_call(
+            crud.update_crawl_job,
+            job_id,
+            {
+                "status": "failed",
+                "failed_at": int(time.time()),
+                "last_error": str(e),
+            },
+            from_statuses=ACTIVE_CRAWL_JOB_STATUSES,
+        )
+    finally:
+        crawl_tasks.pop(job_id, None)
+
+
+def _watch_crawl_jobs(job_ids: List[str]) -> List[str]:
+    now = int(time.time())
+    with SessionLocal() as db:
+        crud.heartbeat_crawl_jobs(db, job_ids, now)
+        return crud.fail_orphaned_crawl_jobs(
+            db, now, now - CRAWL_JOB_STALE_SECONDS
+        )
+
+
+async def watch_crawl_jobs(interval: float = CRAWL_JOB_HEARTBEAT_INTERVAL):
+    """
+    Heartbeats the crawl jobs of this process and fails the jobs left behind
+    by processes that died or restarted, for the lifetime of the app.
+    """
+    while True:
+        try:
+            job_ids = await run_in_threadpool(
+                _watch_crawl_jobs, list(crawl_tasks)
+            )
+            if job_ids:
+                print(f"Failed {len(job_ids)} orphaned crawl jobs")
+        except Exception as e:
+            print(f"Error watching crawl jobs: {e}")
+        await asyncio.sleep(interval)
+
+
+@router.post("/ops/web_retrieval/jobs", response_model=schemas.CrawlJob)
+async def create_crawl_job(
+    data: schemas.WebRetrievalCreate = Body(
+        ..., title="Root URLs and max depth"
+    ),
+):
+    crawl_job = await crawl_job_call(
+        crud.create_crawl_job, data, data.max_pages or DEFAULT_MAX_PAGES
+    )
+    crawl_tasks[crawl_job.id] = asyncio.create_task(
+        run_crawl_job(crawl_job.id, data)
+    )
+    return crawl_job
+
+
+@router.get(
+    "/ops/web_retrieval/jobs/{job_id}", response_model=schemas.CrawlJob
+)
+def get_crawl_job(
+    job_id: str = Path(..., title="The ID of the crawl job"),
+    db: Session = Depends(database.get_db),
+):
+    db_crawl_job = crud.get_crawl_job(db, job_id)
+    if db_crawl_job is None:
+        raise HTTPException(status_code=404, detail="Crawl job not found")
+    return db_to_pydantic_crawl_job(db_crawl_job)
+
+
+@router.get(
+    "/ops/web_retrieval/jobs/{job_id}/pages",
+    response_model=schemas.SyncCursorPage[schemas.CrawlPage],
+)
+def list_crawl_pages(
+    job_id: str = Path(..., title="The ID of the crawl job"),
+    limit: int = Query(default=100, le=1000),
+    after: Optional[int] = None,
+    db: Session = Depends(database.get_db),
+):
+    """
+    List the pages visited by a crawl job in the order they were crawled.
+    - **limit**: Maximum number of results to return.
+    - **after**: ID of the page to start the list after (for pagination).
+    """
+    if crud.get_crawl_job(db, job_id) is None:
+        raise HTTPException(status_code=404, detail="Crawl job not found")
+    crawl_pages = crud.get_crawl_pages(db, job_id, limit=limit, after=after)
+    return schemas.SyncCursorPage(
+        data=[db_to_pydantic_crawl_page(page) for page in crawl_pages]
+    )
+
+
+def _get_crawl_pages(job_id: str, after: Optional[int]):
+    with SessionLocal() as db:
+        crawl_job = crud.get_crawl_job(db, job_id)
+        crawl_pages = crud.get_crawl_pages(
+            db, job_id, limit=CRAWL_PAGE_BATCH_SIZE, after=after
+        )
+        return (
+            crawl_job.status,
+            [db_to_pydantic_crawl_page(page) for page in crawl_pages],
+        )
+
+
+async def stream_crawl_pages(job_id: str):
+    after = None
+    while True:
+        status, crawl_pages = await run_in_threadpool(
+            _get_crawl_pages, job_id, after
+        )
+        for crawl_page in crawl_pages:
+            yield crawl_page.model_dump_json() + "\n"
+        if crawl_pages:
+            after = crawl_pages[-1].id
+        elif status not in ACTIVE_CRAWL_JOB_STATUSES:
+            return
+        else:
+            await asyncio.sleep(CRAWL_PAGE_POLL_INTERVAL)
+
+
+@router.get("/ops/web_retrieval/jobs/{job_id}/pages/stream")
+def stream_crawl_job_pages(
+    job_id: str = Path(..., title="The ID of the crawl job"),
+    db: Session = Depends(database.get_db),
+):
+    """
+    Streams the pages visited by a crawl job as newline delimited JSON until
+    the job finishes.
+    """
+    if crud.get_crawl_job(db, job_id) is None:
+        raise HTTPException(status_code=404, detail="Crawl job not found")
+    return StreamingResponse(
+        stream_crawl_pages(job_id), media_type="application/x-ndjson"
+    )
+
+
+@router.post(
+    "/ops/web_retrieval/jobs/{job_id}/cancel", response_model=schemas.CrawlJob
+)
+async def cancel_crawl_job(
+    job_id: str = Path(..., title="The ID of the crawl job"),
+):
+    crawl_job = await crawl_job_call(
+        crud.update_crawl_job,
+        job_id,
+        {"status": "cancelled", "cancelled_at": int(time.time())},
+        from_statuses=ACTIVE_CRAWL_JOB_STATUSES,
+    )
+    if crawl_job is None:
+        raise HTTPException(status_code=404, detail="Crawl job not found")
+    # jobs running in another process notice it when recording pages
+    task = crawl_tasks.get(job_id)
+    if task:
+        task.cancel()
+    return crawl_job
+
+
 # behaves more like restart
 @router.delete("/ops/web_retrieval", response_model=schemas.DeleteResponse)
 async def delete_collection():
@@ -89,6 +417,8 @@ async def delete_collection():
             )
     except Exception as e:
         del_res = schemas.DeleteResponse(message=f"Error: {str(e)}")
+    # forget the crawl state so the next crawl indexes every page again
+    await run_in_threadpool(_delete_web_pages)
     client.collections.create(
         name=COLLECTION_NAME,
         description=DEFAULT_WEB_RETRIEVAL_DESCRIPTION,
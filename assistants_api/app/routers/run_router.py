@@ -1,31 +1,32 @@
 # In your FastAPI router file
-from fastapi import APIRouter, Body, Depends, HTTPException, Path
+from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query
 from sqlalchemy.orm import Session
 from lib.db import (
     crud,
     schemas,
     database,
 )  # Import your CRUD handlers, schemas, and models
-from lib.mb.broker import RabbitMQBroker, get_broker
-from utils.tranformers import db_to_pydantic_run
-import json
+from lib.db.run_events import wait_for_run
+from lib.mb.relay import run_dispatch_relay
+from utils.tranformers import row_response, serialize_run
 
 router = APIRouter()
 
+MAX_WAIT_SECONDS = 60
+
 
 @router.post("/threads/{thread_id}/runs", response_model=schemas.Run)
 def create_run(
     thread_id: str = Path(..., title="The ID of the thread to run"),
     run: schemas.RunContent = Body(..., title="The run content"),
     db: Session = Depends(database.get_db),
-    broker: RabbitMQBroker = Depends(get_broker),
 ):
     """
     Create a new run within a specified thread.
 
     This endpoint creates a new run associated with a given thread, using the provided run content.
     It ensures that the specified thread exists and validates the run content against the associated assistant.
-    If the creation is successful, the new run's ID is published to a RabbitMQ queue for further processing.
+    The run is dispatched to the workers in the same transaction, through the run_dispatches table.
 
     Parameters:
     - thread_id (str): The ID of the thread in which the run is to be created.
@@ -37,27 +38,41 @@ def create_run(
     Raises:
     - HTTPException: If the run creation fails, an HTTP 500 error is returned with a failure detail.
     """  # noqa
-    db_run = crud.create_run(db=db, thread_id=thread_id, run_params=run)
+    try:
+        db_run = crud.create_run(
+            db=db,
+            thread_id=thread_id,
+            run_params=run,
+            dispatch=True,
+        )
+    except ValueError as e:
+        # missing thread or assistant, or a run already active on the thread
+        raise HTTPException(status_code=400, detail=str(e))
     if db_run is None:
         raise HTTPException(status_code=500, detail="Run creation failed")
 
-    # After successful creation, publish the run ID to the RabbitMQ queue
-    data = {"thread_id": thread_id, "run_id": str(db_run.id)}
-    message = json.dumps(data)
-    broker.publish("runs_queue", message)
-    broker.close_connection()
+    # the dispatch was committed with the run
+    run_dispatch_relay.wake()
 
-    return db_to_pydantic_run(db_run)
+    return row_response(db_run, serialize_run)
 
 
 @router.get("/threads/{thread_id}/runs/{run_id}", response_model=schemas.Run)
-def read_run(
-    thread_id: str, run_id: str, db: Session = Depends(database.get_db)
+async def read_run(
+    thread_id: str,
+    run_id: str,
+    wait: float = Query(default=0, ge=0, le=MAX_WAIT_SECONDS),
+    db: Session = Depends(database.get_db),
 ):
-    db_run = crud.get_run(db, thread_id=thread_id, run_id=run_id)
+    """
+    Retrieve a run.
+    - **wait**: Seconds to wait for the run to complete, fail, expire, be
+    cancelled or require action before returning it.
+    """
+    db_run = await wait_for_run(db, thread_id, run_id, wait)
     if db_run is None:
         raise HTTPException(status_code=404, detail="Run not found")
-    return db_to_pydantic_run(db_run)
+    return row_response(db_run, serialize_run)
 
 
 @router.post(
@@ -66,10 +81,14 @@ def read_run(
 def cancel_run(
     thread_id: str, run_id: str, db: Session = Depends(database.get_db)
 ):
-    run = crud.cancel_run(db, thread_id=thread_id, run_id=run_id)
+    try:
+        run = crud.cancel_run(db, thread_id=thread_id, run_id=run_id)
+    except ValueError as e:
+        # already completed, failed, expired or cancelled
+        raise HTTPException(status_code=409, detail=str(e))
     if run is None:
         raise HTTPException(status_code=404, detail="Run not found")
-    return db_to_pydantic_run(run)
+    return row_response(run, serialize_run)
 
 
 @router.post(
@@ -89,7 +108,6 @@ def submit_tool_outputs(
         ..., description="Request body containing tool outputs."
     ),
     db: Session = Depends(database.get_db),
-    broker: RabbitMQBroker = Depends(get_broker),
 ):
     # Logic to handle the submission of tool outputs
     # This will involve updating the database and performing necessary actions
@@ -99,14 +117,11 @@ def submit_tool_outputs(
             thread_id=thread_id,
             run_id=run_id,
             tool_outputs=body.tool_outputs,
+            dispatch=True,
         )
-        # After successful creation, publish the run ID to the RabbitMQ queue
-        data = {"thread_id": thread_id, "run_id": str(db_run.id)}
-        message = json.dumps(data)
-        broker.publish("runs_queue", message)
-        broker.close_connection()
+        run_dispatch_relay.wake()
 
-        return db_to_pydantic_run(db_run)
+        return row_response(db_run, serialize_run)
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,7 +1,7 @@
 # routers/run_steps.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
-from utils.tranformers import db_to_pydantic_runstep
+from utils.tranformers import page_response, serialize_runstep
 from lib.db import crud, schemas
 from lib.db.database import get_db
 
@@ -15,8 +15,8 @@ router = APIRouter()
 def get_run_steps(
     thread_id: str,
     run_id: str,
-    limit: int = 20,
-    order: str = "desc",
+    limit: int = Query(default=20, le=100),
+    order: str = Query(default="desc", regex="^(asc|desc)$"),
     after: str = None,
     before: str = None,
     db: Session = Depends(get_db),
@@ -25,8 +25,4 @@ def get_run_steps(
         db, thread_id, run_id, limit, order, after, before
     )
 
-    run_steps = [db_to_pydantic_runstep(run_step) for run_step in db_run_steps]
-
-    paginated_run_steps = schemas.SyncCursorPage(data=run_steps)
-
-    return paginated_run_steps
+    return page_response(db_run_steps, serialize_runstep)
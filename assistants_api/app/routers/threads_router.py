@@ -1,7 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
 from sqlalchemy.orm import Session
 from lib.db import schemas, database, crud
-from utils.tranformers import db_to_pydantic_thread
+from utils.tranformers import page_response, row_response, serialize_thread
+from utils.metadata_filter import metadata_filter
 
 router = APIRouter()
 
@@ -16,7 +18,35 @@ def create_thread(
     """
 
     db_thread = crud.create_thread(db, thread_data)
-    return db_to_pydantic_thread(db_thread)
+    return row_response(db_thread, serialize_thread)
+
+
+@router.get("/threads", response_model=schemas.SyncCursorPage[schemas.Thread])
+def list_threads(
+    db: Session = Depends(database.get_db),
+    limit: int = Query(default=20, le=100),
+    order: str = Query(default="desc", regex="^(asc|desc)$"),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    metadata: dict = Depends(metadata_filter),
+):
+    """
+    List threads with optional pagination and ordering.
+    - **limit**: Maximum number of results to return.
+    - **order**: Sort order based on the creation time ('asc' or 'desc').
+    - **after**: ID to start the list from (for pagination).
+    - **before**: ID to list up to (for pagination).
+    - **metadata[key]**: Only return objects with this metadata value.
+    """
+    db_threads = crud.get_threads(
+        db,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+        metadata=metadata,
+    )
+    return page_response(db_threads, serialize_thread)
 
 
 @router.get("/threads/{thread_id}", response_model=schemas.Thread)
@@ -29,7 +59,7 @@ def get_thread(thread_id: str, db: Session = Depends(database.get_db)):
     if db_thread is None:
         raise HTTPException(status_code=404, detail="No thread found")
 
-    return db_to_pydantic_thread(db_thread)
+    return row_response(db_thread, serialize_thread)
 
 
 @router.post("/threads/{thread_id}", response_model=schemas.Thread)
@@ -49,7 +79,7 @@ def update_thread(
     if db_thread is None:
         raise HTTPException(status_code=404, detail="No thread found")
 
-    return db_to_pydantic_thread(db_thread)
+    return row_response(db_thread, serialize_thread)
 
 
 @router.delete("/threads/{thread_id}", response_model=schemas.ThreadDeleted)
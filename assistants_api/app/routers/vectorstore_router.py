@@ -1,18 +1,26 @@
-from typing import List, Optional
+from typing import Optional
+import logging
 from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from sqlalchemy.orm import Session
 from utils.tranformers import (
     db_to_pydantic_vector_store,
     db_to_pydantic_vector_store_file_batch,
+    page_response,
+    row_response,
+    serialize_vector_store,
+    serialize_vector_store_file,
+    serialize_vector_store_file_batch,
 )
+from utils.metadata_filter import metadata_filter
 from lib.db import crud, schemas, database
 from minio import Minio
 from lib.wv import actions as wv_actions
 from lib.fs.store import minio_client, BUCKET_NAME
 from lib.fs import actions as fs_actions
-import json
 
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
@@ -33,8 +41,7 @@ def create_vector_store(
     if vector_store.file_ids:
         background_tasks.add_task(
             process_files,
-            vector_store_model,
-            vector_store.file_ids,
+            vector_store_model.id,
             db,
             minio_client,
         )
@@ -66,120 +73,74 @@ def create_vector_store_file_batch(
     file_batch_model = db_to_pydantic_vector_store_file_batch(db_file_batch)
 
     # Process files in the background
-    background_tasks.add_task(
-        process_files,
-        vector_store,
-        file_batch.file_ids,
-        db,
-        minio_client,
-        file_batch_model,
-    )
+    if file_batch_model.file_counts.in_progress:
+        background_tasks.add_task(
+            process_files,
+            vector_store.id,
+            db,
+            minio_client,
+            file_batch_model.id,
+        )
 
     return file_batch_model
 
 
-def process_files(
-    vector_store_model: schemas.VectorStore,
-    file_ids,
-    db,
-    minio_client,
-    vector_store_file_batch: Optional[schemas.VectorStoreFileBatch] = None,
+@router.get(
+    "/vector_stores/{vector_store_id}/file_batches/{batch_id}",
+    response_model=schemas.VectorStoreFileBatch,
+)
+def read_vector_store_file_batch(
+    vector_store_id: str,
+    batch_id: str,
+    db: Session = Depends(database.get_db),
 ):
-    # Retrieve the existing vector store to update
-    vector_store_model.file_counts.in_progress = len(file_ids)
+    db_file_batch = crud.get_file_batch(db, vector_store_id, batch_id)
+    if db_file_batch is None:
+        raise HTTPException(status_code=404, detail="File batch not found")
+    return row_response(db_file_batch, serialize_vector_store_file_batch)
 
-    if vector_store_file_batch:
-        vector_store_file_batch.file_counts.in_progress = len(file_ids)
 
-    status = (
-        "in_progress"
-        if vector_store_model.file_counts.in_progress > 0
-        else "completed"
+def process_files(
+    vector_store_id: str,
+    db: Session,
+    minio_client: Minio,
+    batch_id: Optional[str] = None,
+):
+    """
+    Indexes the files of a vector store, or of one of its batches, that are
+    still in progress. Counts are kept up to date by the database.
+    """
+    file_ids = crud.get_vector_store_file_ids(
+        db, vector_store_id, batch_id=batch_id, status="in_progress"
     )
-    usage_bytes = 0
-
-    # Process each file
     for file_id in file_ids:
-        crud.update_vector_store(
-            db,
-            vector_store_model.id,
-            {
-                "file_counts": vector_store_model.file_counts.model_dump(),
-                "usage_bytes": usage_bytes,
-                "status": status,
-                "metadata": vector_store_model.metadata,
-            },
-        )
-        if vector_store_file_batch:
-            crud.update_file_batch(
-                db,
-                vector_store_file_batch.id,
-                {
-                    "file_counts": vector_store_file_batch.file_counts.model_dump(),
-                    "status": status,
-                },
-            )
         try:
-            file_data = fs_actions.get_file_binary(
-                minio_client, BUCKET_NAME, file_id
-            )
             file_metadata = fs_actions.get_file(
                 minio_client, BUCKET_NAME, file_id
             )
-
-            wv_actions.upload_file_chunks(
-                file_data,
-                file_metadata.filename,
-                file_id,
-                vector_store_model.id,
-            )
-            usage_bytes += len(file_data)
-            vector_store_model.file_counts.completed += 1
-            # update metadata _file_ids
-            file_ids: List[str] = json.loads(
-                vector_store_model.metadata["_file_ids"]
+            chunks = wv_actions.get_file_chunks(
+                minio_client, file_id, file_metadata.filename
             )
-            file_ids.append(file_id)
-            vector_store_model.metadata["_file_ids"] = json.dumps(file_ids)
-            if vector_store_file_batch:
-                vector_store_file_batch.file_counts.completed += 1
+
+            wv_actions.upload_file_chunks(chunks, file_id, vector_store_id)
         except Exception as e:
-            print(
-                f"Error processing file '{file_metadata.filename}': {str(e)}"
+            logger.exception("Error processing file '%s'", file_id)
+            crud.finish_vector_store_file(
+                db,
+                vector_store_id,
+                file_id,
+                "failed",
+                last_error={"code": "internal_error", "message": str(e)},
             )
-            vector_store_model.file_counts.failed += 1
-            if vector_store_file_batch:
-                vector_store_file_batch.file_counts.failed += 1
-        finally:
-            vector_store_model.file_counts.in_progress -= 1
-            vector_store_model.file_counts.total += 1
-            if vector_store_file_batch:
-                vector_store_file_batch.file_counts.in_progress -= 1
-                vector_store_file_batch.file_counts.total += 1
-            status = (
-                "completed"
-                if vector_store_model.file_counts.in_progress == 0
-                else "in_progress"
+        else:
+            crud.finish_vector_store_file(
+                db,
+                vector_store_id,
+                file_id,
+                "completed",
+                usage_bytes=file_metadata.bytes,
             )
 
-    status = (
-        "in_progress"
-        if vector_store_model.file_counts.in_progress > 0
-        else "completed"
-    )
-
-    # Update the vector store with the final counts and usage bytes
-    crud.update_vector_store(
-        db,
-        vector_store_model.id,
-        {
-            "file_counts": vector_store_model.file_counts.model_dump(),
-            "usage_bytes": usage_bytes,
-            "status": status,
-            "metadata": vector_store_model.metadata,
-        },
-    )
-
 
 @router.get(
     "/vector_stores/{vector_store_id}", response_model=schemas.VectorStore
@@ -192,7 +153,7 @@ def read_vector_store(
     )
     if db_vector_store is None:
         raise HTTPException(status_code=404, detail="Vector store not found")
-    return db_to_pydantic_vector_store(db_vector_store)
+    return row_response(db_vector_store, serialize_vector_store)
 
 
 @router.get(
@@ -205,6 +166,7 @@ def list_vector_stores(
     order: str = Query(default="desc", regex="^(asc|desc)$"),
     after: Optional[str] = None,
     before: Optional[str] = None,
+    metadata: dict = Depends(metadata_filter),
 ):
     """
     List vector stores with optional pagination and ordering.
@@ -212,14 +174,95 @@ def list_vector_stores(
     - **order**: Sort order based on the creation time ('asc' or 'desc').
     - **after**: ID to start the list from (for pagination).
     - **before**: ID to list up to (for pagination).
+    - **metadata[key]**: Only return objects with this metadata value.
     """
     vector_stores = crud.get_vector_stores(
-        db=db, limit=limit, order=order, after=after, before=before
+        db=db,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+        metadata=metadata,
+    )
+
+    return page_response(vector_stores, serialize_vector_store)
+
+
+FileStatusFilter = Query(
+    default=None, regex="^(in_progress|completed|failed|cancelled)$"
+)
+
+
+@router.get(
+    "/vector_stores/{vector_store_id}/files",
+    response_model=schemas.SyncCursorPage[schemas.VectorStoreFile],
+)
+def list_vector_store_files(
+    vector_store_id: str,
+    db: Session = Depends(database.get_db),
+    limit: int = Query(default=20, le=100),
+    order: str = Query(default="desc", regex="^(asc|desc)$"),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    filter: Optional[str] = FileStatusFilter,
+):
+    """
+    List the files of a vector store with optional pagination and ordering.
+    - **filter**: Only return files with this status.
+    """
+    vector_store_files = crud.get_vector_store_files(
+        db,
+        vector_store_id,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+        status=filter,
     )
+    return page_response(vector_store_files, serialize_vector_store_file)
 
-    vector_store_data = [
-        db_to_pydantic_vector_store(store) for store in vector_stores
-    ]
-    paginated_vector_stores = schemas.SyncCursorPage(data=vector_store_data)
 
-    return paginated_vector_stores
+@router.get(
+    "/vector_stores/{vector_store_id}/files/{file_id}",
+    response_model=schemas.VectorStoreFile,
+)
+def read_vector_store_file(
+    vector_store_id: str,
+    file_id: str,
+    db: Session = Depends(database.get_db),
+):
+    vector_store_file = crud.get_vector_store_file(
+        db, vector_store_id, file_id
+    )
+    if vector_store_file is None:
+        raise HTTPException(
+            status_code=404, detail="Vector store file not found"
+        )
+    return row_response(vector_store_file, serialize_vector_store_file)
+
+
+@router.get(
+    "/vector_stores/{vector_store_id}/file_batches/{batch_id}/files",
+    response_model=schemas.SyncCursorPage[schemas.VectorStoreFile],
+)
+def list_vector_store_file_batch_files(
+    vector_store_id: str,
+    batch_id: str,
+    db: Session = Depends(database.get_db),
+    limit: int = Query(default=20, le=100),
+    order: str = Query(default="desc", regex="^(asc|desc)$"),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    filter: Optional[str] = FileStatusFilter,
+):
+    vector_store_files = crud.get_vector_store_files(
+        db,
+        vector_store_id,
+        limit=limit,
+        order=order,
+        after=after,
+        before=before,
+        batch_id=batch_id,
+        status=filter,
+    )
+    return page_response(vector_store_files, serialize_vector_store_file)
@@ -1,177 +1,427 @@
 # crawling.py
 import httpx
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urldefrag, urlparse, urlunparse
+from urllib.robotparser import RobotFileParser
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 import asyncio
-import fitz  # PyMuPDF
-from langchain_text_splitters import (
-    RecursiveCharacterTextSplitter,
-    HTMLHeaderTextSplitter,
-)
-from lib.db.schemas import CrawlInfo
+import hashlib
+import multiprocessing
+import os
+import time
+from lib.db.schemas import CrawlInfo, WebPageState
+from utils.page_parser import ParsedPage, iter_chunks, parse_page
 
+USER_AGENT = "OpenGPTs-WebRetrieval"
+DEFAULT_MAX_PAGES = 1000
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_PER_HOST_DELAY = 0.0  # seconds between requests to the same host
+# processes parsing HTML and PDF pages, 0 parses on the event loop
+DEFAULT_PARSE_WORKERS = min(4, os.cpu_count() or 1)
 
-async def fetch_url(client, url, current_depth, retries=1, timeout=10.0):
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# called with the metadata and the text chunks of every new or changed page
+SuccessCallback = Callable[[CrawlInfo, Iterator[str]], Awaitable[None]]
+LoadPageState = Callable[[str], Awaitable[Optional[WebPageState]]]
+SavePageState = Callable[[WebPageState], Awaitable[None]]
+PageCallback = Callable[[CrawlInfo], Awaitable[None]]
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """
+    Canonical form of a URL used to deduplicate the frontier: drops the
+    fragment, default ports and trailing slashes, lowercases scheme and host.
+    Returns None for URLs that can not be crawled (mailto:, javascript:, ...)
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parsed.hostname:
+        return None
+
+    netloc = parsed.hostname.lower()
+    if parsed.port and parsed.port != DEFAULT_PORTS[scheme]:
+        netloc += f":{parsed.port}"
+    path = parsed.path.rstrip("/") or "/"
+
+    return urlunparse((scheme, netloc, path, parsed.params, parsed.query, ""))
+
+
+class HostLimiter:
+    """Caps the in-flight requests and the request rate for a single host."""
+
+    def __init__(self, max_concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.delay = delay
+        self.lock = asyncio.Lock()
+        self.next_request_at = 0.0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.delay:
+            async with self.lock:
+                wait = self.next_request_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.next_request_at = time.monotonic() + self.delay
+        return self
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+
+async def fetch_url(
+    client, url, current_depth, retries=1, timeout=10.0, headers=None
+) -> Tuple[Optional[httpx.Response], Optional[str]]:
     for attempt in range(retries):
         try:
-            response = await client.get(url, timeout=timeout)
+            response = await client.get(url, timeout=timeout, headers=headers)
+            if response.status_code == 304:
+                print(f"Not modified {url} at depth {current_depth}")
+                return response, None
             response.raise_for_status()
-
-            content_type = response.headers.get("content-type", "").lower()
-            if "application/pdf" in content_type:
-                print(f"Fetched PDF {url} at depth {current_depth}")
-                pdf_content = await fetch_pdf_content(response.content)
-                return pdf_content, None  # Return content with no error
-            else:
-                print(f"Fetched HTML {url} at depth {current_depth}")
-                return response.text, None  # Return content with no error
+            print(f"Fetched {url} at depth {current_depth}")
+            return response, None  # Return response with no error
         except (
             httpx.RequestError,
             httpx.HTTPStatusError,
             httpx.TimeoutException,
         ) as e:
             print(f"Error fetching {url}: {e}")
-            return None, str(e)  # Return no content with error message
+            return None, str(e)  # Return no response with error message
 
     print(f"Failed to fetch {url} after {retries} attempts.")
     return None, "Failed after retries"
 
 
-async def fetch_pdf_content(pdf_bytes):
-    try:
-        document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        text = ""
-        for page in document:
-            text += page.get_text()
-        return text
-    except Exception as e:
-        print(f"Error processing PDF: {e}")
-        return None
+@lru_cache
+def get_parser_pool(max_workers: int) -> ProcessPoolExecutor:
+    # spawn, forking the threaded API process is not safe
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
 
 
-async def process_url(
-    client,
-    url,
-    current_depth,
-    root_url,
-    visited,
-    max_depth,
-    constrain_to_root_domain,
-    success_callback,
-):
-    if url in visited or (max_depth is not None and current_depth > max_depth):
-        return None, None, None
-
-    visited.add(url)
-    content, error = await fetch_url(client, url, current_depth)
-    if content is None and error is not None:
-        crawl_info = CrawlInfo(
-            url=url, content="", error=error, depth=current_depth
+def conditional_headers(page_state: Optional[WebPageState]) -> dict:
+    headers = {}
+    if page_state is None:
+        return headers
+    if page_state.etag:
+        headers["If-None-Match"] = page_state.etag
+    if page_state.last_modified:
+        headers["If-Modified-Since"] = page_state.last_modified
+    return headers
+
+
+class Crawler:
+    """
+    Breadth first crawler over a shared frontier queue.
+
+    A fixed pool of workers bounds the global concurrency, each host has its
+    own concurrency limit and delay, robots.txt is honoured and the crawl
+    stops scheduling pages once `max_pages` URLs have been admitted.
+    """
+
+    def __init__(
+        self,
+        constrain_to_root_domain: bool,
+        max_depth: Optional[int] = None,
+        success_callback: Optional[SuccessCallback] = None,
+        max_pages: int = DEFAULT_MAX_PAGES,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_per_host: int = DEFAULT_MAX_PER_HOST,
+        per_host_delay: float = DEFAULT_PER_HOST_DELAY,
+        respect_robots: bool = True,
+        load_page_state: Optional[LoadPageState] = None,
+        save_page_state: Optional[SavePageState] = None,
+        page_callback: Optional[PageCallback] = None,
+        keep_results: bool = True,
+        parse_workers: int = DEFAULT_PARSE_WORKERS,
+    ):
+        self.constrain_to_root_domain = constrain_to_root_domain
+        self.max_depth = max_depth
+        self.success_callback = success_callback
+        self.max_pages = max_pages
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.per_host_delay = per_host_delay
+        self.respect_robots = respect_robots
+        self.load_page_state = load_page_state
+        self.save_page_state = save_page_state
+        # called with the result of every visited page, successful or not
+        self.page_callback = page_callback
+        # large crawls report through page_callback instead of keeping all
+        # the results in memory
+        self.keep_results = keep_results
+        self.parse_workers = parse_workers
+        # bounds the pages waiting for a parser so that fetching does not
+        # run arbitrarily ahead of parsing
+        self.parse_slots = asyncio.Semaphore(max(parse_workers, 1) * 2)
+
+        self.frontier: asyncio.Queue[Tuple[str, str, int]] = asyncio.Queue()
+        self.visited = set()
+        self.host_limiters: Dict[str, HostLimiter] = {}
+        self.robots: Dict[str, Optional[RobotFileParser]] = {}
+        self.robots_locks: Dict[str, asyncio.Lock] = {}
+        self.all_data: List[CrawlInfo] = []
+        self.stats = {"fetched": 0, "not_modified": 0, "unchanged": 0}
+
+    def create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            headers={"User-Agent": USER_AGENT},
+            follow_redirects=True,
         )
-        return crawl_info, root_url, None
-
-    crawl_info = CrawlInfo(url=url, content=content, depth=current_depth)
-    if success_callback:
-        await success_callback(crawl_info)  # Call the success callback
-
-    if not content.startswith(
-        "%PDF"
-    ):  # PDF content will not contain HTML links
-        soup = BeautifulSoup(content, "lxml")
-        links = [
-            urljoin(url, a_tag["href"])
-            for a_tag in soup.find_all("a", href=True)
-        ]
-        if constrain_to_root_domain:
-            valid_links = [
-                link
-                for link in links
-                if urlparse(link).netloc == urlparse(root_url).netloc
-            ]
-        else:
-            valid_links = links
-        print(f"\nFound {len(valid_links)} valid links on {url}")
-        return crawl_info, root_url, valid_links
-    else:
-        return crawl_info, root_url, []
 
+    async def enqueue(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        root_url: str,
+        depth: int,
+    ) -> bool:
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        if len(self.visited) >= self.max_pages:
+            return False
+        normalized_url = normalize_url(url)
+        if normalized_url is None or normalized_url in self.visited:
+            return False
+        if (
+            self.constrain_to_root_domain
+            and urlparse(normalized_url).netloc
+            != urlparse(normalize_url(root_url) or root_url).netloc
+        ):
+            return False
+        if not await self.is_allowed(client, url):
+            return False
+        # other workers may have admitted pages while robots.txt was checked
+        if (
+            normalized_url in self.visited
+            or len(self.visited) >= self.max_pages
+        ):
+            return False
 
-async def crawl_websites(
-    root_urls,
-    constrain_to_root_domain,
-    max_depth=None,
-    success_callback=None,
-) -> list[CrawlInfo]:
-    visited = set()
-    queue = [(url, url, 0) for url in root_urls]  # (url, root_url, depth)
-    all_data = []
-
-    async with httpx.AsyncClient() as client:
-        while queue:
-            print("\n\nQueue:\n", queue)
-            tasks = [
-                process_url(
-                    client,
-                    url,
-                    depth,
-                    root_url,
-                    visited,
-                    max_depth,
-                    constrain_to_root_domain,
-                    success_callback,
+        # the normalized form is only used to deduplicate, the page is
+        # fetched as linked to avoid a redirect on servers that want the slash
+        self.visited.add(normalized_url)
+        self.frontier.put_nowait((urldefrag(url).url, root_url, depth))
+        return True
+
+    def host_limiter(self, url: str) -> HostLimiter:
+        host = urlparse(url).netloc.lower()
+        if host not in self.host_limiters:
+            self.host_limiters[host] = HostLimiter(
+                self.max_per_host, self.per_host_delay
+            )
+        return self.host_limiters[host]
+
+    async def is_allowed(self, client: httpx.AsyncClient, url: str) -> bool:
+        if not self.respect_robots:
+            return True
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if host not in self.robots_locks:
+            self.robots_locks[host] = asyncio.Lock()
+        async with self.robots_locks[host]:
+            if host not in self.robots:
+                self.robots[host] = await self.fetch_robots(
+                    client, f"{parsed.scheme}://{host}/robots.txt"
                 )
-                for url, root_url, depth in queue
-            ]
-            results = await asyncio.gather(*tasks)
-
-            new_queue = []
-            for data, root_url, links in results:
-                if data is not None:
-                    all_data.append(data)
-                    if links is not None:
-                        new_queue.extend(
-                            (link, root_url, data.depth + 1) for link in links
-                        )
-
-            queue = new_queue
-
-    return all_data
-
-
-# Placeholder function for preprocessing content
-def content_preprocess(crawl_info: CrawlInfo):
-    chunk_size = 2000
-    chunk_overlap = 200
-    documents = []
-    if crawl_info.url.endswith(".pdf"):
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            is_separator_regex=False,
-        )
+        robots = self.robots[host]
+        return robots is None or robots.can_fetch(USER_AGENT, url)
+
+    async def fetch_robots(
+        self, client: httpx.AsyncClient, robots_url: str
+    ) -> Optional[RobotFileParser]:
+        try:
+            response = await client.get(robots_url, timeout=10.0)
+        except httpx.RequestError as e:
+            print(f"Error fetching {robots_url}: {e}")
+            return None
+        if response.status_code >= 400:
+            return None  # no robots.txt, everything is allowed
 
-        documents = text_splitter.create_documents([crawl_info.content])
+        robots = RobotFileParser(robots_url)
+        robots.parse(response.text.splitlines())
+        crawl_delay = robots.crawl_delay(USER_AGENT)
+        if crawl_delay:
+            limiter = self.host_limiter(robots_url)
+            limiter.delay = max(limiter.delay, float(crawl_delay))
+        return robots
 
-    else:  # if is HTML content
-        headers_to_split_on = [("h1", "Header 1"), ("h2", "Header 2")]
-        splitter = HTMLHeaderTextSplitter(
-            headers_to_split_on=headers_to_split_on
-        )
-        header_split_docs = splitter.split_text(crawl_info.content)
+    async def process_url(
+        self, client: httpx.AsyncClient, url: str, root_url: str, depth: int
+    ) -> Tuple[CrawlInfo, List[str]]:
+        page_state = None
+        if self.load_page_state:
+            page_state = await self.load_page_state(url)
+
+        async with self.host_limiter(url):
+            response, error = await fetch_url(
+                client, url, depth, headers=conditional_headers(page_state)
+            )
+        if response is None:
+            crawl_info = CrawlInfo(
+                url=url, content="", error=error or "No content", depth=depth
+            )
+            return crawl_info, []
+
+        # Pages that did not change since the last crawl are neither parsed
+        # nor indexed again, their links are replayed from the stored state
+        if response.status_code == 304 and page_state is not None:
+            self.stats["not_modified"] += 1
+            return (
+                CrawlInfo(url=url, content="", depth=depth),
+                page_state.links,
+            )
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if page_state is not None and page_state.content_hash == content_hash:
+            self.stats["unchanged"] += 1
+            await self.save(url, response, content_hash, page_state.links)
+            return (
+                CrawlInfo(url=url, content="", depth=depth),
+                page_state.links,
+            )
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        try:
+            parsed_page = await self.parse(response)
+        except Exception as e:
+            print(f"Error parsing {url}: {e}")
+            crawl_info = CrawlInfo(
+                url=url, content="", error=f"No content: {e}", depth=depth
+            )
+            return crawl_info, []
+
+        self.stats["fetched"] += 1
+        # the page text goes straight to the indexer as chunks, only the
+        # metadata of a page is kept for the rest of the crawl
+        crawl_info = CrawlInfo(url=url, content="", depth=depth)
+        indexed = True
+        if self.success_callback:
+            try:
+                await self.success_callback(
+                    crawl_info, iter_chunks(parsed_page)
+                )
+            except Exception as e:
+                print(f"Error during callback for URL {url}: {e}")
+                crawl_info.error = str(e)
+                indexed = False
+
+        links = parsed_page.links
+        print(f"\nFound {len(links)} links on {url}")
+        if indexed:  # otherwise the next crawl has to index it again
+            await self.save(url, response, content_hash, links)
+        return crawl_info, links
+
+    async def parse(self, response: httpx.Response) -> ParsedPage:
+        args = (
+            response.content,
+            str(response.url),
+            response.headers.get("content-type", ""),
+            response.charset_encoding,
         )
-        documents = text_splitter.split_documents(header_split_docs)
+        if not self.parse_workers:
+            return parse_page(*args)
+
+        async with self.parse_slots:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    get_parser_pool(self.parse_workers), parse_page, *args
+                )
+            except BrokenProcessPool:
+                # a parser process died, e.g. on a malformed PDF
+                get_parser_pool(self.parse_workers).shutdown(wait=False)
+                get_parser_pool.cache_clear()
+                raise
 
-    crawl_info_docs = [
-        CrawlInfo(
-            url=crawl_info.url,
-            content=doc.page_content,
-            depth=crawl_info.depth,
+    async def save(
+        self,
+        url: str,
+        response: httpx.Response,
+        content_hash: str,
+        links: List[str],
+    ):
+        if not self.save_page_state:
+            return
+        await self.save_page_state(
+            WebPageState(
+                url=url,
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+                content_hash=content_hash,
+                links=links,
+            )
         )
-        for doc in documents
-    ]
 
-    return crawl_info_docs
+    async def worker(self, client: httpx.AsyncClient):
+        while True:
+            url, root_url, depth = await self.frontier.get()
+            try:
+                crawl_info, links = await self.process_url(
+                    client, url, root_url, depth
+                )
+                await self.record(crawl_info)
+                for link in links:
+                    await self.enqueue(client, link, root_url, depth + 1)
+            except Exception as e:
+                print(f"Error crawling {url}: {e}")
+                await self.record(
+                    CrawlInfo(url=url, content="", error=str(e), depth=depth)
+                )
+            finally:
+                self.frontier.task_done()
+
+    async def record(self, crawl_info: CrawlInfo):
+        if self.keep_results:
+            self.all_data.append(crawl_info)
+        if self.page_callback:
+            try:
+                await self.page_callback(crawl_info)
+            except Exception as e:
+                print(f"Error recording URL {crawl_info.url}: {e}")
+
+    async def crawl(self, root_urls: List[str]) -> List[CrawlInfo]:
+        async with self.create_client() as client:
+            for url in root_urls:
+                await self.enqueue(client, url, url, 0)
+            workers = [
+                asyncio.create_task(self.worker(client))
+                for _ in range(self.max_concurrency)
+            ]
+            try:
+                await self.frontier.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        print(f"\nCrawl stats: {self.stats}")
+        return self.all_data
+
+
+async def crawl_websites(
+    root_urls,
+    constrain_to_root_domain,
+    max_depth=None,
+    success_callback=None,
+    max_pages=DEFAULT_MAX_PAGES,
+    **crawler_options,
+) -> list[CrawlInfo]:
+    crawler = Crawler(
+        constrain_to_root_domain,
+        max_depth=max_depth,
+        success_callback=success_callback,
+        max_pages=max_pages,
+        **crawler_options,
+    )
+    return await crawler.crawl(root_urls)
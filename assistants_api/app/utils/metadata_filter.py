@@ -0,0 +1,26 @@
+from typing import Dict
+import re
+from fastapi import HTTPException, Request
+
+METADATA_PARAM = re.compile(r"^metadata\[(.+)\]$")
+MAX_METADATA_FILTERS = 16  # objects hold at most 16 metadata pairs
+
+
+def metadata_filter(request: Request) -> Dict[str, str]:
+    """
+    Dependency collecting `metadata[key]=value` query parameters, e.g.
+    `GET /threads?metadata[tenant]=acme`, into the pairs the listed objects'
+    metadata must contain.
+    """
+    metadata = {}
+    for name, value in request.query_params.multi_items():
+        match = METADATA_PARAM.match(name)
+        if match:
+            metadata[match.group(1)] = value
+    if len(metadata) > MAX_METADATA_FILTERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_METADATA_FILTERS} metadata filters "
+            "are supported",
+        )
+    return metadata
@@ -0,0 +1,147 @@
+# page_parser.py
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import urljoin
+import re
+import fitz  # PyMuPDF
+from lxml import etree
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 200
+
+SECTION_ORDER = ["h1", "h2"]
+SECTION_TAGS = set(SECTION_ORDER)
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "head", "svg"}
+BLOCK_TAGS = set(
+    "address article aside blockquote br dd div dl dt fieldset figcaption "
+    "figure footer form h3 h4 h5 h6 header hr li main nav ol p pre section "
+    "table td th tr ul".split()
+)
+WHITESPACE = re.compile(r"[ \t\r\f\v]+")
+
+
+class ParsedPage(NamedTuple):
+    links: List[str]
+    # (headers, text) for each h1/h2 delimited section of the page
+    sections: List[Tuple[Tuple[str, ...], str]]
+
+
+class HTMLPageTarget:
+    """
+    lxml parser target collecting links and header sectioned text while the
+    document is parsed, without building a tree.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.links: List[str] = []
+        self.sections: List[Tuple[Tuple[str, ...], str]] = []
+        self.headers = {}
+        self.header_tag: Optional[str] = None
+        self.header_text: List[str] = []
+        self.text: List[str] = []
+        self.skip_depth = 0
+
+    def start(self, tag, attrib):
+        tag = tag.lower() if isinstance(tag, str) else tag
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag == "a" and attrib.get("href"):
+            self.links.append(urljoin(self.url, attrib["href"].strip()))
+        elif tag in SECTION_TAGS and not self.skip_depth:
+            self.flush()
+            self.header_tag = tag
+            self.header_text = []
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else tag
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag == self.header_tag:
+            if tag == "h1":
+                self.headers = {}
+            self.headers[tag] = " ".join("".join(self.header_text).split())
+            self.header_tag = None
+        if tag in BLOCK_TAGS:
+            self.text.append("\n")
+
+    def data(self, data):
+        if self.skip_depth:
+            return
+        if self.header_tag:
+            self.header_text.append(data)
+        else:
+            self.text.append(data)
+
+    def comment(self, text):
+        pass
+
+    def flush(self):
+        lines = (
+            WHITESPACE.sub(" ", line).strip()
+            for line in "".join(self.text).splitlines()
+        )
+        text = "\n".join(line for line in lines if line)
+        self.text = []
+        if text:
+            headers = [self.headers.get(tag) for tag in SECTION_ORDER]
+            self.sections.append((tuple(filter(None, headers)), text))
+
+    def close(self) -> ParsedPage:
+        self.flush()
+        return ParsedPage(links=self.links, sections=self.sections)
+
+
+def parse_html(
+    content: bytes, url: str, encoding: Optional[str] = None
+) -> ParsedPage:
+    """
+    Extracts the links and the h1/h2 sections of a page in a single pass.
+    """
+    parser = etree.HTMLParser(
+        target=HTMLPageTarget(url), encoding=encoding, recover=True
+    )
+    parser.feed(content)
+    return parser.close()
+
+
+def parse_pdf(content: bytes) -> ParsedPage:
+    document = fitz.open(stream=content, filetype="pdf")
+    try:
+        text = "".join(page.get_text() for page in document)
+    finally:
+        document.close()
+    # PDF content will not contain links
+    return ParsedPage(links=[], sections=[((), text)] if text else [])
+
+
+def parse_page(
+    content: bytes, url: str, content_type: str, encoding: Optional[str]
+) -> ParsedPage:
+    """
+    Parses a fetched page according to its type. Takes and returns only
+    picklable values so that it can run in a process pool.
+    """
+    if "application/pdf" in content_type.lower() or content.startswith(
+        b"%PDF"
+    ):
+        return parse_pdf(content)
+    return parse_html(content, url, encoding)
+
+
+def iter_chunks(
+    parsed_page: ParsedPage,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Iterator[str]:
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    for headers, text in parsed_page.sections:
+        # each chunk starts with the headers of its section, which would be
+        # lost otherwise once the section is split
+        heading = " > ".join(headers)
+        for chunk in text_splitter.split_text(text):
+            yield f"{heading}\n{chunk}" if heading else chunk
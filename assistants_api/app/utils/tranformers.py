@@ -1,3 +1,6 @@
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import inspect
 from lib.db import models
 from lib.db import schemas
 
@@ -21,6 +24,8 @@ def db_to_pydantic_thread(
     del thread_dict["_sa_instance_state"]
     thread_dict["metadata"] = thread_dict["_metadata"]
     del thread_dict["_metadata"]
+    thread_dict.pop("locked_by", None)
+    thread_dict.pop("lease_until", None)
     return schemas.Thread(**thread_dict)
 
 
@@ -75,3 +80,95 @@ def db_to_pydantic_vector_store_file_batch(
     vector_store_file_batch_dict = vector_store_file_batch_dict.copy()
     del vector_store_file_batch_dict["_sa_instance_state"]
     return schemas.VectorStoreFileBatch(**vector_store_file_batch_dict)
+
+
+def db_to_pydantic_vector_store_file(
+    db_vector_store_file: models.VectorStoreFile,
+) -> schemas.VectorStoreFile:
+    vector_store_file_dict = db_vector_store_file.__dict__
+    vector_store_file_dict = vector_store_file_dict.copy()
+    del vector_store_file_dict["_sa_instance_state"]
+    del vector_store_file_dict["batch_id"]
+    return schemas.VectorStoreFile(**vector_store_file_dict)
+
+
+def db_to_pydantic_crawl_job(
+    db_crawl_job: models.CrawlJob,
+) -> schemas.CrawlJob:
+    crawl_job_dict = db_crawl_job.__dict__
+    crawl_job_dict = crawl_job_dict.copy()
+    del crawl_job_dict["_sa_instance_state"]
+    return schemas.CrawlJob(**crawl_job_dict)
+
+
+def db_to_pydantic_crawl_page(
+    db_crawl_page: models.CrawlPage,
+) -> schemas.CrawlPage:
+    crawl_page_dict = db_crawl_page.__dict__
+    crawl_page_dict = crawl_page_dict.copy()
+    del crawl_page_dict["_sa_instance_state"]
+    return schemas.CrawlPage(**crawl_page_dict)
+
+
+# Fast path for responses: rows are mapped column by column to the fields of
+# their API object and encoded with orjson, without building the pydantic
+# models and validating them a second time against the response_model. The
+# rows come from crud, which only writes values the schemas accept.
+
+
+class RowSerializer:
+    """
+    Maps the columns of a model to the JSON fields of its API object, e.g.
+    the `_metadata` attribute to the `metadata` field.
+    """
+
+    def __init__(
+        self,
+        model,
+        exclude: Tuple[str, ...] = (),
+        defaults: Optional[Dict] = None,
+    ):
+        self.fields = [
+            (attr.key, attr.columns[0].name)
+            for attr in inspect(model).column_attrs
+            if attr.columns[0].name not in exclude
+        ]
+        self.defaults = defaults or {}
+
+    def __call__(self, db_object) -> dict:
+        loaded = db_object.__dict__
+        row = self.defaults.copy()
+        for key, name in self.fields:
+            row[name] = (
+                loaded[key] if key in loaded else getattr(db_object, key)
+            )
+        return row
+
+
+serialize_assistant = RowSerializer(models.Assistant)
+serialize_thread = RowSerializer(
+    models.Thread,
+    exclude=("locked_by", "lease_until"),
+    defaults={"tool_resources": None},
+)
+serialize_message = RowSerializer(models.Message)
+serialize_run = RowSerializer(models.Run)
+serialize_runstep = RowSerializer(models.RunStep)
+serialize_vector_store = RowSerializer(models.VectorStore)
+serialize_vector_store_file_batch = RowSerializer(models.VectorStoreFileBatch)
+serialize_vector_store_file = RowSerializer(
+    models.VectorStoreFile, exclude=("batch_id",)
+)
+
+
+def row_response(db_object, serializer: Callable[..., dict]) -> ORJSONResponse:
+    return ORJSONResponse(serializer(db_object))
+
+
+def page_response(
+    db_objects: Iterable, serializer: Callable[..., dict]
+) -> ORJSONResponse:
+    """Response of a list endpoint, shaped like a SyncCursorPage."""
+    return ORJSONResponse(
+        {"data": [serializer(db_object) for db_object in db_objects]}
+    )
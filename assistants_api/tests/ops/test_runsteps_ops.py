@@ -120,7 +120,7 @@ def test_create_multiple_run_steps(
     requests.post(create_url, json=step_data_message)
 
     response = openai_client.beta.threads.runs.steps.list(
-        thread_id=thread_id, run_id=run_id
+        thread_id=thread_id, run_id=run_id, order="asc"
     )
     assert response is not None
     assert len(response.data) == 2
@@ -133,3 +133,48 @@ def test_create_multiple_run_steps(
         response.data[1].step_details.message_creation.message_id
         == "msg_6iTjazdBj74xg3yVbjrZye9P"
     )
+
+
+@pytest.mark.dependency(depends=["test_create_run_step"])
+def test_paginate_run_steps(
+    openai_client: OpenAI, assistant_id: str, thread_id: str, run_id: str
+):
+    create_url = (
+        f"http://localhost:8000/ops/threads/{thread_id}/runs/{run_id}/steps"
+    )
+    step_data = {
+        "assistant_id": assistant_id,
+        "type": "tool_calls",
+        "status": "in_progress",
+        "step_details": {"tool_calls": [], "type": "tool_calls"},
+    }
+    # steps created within the same second must still have a stable order
+    step_ids = [
+        requests.post(create_url, json=step_data).json()["id"]
+        for _ in range(25)
+    ]
+    assert step_ids == sorted(step_ids)
+
+    for order, expected in [("asc", step_ids), ("desc", step_ids[::-1])]:
+        listed = []
+        after = None
+        while True:
+            params = {"after": after} if after else {}
+            page = openai_client.beta.threads.runs.steps.list(
+                thread_id=thread_id,
+                run_id=run_id,
+                order=order,
+                limit=10,
+                **params,
+            )
+            listed += [step.id for step in page.data]
+            if len(page.data) < 10:
+                break
+            after = page.data[-1].id
+        assert listed == expected
+
+    # before returns the steps preceding the cursor in the requested order
+    page = openai_client.beta.threads.runs.steps.list(
+        thread_id=thread_id, run_id=run_id, order="asc", before=step_ids[5]
+    )
+    assert [step.id for step in page.data] == step_ids[:5]
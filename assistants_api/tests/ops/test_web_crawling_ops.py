@@ -1,5 +1,8 @@
 from openai import OpenAI
 import pytest
+import requests
+import json
+import time
 import weaviate
 import os
 
@@ -93,3 +96,87 @@ def test_change_description_and_delete_collection(
 
     config = collection.config.get()
     assert not (config.description == test_description)
+
+
+def wait_for_crawl_job(job_id: str, timeout: float = 120) -> dict:
+    deadline = time.time() + timeout
+    while True:
+        response = requests.get(f"{base_url}/ops/web_retrieval/jobs/{job_id}")
+        assert response.status_code == 200
+        crawl_job = response.json()
+        if crawl_job["status"] not in ["queued", "in_progress"]:
+            return crawl_job
+        assert time.time() < deadline
+        time.sleep(1)
+
+
+@pytest.mark.dependency()
+def test_crawl_job():
+    response = requests.post(
+        f"{base_url}/ops/web_retrieval/jobs",
+        json={
+            "root_urls": ["https://quotes.toscrape.com/"],
+            "constrain_to_root_domain": True,
+            "max_depth": 1,
+            "max_pages": 20,
+        },
+    )
+    assert response.status_code == 200
+    crawl_job = response.json()
+    assert crawl_job["id"].startswith("crawl_")
+    assert crawl_job["status"] in ["queued", "in_progress"]
+
+    # pages are streamed while the job runs and the stream ends with it
+    with requests.get(
+        f"{base_url}/ops/web_retrieval/jobs/{crawl_job['id']}/pages/stream",
+        stream=True,
+    ) as stream:
+        streamed = [json.loads(line) for line in stream.iter_lines() if line]
+
+    crawl_job = wait_for_crawl_job(crawl_job["id"])
+    assert crawl_job["status"] == "completed"
+    assert crawl_job["pages_crawled"] == len(streamed) == 20
+
+    pages = []
+    after = None
+    while True:
+        params = {"limit": 8, **({"after": after} if after else {})}
+        response = requests.get(
+            f"{base_url}/ops/web_retrieval/jobs/{crawl_job['id']}/pages",
+            params=params,
+        )
+        assert response.status_code == 200
+        data = response.json()["data"]
+        if not data:
+            break
+        pages += data
+        after = data[-1]["id"]
+    assert [page["url"] for page in pages] == [
+        page["url"] for page in streamed
+    ]
+
+
+@pytest.mark.dependency(depends=["test_crawl_job"])
+def test_cancel_crawl_job():
+    response = requests.post(
+        f"{base_url}/ops/web_retrieval/jobs",
+        json={
+            "root_urls": ["https://quotes.toscrape.com/"],
+            "constrain_to_root_domain": True,
+            "max_depth": 5,
+        },
+    )
+    job_id = response.json()["id"]
+
+    response = requests.post(
+        f"{base_url}/ops/web_retrieval/jobs/{job_id}/cancel"
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == "cancelled"
+    assert response.json()["cancelled_at"] is not None
+
+    crawl_job = wait_for_crawl_job(job_id)
+    assert crawl_job["status"] == "cancelled"
+
+    response = requests.get(f"{base_url}/ops/web_retrieval/jobs/not_a_job")
+    assert response.status_code == 404
@@ -5,6 +5,7 @@ from openai.types.beta.assistant import Assistant
 from openai.types.beta.code_interpreter_tool import CodeInterpreterTool
 from datetime import datetime
 import os
+import uuid
 
 api_key = os.getenv("OPENAI_API_KEY") if os.getenv("OPENAI_API_KEY") else None
 use_openai = True if os.getenv("USE_OPENAI") else False
@@ -190,3 +191,46 @@ def test_delete_assistant(openai_client: OpenAI):
         assert "No assistant found" in str(e)
     else:
         raise AssertionError("Assistant was not deleted")
+
+
+@pytest.mark.skipif(
+    use_openai, reason="OpenAI API does not report SQL statements"
+)
+@pytest.mark.dependency(depends=["test_create_assistant"])
+def test_assistant_writes_statement_count(openai_client: OpenAI):
+    assistants = openai_client.beta.assistants.with_raw_response
+
+    response = assistants.create(model="gpt-4", metadata={"a": "1"})
+    assert int(response.headers["X-SQL-Statements"]) == 1
+    assistant = response.parse()
+
+    # a single UPDATE ... RETURNING, metadata is merged in SQL
+    response = assistants.update(
+        assistant.id, name="Renamed", metadata={"b": "2"}
+    )
+    assert int(response.headers["X-SQL-Statements"]) == 1
+    updated_assistant = response.parse()
+    assert updated_assistant.name == "Renamed"
+    assert updated_assistant.metadata == {"a": "1", "b": "2"}
+
+    response = assistants.delete(assistant.id)
+    assert int(response.headers["X-SQL-Statements"]) == 1
+
+
+@pytest.mark.skipif(
+    use_openai, reason="OpenAI API does not filter by metadata"
+)
+@pytest.mark.dependency(depends=["test_create_assistant"])
+def test_list_assistants_by_metadata(openai_client: OpenAI):
+    tenant = uuid.uuid4().hex
+    assistant = openai_client.beta.assistants.create(
+        model="gpt-4", metadata={"tenant": tenant}
+    )
+    openai_client.beta.assistants.create(
+        model="gpt-4", metadata={"tenant": "other"}
+    )
+
+    response = openai_client.beta.assistants.list(
+        extra_query={"metadata[tenant]": tenant}
+    )
+    assert [a.id for a in response.data] == [assistant.id]
@@ -1,8 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 import pytest
 from openai import OpenAI
 from openai.types import FileObject
 from minio import Minio
 import os
+import statistics
+import time
 
 api_key = os.getenv("OPENAI_API_KEY") if os.getenv("OPENAI_API_KEY") else None
 weaviate_url = os.getenv("WEAVIATE_URL") if os.getenv("WEAVIATE_URL") else None
@@ -113,3 +117,43 @@ def test_delete_file(openai_client: OpenAI):
     # Step 4: Attempt to retrieve the deleted file
     with pytest.raises(Exception):
         openai_client.files.retrieve(create_response.id)
+
+
+@pytest.mark.dependency(depends=["test_create_file", "test_retrieve_file"])
+def test_retrieve_file_latency_during_uploads(openai_client: OpenAI):
+    with open(test_txt_file_path, 'rb') as file:
+        file_created = openai_client.files.create(
+            file=file, purpose="assistants"
+        )
+
+    def retrieve_latencies(amount: int) -> List[float]:
+        latencies = []
+        for _ in range(amount):
+            start = time.perf_counter()
+            openai_client.files.retrieve(file_created.id)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    baseline = statistics.median(retrieve_latencies(10))
+
+    large_file = os.urandom(32 * 1024 * 1024)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        uploads = [
+            executor.submit(
+                openai_client.files.create,
+                file=(f"large_{i}.txt", large_file),
+                purpose="assistants",
+            )
+            for i in range(4)
+        ]
+        under_load = statistics.median(retrieve_latencies(10))
+        for upload in uploads:
+            assert upload.result().bytes == len(large_file)
+
+    print(
+        f"\nGET /files/{{id}} median: {baseline:.4f}s idle, "
+        f"{under_load:.4f}s during uploads"
+    )
+    # blocking I/O on the event loop would make each GET wait for whole
+    # uploads to be stored, which takes orders of magnitude longer
+    assert under_load < max(baseline * 5, baseline + 0.25)
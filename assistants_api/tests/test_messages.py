@@ -1,6 +1,7 @@
 import pytest
 from openai import OpenAI
 import os
+import requests
 import time
 
 api_key = os.getenv("OPENAI_API_KEY") if os.getenv("OPENAI_API_KEY") else None
@@ -109,6 +110,64 @@ def test_create_thread_with_message(openai_client: OpenAI):
     assert get_messages.data[0].metadata == message_data["metadata"]
 
 
+@pytest.mark.dependency(depends=["test_create_thread_with_message"])
+def test_create_thread_with_many_messages_keeps_order(openai_client: OpenAI):
+    contents = [f"Message {i}" for i in range(12)]
+    create_thread = openai_client.beta.threads.create(
+        messages=[{"role": "user", "content": content} for content in contents]
+    )
+    assert create_thread.id.startswith("thread_")
+
+    get_messages = openai_client.beta.threads.messages.list(
+        thread_id=create_thread.id, order="asc"
+    )
+
+    assert [m.content[0].text.value for m in get_messages.data] == contents
+    assert all(m.id.startswith("msg_") for m in get_messages.data)
+    # seconds, like every other created_at
+    assert abs(get_messages.data[0].created_at - time.time()) < 60
+
+
+@pytest.mark.dependency(depends=["test_get_messages_in_thread"])
+def test_create_message_batch(openai_client: OpenAI, thread_id: str):
+    contents = [f"Imported message {i}" for i in range(50)]
+    response = requests.post(
+        f"{base_url}/threads/{thread_id}/messages/batch",
+        json={
+            "messages": [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": content,
+                }
+                for i, content in enumerate(contents)
+            ]
+        },
+    )
+    assert response.status_code == 200
+    created = response.json()["data"]
+    assert [m["content"][0]["text"]["value"] for m in created] == contents
+    assert created[1]["role"] == "assistant"
+
+    listed = []
+    after = None
+    while True:
+        params = {"after": after} if after else {}
+        page = openai_client.beta.threads.messages.list(
+            thread_id=thread_id, order="asc", limit=100, **params
+        )
+        listed += page.data
+        if len(page.data) < 100:
+            break
+        after = page.data[-1].id
+    assert [m.id for m in listed][-50:] == [m["id"] for m in created]
+
+    response = requests.post(
+        f"{base_url}/threads/not_a_thread/messages/batch",
+        json={"messages": [{"role": "user", "content": "Hello"}]},
+    )
+    assert response.status_code == 404
+
+
 @pytest.mark.dependency(
     depends=["test_create_message_in_thread", "test_get_messages_in_thread"]
 )
@@ -1,7 +1,8 @@
 import pytest
-from openai import OpenAI
+from openai import BadRequestError, OpenAI
 from openai.types.beta.threads import Run
 import os
+import requests
 import time
 
 api_key = os.getenv("OPENAI_API_KEY") if os.getenv("OPENAI_API_KEY") else None
@@ -88,6 +89,19 @@ def run_id_and_thread_id(
     return (response.id, thread_id)
 
 
+@pytest.mark.dependency(depends=["test_create_run"])
+def test_create_run_while_active(
+    openai_client: OpenAI, run_id_and_thread_id: tuple, assistant_id: str
+):
+    # a thread has at most one active run
+    with pytest.raises(BadRequestError) as e:
+        openai_client.beta.threads.runs.create(
+            thread_id=run_id_and_thread_id[1],
+            assistant_id=assistant_id,
+        )
+    assert "already has an active run" in str(e.value)
+
+
 @pytest.mark.dependency(depends=["test_create_run"])
 def test_get_run(openai_client: OpenAI, run_id_and_thread_id: tuple):
     response = openai_client.beta.threads.runs.retrieve(
@@ -140,6 +154,32 @@ def test_cancel_run(openai_client: OpenAI, run_id_and_thread_id: tuple):
     assert post_cancel_run_response.status in ["cancelling", "cancelled"]
 
 
+@pytest.mark.skipif(use_openai, reason="OpenAI API does not long-poll runs")
+@pytest.mark.dependency(depends=["test_create_run", "test_get_run"])
+def test_cancelled_run_is_stopped(
+    openai_client: OpenAI, assistant_id: str, thread_id: str
+):
+    openai_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content="Write a long essay about the Apollo program.",
+    )
+    response = openai_client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+    )
+    openai_client.beta.threads.runs.cancel(
+        thread_id=thread_id, run_id=response.id
+    )
+
+    # the worker marks the run cancelled instead of completing it
+    response = openai_client.beta.threads.runs.retrieve(
+        thread_id=thread_id, run_id=response.id, extra_query={"wait": 30}
+    )
+    assert response.status == "cancelled"
+    assert response.cancelled_at is not None
+
+
 @pytest.mark.dependency(depends=["test_create_run", "test_get_run"])
 def test_run_execution(
     openai_client: OpenAI, assistant_id: str, thread_id: str
@@ -181,6 +221,70 @@ def test_run_execution(
     assert "1969" in messages.data[0].content[0].text.value
 
 
+@pytest.mark.skipif(use_openai, reason="OpenAI API does not long-poll runs")
+@pytest.mark.dependency(depends=["test_create_run", "test_get_run"])
+def test_run_long_poll(
+    openai_client: OpenAI, assistant_id: str, thread_id: str
+):
+    openai_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content="What year was the Apollo 11 moon landing (answer concisely)",
+    )
+    response = openai_client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+    )
+    assert response.status == "queued"
+
+    # requests wait for the run to settle instead of polling every second
+    requests_made = 0
+    start = time.time()
+    while response.status in ["queued", "in_progress"]:
+        assert time.time() - start < 60, "Run did not complete in time."
+        response = openai_client.beta.threads.runs.retrieve(
+            thread_id=thread_id,
+            run_id=response.id,
+            extra_query={"wait": 30},
+        )
+        requests_made += 1
+
+    assert response.status == "completed"
+    assert requests_made <= 3
+
+    # settled runs are returned without waiting
+    start = time.time()
+    openai_client.beta.threads.runs.retrieve(
+        thread_id=thread_id, run_id=response.id, extra_query={"wait": 30}
+    )
+    assert time.time() - start < 5
+
+
+@pytest.mark.skipif(use_openai, reason="OpenAI API has no run priorities")
+@pytest.mark.dependency(depends=["test_create_run", "test_get_run"])
+def test_batch_run(openai_client: OpenAI, assistant_id: str, thread_id: str):
+    openai_client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content="What year was the Apollo 11 moon landing (answer concisely)",
+    )
+    response = openai_client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        metadata={"priority": "batch", "tenant": "tests"},
+    )
+    response = openai_client.beta.threads.runs.retrieve(
+        thread_id=thread_id, run_id=response.id, extra_query={"wait": 60}
+    )
+    assert response.status == "completed"
+
+    response = requests.get(f"{base_url}/ops/run_queues")
+    assert response.status_code == 200
+    queues = {queue["priority"]: queue for queue in response.json()["data"]}
+    assert set(queues) == {"interactive", "batch"}
+    assert queues["batch"]["pending"] >= 0
+
+
 @pytest.mark.dependency(depends=["test_create_run", "test_get_run"])
 def test_run_instruction_following(
     openai_client: OpenAI, assistant_id: str, thread_id: str
@@ -2,7 +2,9 @@ import pytest
 from openai import OpenAI
 from openai.types.beta.thread import Thread
 import os
+import requests
 import time
+import uuid
 
 api_key = os.getenv("OPENAI_API_KEY") if os.getenv("OPENAI_API_KEY") else None
 use_openai = True if os.getenv("USE_OPENAI") else False
@@ -84,6 +86,50 @@ def test_delete_thread(openai_client: OpenAI, thread_id: str):
         raise AssertionError("Thread was not deleted")
 
 
+@pytest.mark.skipif(use_openai, reason="OpenAI API does not list threads")
+@pytest.mark.dependency(depends=["test_create_thread_without_messages"])
+def test_list_threads_by_metadata(openai_client: OpenAI):
+    tenant = uuid.uuid4().hex
+    threads = [
+        openai_client.beta.threads.create(
+            metadata={"tenant": tenant, "index": str(i)}
+        )
+        for i in range(3)
+    ]
+    openai_client.beta.threads.create(metadata={"tenant": "other"})
+
+    response = requests.get(
+        f"{base_url}/threads", params={"metadata[tenant]": tenant}
+    )
+    assert response.status_code == 200
+    assert [thread["id"] for thread in response.json()["data"]] == [
+        thread.id for thread in reversed(threads)
+    ]
+
+    # every pair has to match
+    response = requests.get(
+        f"{base_url}/threads",
+        params={"metadata[tenant]": tenant, "metadata[index]": "1"},
+    )
+    assert [thread["id"] for thread in response.json()["data"]] == [
+        threads[1].id
+    ]
+
+    # pagination applies to the filtered threads
+    response = requests.get(
+        f"{base_url}/threads",
+        params={
+            "metadata[tenant]": tenant,
+            "limit": 1,
+            "order": "asc",
+            "after": threads[0].id,
+        },
+    )
+    assert [thread["id"] for thread in response.json()["data"]] == [
+        threads[1].id
+    ]
+
+
 # @pytest.fixture(scope="session", autouse=True)
 # def cleanup(request):
 #     # THIS REQUIRES A WAY TO RETIREVE ALL THREADS WHICH CURRENTLY DOES NOT EXIST IN THE API # noqa
@@ -3,7 +3,6 @@ from openai import OpenAI
 from openai.types.beta.vector_store import VectorStore
 import os
 import weaviate
-import json
 import time
 
 api_key = os.getenv("OPENAI_API_KEY") if os.getenv("OPENAI_API_KEY") else None
@@ -96,11 +95,7 @@ def test_create_vector_store(openai_client: OpenAI):
     assert response.status == "completed"
     assert response.file_counts.total == 0
     assert response.usage_bytes == 0
-    if not use_openai:
-        assert response.metadata == {
-            "example_key": "example_value",
-            "_file_ids": "[]",
-        }
+    assert response.metadata == {"example_key": "example_value"}
 
 
 @pytest.mark.dependency(depends=["test_create_vector_store"])
@@ -135,12 +130,8 @@ def test_create_vector_store_with_files(
 
     assert isinstance(response, VectorStore)
     assert response.id is not None
-    if not use_openai:
-        assert response.metadata == {
-            "example_key": "example_value",
-            "_file_ids": "[]",
-        }
-    # assert response.file_counts.total == 2
+    assert response.metadata == {"example_key": "example_value"}
+    assert response.file_counts.total == 2
 
     # wait untill uploads are completed
     max_checks = 5
@@ -161,15 +152,22 @@ def test_create_vector_store_with_files(
 
     assert response.usage_bytes > 4000
 
+    vector_store_files = openai_client.beta.vector_stores.files.list(
+        response.id, order="asc"
+    )
+    assert [f.id for f in vector_store_files.data] == sorted(
+        [file_txt.id, file_pdf.id]
+    )
+    assert all(f.status == "completed" for f in vector_store_files.data)
+    assert sum(f.usage_bytes for f in vector_store_files.data) == (
+        response.usage_bytes
+    )
+
     if not use_openai:
         assert (
             weaviate_client.collections.exists(id_to_string(response.id))
             is True
         )
-        assert "_file_ids" in response.metadata
-        file_ids = json.loads(response.metadata["_file_ids"])
-        assert file_pdf.id in file_ids
-        assert file_txt.id in file_ids
         print("id_to_string(response.id):", id_to_string(response.id))
         collection = weaviate_client.collections.get(id_to_string(response.id))
 
@@ -288,3 +286,136 @@ def test_add_file_vector_store(openai_client: OpenAI, vector_store, file_txt):
     assert vector_store.status == "completed"
     assert vector_store.file_counts.total == 1
     assert vector_store.file_counts.completed == 1
+
+
+def wait_for_vector_store(openai_client: OpenAI, vector_store_id: str):
+    max_checks = 5
+    check_interval = 2
+    for _ in range(max_checks):
+        time.sleep(check_interval)
+        vector_store = openai_client.beta.vector_stores.retrieve(
+            vector_store_id
+        )
+        if vector_store.status == "completed":
+            return vector_store
+    assert False, "Vector store did not complete within the expected time."
+
+
+@pytest.mark.dependency(depends=["test_create_vector_store_with_files"])
+def test_reuse_file_chunks_across_vector_stores(
+    openai_client: OpenAI,
+    weaviate_client: weaviate.client.WeaviateClient,
+    file_pdf,
+):
+    first = openai_client.beta.vector_stores.create(
+        name="First Vector Store", file_ids=[file_pdf.id]
+    )
+    first = wait_for_vector_store(openai_client, first.id)
+
+    # the second store is served from the cached chunks of the same file
+    second = openai_client.beta.vector_stores.create(
+        name="Second Vector Store", file_ids=[file_pdf.id]
+    )
+    second = wait_for_vector_store(openai_client, second.id)
+
+    assert first.file_counts.completed == 1
+    assert second.file_counts.completed == 1
+    assert first.usage_bytes == second.usage_bytes
+
+    if not use_openai:
+        first_count = (
+            weaviate_client.collections.get(id_to_string(first.id))
+            .aggregate.over_all(total_count=True)
+            .total_count
+        )
+        second_count = (
+            weaviate_client.collections.get(id_to_string(second.id))
+            .aggregate.over_all(total_count=True)
+            .total_count
+        )
+        assert first_count > 0
+        assert first_count == second_count
+
+
+@pytest.mark.dependency(depends=["test_add_file_vector_store"])
+def test_concurrent_file_batches(
+    openai_client: OpenAI, vector_store, file_txt, file_pdf
+):
+    # both batches update the counts of the same store while indexing
+    first = openai_client.beta.vector_stores.file_batches.create(
+        vector_store_id=vector_store.id, file_ids=[file_txt.id]
+    )
+    second = openai_client.beta.vector_stores.file_batches.create(
+        vector_store_id=vector_store.id, file_ids=[file_pdf.id, file_txt.id]
+    )
+    assert first.file_counts.total == 1
+    # files already in the store are not added again
+    assert second.file_counts.total == 1
+
+    vector_store = wait_for_vector_store(openai_client, vector_store.id)
+    assert vector_store.file_counts.total == 2
+    assert vector_store.file_counts.completed == 2
+    assert vector_store.file_counts.in_progress == 0
+    assert vector_store.file_counts.failed == 0
+    assert vector_store.usage_bytes == file_txt.bytes + file_pdf.bytes
+
+    for batch in [first, second]:
+        batch = openai_client.beta.vector_stores.file_batches.retrieve(
+            batch.id, vector_store_id=vector_store.id
+        )
+        assert batch.status == "completed"
+        assert batch.file_counts.completed == 1
+
+
+@pytest.mark.dependency(depends=["test_concurrent_file_batches"])
+def test_list_vector_store_files(
+    openai_client: OpenAI, vector_store, file_txt, file_pdf
+):
+    batch = openai_client.beta.vector_stores.file_batches.create(
+        vector_store_id=vector_store.id, file_ids=[file_txt.id, file_pdf.id]
+    )
+    wait_for_vector_store(openai_client, vector_store.id)
+
+    first_page = openai_client.beta.vector_stores.files.list(
+        vector_store.id, limit=1
+    )
+    assert len(first_page.data) == 1
+    second_page = openai_client.beta.vector_stores.files.list(
+        vector_store.id, limit=1, after=first_page.data[0].id
+    )
+    assert len(second_page.data) == 1
+    assert {first_page.data[0].id, second_page.data[0].id} == {
+        file_txt.id,
+        file_pdf.id,
+    }
+
+    vector_store_file = openai_client.beta.vector_stores.files.retrieve(
+        file_txt.id, vector_store_id=vector_store.id
+    )
+    assert vector_store_file.vector_store_id == vector_store.id
+    assert vector_store_file.status == "completed"
+    assert vector_store_file.usage_bytes == file_txt.bytes
+
+    failed = openai_client.beta.vector_stores.files.list(
+        vector_store.id, filter="failed"
+    )
+    assert failed.data == []
+
+    batch_files = openai_client.beta.vector_stores.file_batches.list_files(
+        batch.id, vector_store_id=vector_store.id
+    )
+    assert len(batch_files.data) == 2
+
+
+@pytest.mark.skipif(use_openai, reason="OpenAI API does not filter by ids")
+def test_retrieve_many_files(openai_client: OpenAI, file_txt, file_pdf):
+    files = openai_client.files.list(
+        extra_query={"ids": [file_txt.id, file_pdf.id, "file-missing"]}
+    )
+    assert sorted(file.id for file in files.data) == sorted(
+        [file_txt.id, file_pdf.id]
+    )
+    assert {file.filename for file in files.data} == {
+        file_txt.filename,
+        file_pdf.filename,
+    }
@@ -0,0 +1,98 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+# the engine is created on import but never connected to in these tests
+for name, value in [("POSTGRES_HOST", "localhost"), ("POSTGRES_PORT", "5432")]:
+    os.environ.setdefault(name, value)
+
+from lib.db import models  # noqa: E402
+from lib.db.cache import RowCache  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_thread(thread_id: str) -> models.Thread:
+    # every column is set, as on rows loaded from the database
+    return models.Thread(
+        id=thread_id,
+        object="thread",
+        created_at=1700000000,
+        _metadata={"tenant": "acme"},
+        locked_by=None,
+        lease_until=None,
+    )
+
+
+def test_row_cache_hits_and_ttl():
+    clock = FakeClock()
+    cache = RowCache(models.Thread, max_size=8, ttl=60, clock=clock)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return make_thread("thread_1")
+
+    first = cache.get_or_load("thread_1", load)
+    second = cache.get_or_load("thread_1", load)
+    assert len(loads) == 1
+    assert second is not first  # each hit builds a new object
+    assert second.id == "thread_1"
+    assert second._metadata == {"tenant": "acme"}
+
+    clock.now = 61
+    cache.get_or_load("thread_1", load)
+    assert len(loads) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_row_cache_evicts_least_recently_used():
+    cache = RowCache(models.Thread, max_size=2, clock=FakeClock())
+    for thread_id in ["thread_1", "thread_2"]:
+        cache.set(thread_id, make_thread(thread_id))
+    cache.get("thread_1")
+    cache.set("thread_3", make_thread("thread_3"))
+
+    assert cache.get("thread_2") is None
+    assert cache.get("thread_1") is not None
+    assert cache.get("thread_3") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_row_cache_invalidation():
+    cache = RowCache(models.Thread, clock=FakeClock())
+    cache.set("thread_1", make_thread("thread_1"))
+    cache.invalidate("thread_1")
+    assert cache.get("thread_1") is None
+
+    # a row loaded before a write is not cached once the write invalidated it
+    def load():
+        cache.invalidate("thread_1")
+        return make_thread("thread_1")
+
+    assert cache.get_or_load("thread_1", load) is not None
+    assert cache.get("thread_1") is None
+
+
+def test_row_cache_returns_copies_without_excluded_columns():
+    cache = RowCache(
+        models.Thread, clock=FakeClock(), exclude=("locked_by", "lease_until")
+    )
+    thread = make_thread("thread_1")
+    thread.locked_by = "run_1:abcd"
+    thread.lease_until = 1700000060
+    cache.set("thread_1", thread)
+    thread._metadata["tenant"] = "changed after caching"
+
+    cached = cache.get("thread_1")
+    assert cached._metadata == {"tenant": "acme"}
+    assert cached.locked_by is None and cached.lease_until is None
+    cached._metadata["tenant"] = "changed by a caller"
+    assert cache.get("thread_1")._metadata == {"tenant": "acme"}
@@ -0,0 +1,367 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import functools
+import hashlib
+import os
+import sys
+import threading
+import time
+import fitz
+import pytest
+from sqlalchemy import delete, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+for name, value in [("POSTGRES_HOST", "localhost"), ("POSTGRES_PORT", "5432")]:
+    os.environ.setdefault(name, value)
+
+from lib.db import crud, database, models, schemas  # noqa: E402
+from utils import crawling, page_parser  # noqa: E402
+
+PAGE_COUNT = 200
+LINKS_PER_PAGE = 20
+PAGE_LATENCY = 0.02
+
+
+MIXED_PAGE_COUNT = 30
+MIXED_PDF_PAGES = 150
+
+
+@functools.lru_cache
+def mixed_site_pdf() -> bytes:
+    document = fitz.open()
+    for i in range(MIXED_PDF_PAGES):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Page {i} " + "lorem ipsum " * 60)
+    return document.tobytes()
+
+
+class SiteState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requested = []
+        self.conditional = 0
+
+
+def make_handler(state: SiteState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with state.lock:
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+                state.requested.append(self.path)
+                state.conditional += "If-None-Match" in self.headers
+            try:
+                self.respond()
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+        def respond(self):
+            if self.path == "/robots.txt":
+                body = b"User-agent: *\nDisallow: /private\n"
+                content_type = "text/plain"
+            elif self.path.startswith("/mixed/"):
+                time.sleep(PAGE_LATENCY)
+                name = self.path.split("/")[2]
+                if name.endswith(".pdf"):
+                    body = mixed_site_pdf()
+                    content_type = "application/pdf"
+                else:
+                    page = int(name)
+                    links = "".join(
+                        f'<a href="/mixed/{(page + i) % MIXED_PAGE_COUNT}">'
+                        "next</a>"
+                        for i in range(1, 4)
+                    )
+                    body = (
+                        f'<html><body><h1>Mixed {page}</h1><a href="/mixed/'
+                        f'{page}.pdf">pdf</a>{links}</body></html>'
+                    ).encode()
+                    content_type = "text/html"
+            elif self.path.startswith("/page/"):
+                time.sleep(PAGE_LATENCY)
+                page = int(self.path.strip("/").split("/")[1])
+                links = "".join(
+                    # fragments and trailing slashes point to the same pages
+                    f'<a href="/page/{(page * 7 + i) % PAGE_COUNT}/#top">'
+                    f'link</a><a href="/page/{(page * 7 + i) % PAGE_COUNT}">'
+                    "link</a>"
+                    for i in range(LINKS_PER_PAGE)
+                )
+                body = (
+                    f"<html><body><h1>Page {page}</h1><p>Content {page}</p>"
+                    f'{links}<a href="/private/{page}">private</a>'
+                    '<a href="mailto:someone@example.com">mail</a>'
+                    "</body></html>"
+                ).encode()
+                content_type = "text/html"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            etag = f'"{hashlib.sha256(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+@pytest.fixture
+def site():
+    state = SiteState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", state
+    server.shutdown()
+    server.server_close()
+
+
+def test_normalize_url():
+    assert (
+        crawling.normalize_url("HTTPS://Example.com:443/docs/#intro")
+        == "https://example.com/docs"
+    )
+    assert (
+        crawling.normalize_url("http://example.com")
+        == crawling.normalize_url("http://example.com/")
+        == "http://example.com/"
+    )
+    assert (
+        crawling.normalize_url("http://example.com:8080/a/?q=1")
+        == "http://example.com:8080/a?q=1"
+    )
+    assert crawling.normalize_url("mailto:someone@example.com") is None
+    assert crawling.normalize_url("javascript:void(0)") is None
+
+
+def test_parse_html():
+    parsed_page = page_parser.parse_html(
+        b"<html><head><title>Title</title><style>p {}</style></head><body>"
+        b"<p>Intro <a href='/a#top'>A</a></p><h1>Main <b>title</b></h1>"
+        b"<p>one</p><script>var x;</script><p>two<br>three</p>"
+        b"<h2>Sub</h2><div>deep &amp; text</div>"
+        b"<a href='https://other.com/'>other</a><h1>Next</h1>tail"
+        b"</body></html>",
+        "https://example.com/docs/",
+    )
+
+    assert parsed_page.links == [
+        "https://example.com/a#top",
+        "https://other.com/",
+    ]
+    assert parsed_page.sections == [
+        ((), "Intro A"),
+        (("Main title",), "one\ntwo\nthree"),
+        (("Main title", "Sub"), "deep & text\nother"),
+        (("Next",), "tail"),
+    ]
+    chunks = list(page_parser.iter_chunks(parsed_page, 8, 0))
+    assert chunks[:3] == [
+        "Intro A",
+        "Main title\none\ntwo",
+        "Main title\nthree",
+    ]
+    assert "Main title > Sub\ndeep &" in chunks
+
+
+def test_crawl_respects_limits(site):
+    base_url, state = site
+    crawl_infos = asyncio.run(
+        crawling.crawl_websites(
+            [f"{base_url}/page/0"],
+            constrain_to_root_domain=True,
+            max_depth=10,
+            max_pages=50,
+            max_concurrency=16,
+            max_per_host=3,
+        )
+    )
+
+    pages = [path for path in state.requested if path.startswith("/page/")]
+    assert len(crawl_infos) == 50
+    assert all(crawl_info.error is None for crawl_info in crawl_infos)
+    # every page is fetched once even though it is linked in several forms
+    assert len(pages) == len(set(path.rstrip("/") for path in pages)) == 50
+    assert state.requested.count("/robots.txt") == 1
+    assert not any(path.startswith("/private") for path in state.requested)
+    assert state.max_in_flight <= 3
+
+
+def test_crawl_benchmark(site):
+    base_url, state = site
+    results = {}
+    for max_per_host in [1, 8]:
+        start = time.perf_counter()
+        crawl_infos = asyncio.run(
+            crawling.crawl_websites(
+                [f"{base_url}/page/0"],
+                constrain_to_root_domain=True,
+                max_depth=None,
+                max_pages=PAGE_COUNT,
+                max_concurrency=8,
+                max_per_host=max_per_host,
+            )
+        )
+        results[max_per_host] = time.perf_counter() - start
+        assert len(crawl_infos) == PAGE_COUNT
+
+    print(
+        f"\nCrawled {PAGE_COUNT} pages: {results[1]:.2f}s sequential, "
+        f"{results[8]:.2f}s with 8 concurrent requests"
+    )
+    assert results[8] < results[1]
+
+
+def test_recrawl_skips_unchanged_pages(site):
+    base_url, state = site
+    page_states = {}
+    indexed = []
+
+    async def load_page_state(url):
+        return page_states.get(url)
+
+    async def save_page_state(page_state):
+        page_states[page_state.url] = page_state
+
+    async def success_callback(crawl_info, chunks):
+        assert crawl_info.content == ""
+        # the h1 of the page heads its chunks
+        heading, text = next(chunks).split("\n", 1)
+        assert heading.startswith("Page ") and text.startswith("Content ")
+        indexed.append(crawl_info.url)
+
+    def crawl():
+        return asyncio.run(
+            crawling.crawl_websites(
+                [f"{base_url}/page/0"],
+                constrain_to_root_domain=True,
+                max_depth=None,
+                success_callback=success_callback,
+                max_pages=PAGE_COUNT,
+                load_page_state=load_page_state,
+                save_page_state=save_page_state,
+            )
+        )
+
+    first = crawl()
+    assert len(indexed) == len(first) == len(page_states) == PAGE_COUNT
+
+    indexed.clear()
+    second = crawl()
+    # the same pages are discovered through the stored links, but none of
+    # them is downloaded or indexed again
+    assert {c.url for c in second} == {c.url for c in first}
+    assert all(crawl_info.error is None for crawl_info in second)
+    assert indexed == []
+    assert state.conditional == PAGE_COUNT
+
+    # pages without a stored state (e.g. a failed callback) are indexed again
+    failed_url = first[1].url
+    del page_states[failed_url]
+    crawl()
+    assert indexed == [failed_url]
+
+
+def test_crawl_reports_pages_without_keeping_them(site):
+    base_url, _ = site
+    recorded = []
+
+    async def page_callback(crawl_info):
+        recorded.append(crawl_info)
+
+    crawl_infos = asyncio.run(
+        crawling.crawl_websites(
+            [f"{base_url}/page/0", f"{base_url}/missing"],
+            constrain_to_root_domain=True,
+            max_depth=None,
+            max_pages=20,
+            page_callback=page_callback,
+            keep_results=False,
+        )
+    )
+
+    assert crawl_infos == []
+    assert len(recorded) == 20
+    assert [c.url for c in recorded if c.error] == [f"{base_url}/missing"]
+
+
+def test_parse_benchmark(site):
+    base_url, _ = site
+    results = {}
+    for parse_workers in [0, crawling.DEFAULT_PARSE_WORKERS]:
+        # start the parser processes outside of the measurement
+        crawling.get_parser_pool(crawling.DEFAULT_PARSE_WORKERS)
+        start = time.perf_counter()
+        crawl_infos = asyncio.run(
+            crawling.crawl_websites(
+                [f"{base_url}/mixed/0"],
+                constrain_to_root_domain=True,
+                max_depth=None,
+                max_pages=MIXED_PAGE_COUNT * 2,
+                max_concurrency=8,
+                max_per_host=8,
+                parse_workers=parse_workers,
+            )
+        )
+        results[parse_workers] = time.perf_counter() - start
+        assert len(crawl_infos) == MIXED_PAGE_COUNT * 2
+        assert all(crawl_info.error is None for crawl_info in crawl_infos)
+
+    print(
+        f"\nCrawled {MIXED_PAGE_COUNT} HTML pages and {MIXED_PAGE_COUNT} "
+        f"PDFs: {results[0]:.2f}s parsing on the event loop, "
+        f"{results[crawling.DEFAULT_PARSE_WORKERS]:.2f}s with "
+        f"{crawling.DEFAULT_PARSE_WORKERS} parser processes"
+    )
+    assert results[crawling.DEFAULT_PARSE_WORKERS] < results[0]
+
+
+def test_orphaned_crawl_jobs_are_failed():
+    try:
+        with database.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except OperationalError:
+        pytest.skip("Postgres is not reachable")
+    models.Base.metadata.create_all(bind=database.engine)
+    data = schemas.WebRetrievalCreate(
+        root_urls=["https://example.com"],
+        constrain_to_root_domain=True,
+        max_depth=1,
+    )
+    now = int(time.time())
+    with database.SessionLocal() as db:
+        orphaned = crud.create_crawl_job(db, data, 10).id
+        running = crud.create_crawl_job(db, data, 10).id
+        db.query(models.CrawlJob).filter(
+            models.CrawlJob.id.in_([orphaned, running])
+        ).update({"heartbeat_at": now - 120}, synchronize_session=False)
+        db.commit()
+        try:
+            # the process running `running` is still heartbeating it
+            crud.heartbeat_crawl_jobs(db, [running], now)
+            failed = crud.fail_orphaned_crawl_jobs(db, now, now - 60)
+            assert orphaned in failed and running not in failed
+            assert crud.get_crawl_job(db, orphaned).status == "failed"
+            assert crud.get_crawl_job(db, running).status == "queued"
+        finally:
+            db.execute(
+                delete(models.CrawlJob).where(
+                    models.CrawlJob.id.in_([orphaned, running])
+                )
+            )
+            db.commit()
@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+# the engine is created on import but never connected to in these tests
+for name, value in [("POSTGRES_HOST", "localhost"), ("POSTGRES_PORT", "5432")]:
+    os.environ.setdefault(name, value)
+
+from lib.db import crud, database, models, schemas  # noqa: E402
+from routers import runsteps_router  # noqa: E402
+from routers.ops import runsteps_ops_router  # noqa: E402
+from utils import tranformers  # noqa: E402
+
+THREAD_ID = "thread_test"
+RUN_ID = "run_test"
+STEP_COUNT = 20
+DOCUMENTS_PER_STEP = 10
+REQUESTS = 20
+
+
+def retrieval_step_details(index: int) -> dict:
+    document = f"Document {index} " + "lorem ipsum dolor sit amet " * 150
+    return {
+        "type": "tool_calls",
+        "tool_calls": [
+            {
+                "id": f"call_{index}_file_search",
+                "type": "file_search",
+                "file_search": {"documents": [document] * DOCUMENTS_PER_STEP},
+            },
+            {
+                "id": f"call_{index}_web_retrieval",
+                "type": "web_retrieval",
+                "query": "lorem ipsum",
+                "retrieval": [
+                    {
+                        "url": f"https://example.com/{i}",
+                        "content": document,
+                        "depth": 1,
+                    }
+                    for i in range(DOCUMENTS_PER_STEP)
+                ],
+            },
+        ],
+    }
+
+
+def make_run_step(index: int) -> models.RunStep:
+    # every column is set, as on rows loaded from the database
+    return models.RunStep(
+        id=f"step_{index}",
+        assistant_id="asst_test",
+        step_details=retrieval_step_details(index),
+        type="tool_calls",
+        status="completed",
+        run_id=RUN_ID,
+        thread_id=THREAD_ID,
+        created_at=1700000000 + index,
+        completed_at=1700000001 + index,
+        cancelled_at=None,
+        expired_at=None,
+        failed_at=None,
+        last_error=None,
+        _metadata=None,
+        usage=None,
+        object="thread.run.step",
+    )
+
+
+@pytest.fixture
+def client(monkeypatch):
+    run_steps = [make_run_step(i) for i in range(STEP_COUNT)]
+    monkeypatch.setattr(
+        crud, "get_run_steps", lambda *args, **kwargs: run_steps
+    )
+    monkeypatch.setattr(
+        crud,
+        "create_run_step",
+        lambda db, thread_id, run_id, run_step: models.RunStep(
+            id="step_created",
+            assistant_id=run_step.assistant_id,
+            step_details=run_step.step_details.model_dump(),
+            type=run_step.type,
+            status=run_step.status,
+            run_id=run_id,
+            thread_id=thread_id,
+            created_at=1700000000,
+            object="thread.run.step",
+        ),
+    )
+
+    app = FastAPI()
+    app.include_router(runsteps_router.router)
+    app.include_router(runsteps_ops_router.router)
+
+    # the previous implementation, validated and encoded with the json module
+    @app.get(
+        "/legacy/threads/{thread_id}/runs/{run_id}/steps",
+        response_model=schemas.SyncCursorPage[schemas.RunStep],
+        response_class=JSONResponse,
+    )
+    def legacy_run_steps(thread_id: str, run_id: str):
+        return schemas.SyncCursorPage(
+            data=[
+                tranformers.db_to_pydantic_runstep(run_step)
+                for run_step in crud.get_run_steps()
+            ]
+        )
+
+    app.dependency_overrides[database.get_db] = lambda: None
+    return TestClient(app)
+
+
+def test_create_run_step_with_large_observation(client):
+    step_details = retrieval_step_details(0)
+    response = client.post(
+        f"/ops/threads/{THREAD_ID}/runs/{RUN_ID}/steps",
+        json={
+            "assistant_id": "asst_test",
+            "step_details": step_details,
+            "type": "tool_calls",
+            "status": "completed",
+        },
+    )
+    assert response.status_code == 200
+    run_step = schemas.RunStep(**response.json())
+    assert run_step.id == "step_created"
+    assert run_step.step_details.model_dump() == step_details
+
+
+def test_list_run_steps_benchmark(client):
+    path = f"/threads/{THREAD_ID}/runs/{RUN_ID}/steps?limit={STEP_COUNT}"
+    fast = client.get(path)
+    legacy = client.get(f"/legacy{path}")
+    assert fast.status_code == legacy.status_code == 200
+    assert fast.json() == legacy.json()
+    assert len(fast.json()["data"]) == STEP_COUNT
+
+    results = {}
+    for name, url in [("legacy", f"/legacy{path}"), ("fast", path)]:
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            client.get(url)
+        elapsed = time.perf_counter() - start
+        results[name] = elapsed / (REQUESTS * STEP_COUNT) * 1e6
+
+    print(
+        f"\nListing {STEP_COUNT} run steps of {len(fast.content) // 1024}KB: "
+        f"{results['legacy']:.1f}us per step with pydantic and json, "
+        f"{results['fast']:.1f}us per step with row serializers and orjson"
+    )
+    assert results["fast"] < results["legacy"]
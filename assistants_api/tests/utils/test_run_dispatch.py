@@ -0,0 +1,243 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+from sqlalchemy import delete, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+for name, value in [("POSTGRES_HOST", "localhost"), ("POSTGRES_PORT", "5432")]:
+    os.environ.setdefault(name, value)
+
+from lib.db import crud, database, models  # noqa: E402
+from lib.mb.relay import MAX_QUEUE_DEPTH, RunDispatchRelay  # noqa: E402
+
+WORKERS = 8
+DISPATCHES = 2000
+
+
+@pytest.fixture
+def run_prefix():
+    """
+    Runs on the Postgres of the dev environment, the dispatches of a test
+    are told apart from others by the prefix of their run ids.
+    """
+    try:
+        with database.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except OperationalError:
+        pytest.skip("Postgres is not reachable")
+    models.RunDispatch.__table__.create(database.engine, checkfirst=True)
+    prefix = f"run_test{uuid.uuid4().hex[:8]}_"
+    yield prefix
+    with database.SessionLocal() as db:
+        db.execute(
+            delete(models.RunDispatch).where(
+                models.RunDispatch.run_id.startswith(prefix)
+            )
+        )
+        db.commit()
+
+
+def add_dispatches(
+    prefix: str, count: int, priority: str = "interactive", tenant: str = ""
+) -> set:
+    with database.SessionLocal() as db:
+        for i in range(count):
+            crud.add_run_dispatch(
+                db, "thread_test", f"{prefix}{tenant}{i}", priority, tenant
+            )
+        db.commit()
+        return {
+            dispatch.id
+            for dispatch in db.query(models.RunDispatch).filter(
+                models.RunDispatch.run_id.startswith(prefix)
+            )
+        }
+
+
+def test_claim_ack_and_nack(run_prefix):
+    (dispatch_id,) = add_dispatches(run_prefix, 1)
+
+    def claim(worker: str) -> list:
+        with database.SessionLocal() as db:
+            return [
+                dispatch.id
+                for dispatch in crud.claim_run_dispatches(db, worker, 100, 600)
+                if dispatch.run_id.startswith(run_prefix)
+            ]
+
+    assert claim("worker_a") == [dispatch_id]
+    # hidden from other workers while claimed
+    assert claim("worker_b") == []
+    with database.SessionLocal() as db:
+        assert not crud.ack_run_dispatches(db, [dispatch_id], "worker_b")
+        assert crud.nack_run_dispatches(db, [dispatch_id], "worker_a", 0)
+    assert claim("worker_b") == [dispatch_id]
+    with database.SessionLocal() as db:
+        assert not crud.ack_run_dispatches(db, [dispatch_id], "worker_a")
+        assert crud.ack_run_dispatches(db, [dispatch_id], "worker_b")
+    assert claim("worker_a") == []
+
+
+def test_failed_runs_are_retried_after_their_delay(run_prefix):
+    (dispatch_id,) = add_dispatches(run_prefix, 1)
+
+    def claim() -> list:
+        with database.SessionLocal() as db:
+            return [
+                dispatch
+                for dispatch in crud.claim_run_dispatches(
+                    db, "worker_a", 100, 600
+                )
+                if dispatch.run_id.startswith(run_prefix)
+            ]
+
+    (dispatch,) = claim()
+    assert dispatch.attempts == 0
+    with database.SessionLocal() as db:
+        # postponed, not counted as a failed attempt
+        assert crud.nack_run_dispatches(db, [dispatch_id], "worker_a", 0)
+    (dispatch,) = claim()
+    assert dispatch.attempts == 0
+    with database.SessionLocal() as db:
+        assert crud.nack_run_dispatches(
+            db, [dispatch_id], "worker_a", 60, failed=True
+        )
+    # backing off
+    assert claim() == []
+    with database.SessionLocal() as db:
+        dispatch = db.get(models.RunDispatch, dispatch_id)
+        assert dispatch.attempts == 1
+        assert dispatch.claimed_by is None
+        assert dispatch.visible_at > time.time() + 50
+
+
+def test_concurrent_claims_are_exclusive(run_prefix):
+    dispatch_ids = add_dispatches(run_prefix, DISPATCHES)
+    claimed = []
+
+    def work(worker: str):
+        with database.SessionLocal() as db:
+            while len(claimed) < len(dispatch_ids):
+                dispatches = crud.claim_run_dispatches(db, worker, 10, 600)
+                if not dispatches:
+                    return
+                for dispatch in dispatches:
+                    if not dispatch.run_id.startswith(run_prefix):
+                        # not ours, given back right away
+                        crud.nack_run_dispatches(db, [dispatch.id], worker, 0)
+                        continue
+                    claimed.append(dispatch.id)
+                    assert crud.ack_run_dispatches(db, [dispatch.id], worker)
+
+    threads = [
+        threading.Thread(target=work, args=(f"worker_{i}",))
+        for i in range(WORKERS)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    assert len(claimed) == len(dispatch_ids)
+    assert set(claimed) == dispatch_ids
+    print(
+        f"{len(claimed)} dispatches claimed and acked by {WORKERS} workers "
+        f"in {elapsed:.2f}s, {len(claimed) / elapsed:.0f}/s"
+    )
+
+
+def test_claims_take_turns_between_tenants(run_prefix):
+    add_dispatches(run_prefix, 6, tenant="tenant_a")
+    add_dispatches(run_prefix, 2, tenant="tenant_b")
+    add_dispatches(run_prefix, 2, priority="batch", tenant="tenant_c")
+
+    with database.SessionLocal() as db:
+        dispatches = [
+            dispatch
+            for dispatch in crud.claim_run_dispatches(
+                db, "worker_a", 100, 600, "interactive"
+            )
+            if dispatch.run_id.startswith(run_prefix)
+        ]
+    assert [dispatch.run_id[len(run_prefix) :] for dispatch in dispatches] == [
+        "tenant_a0",
+        "tenant_b0",
+        "tenant_a1",
+        "tenant_b1",
+        "tenant_a2",
+        "tenant_a3",
+        "tenant_a4",
+        "tenant_a5",
+    ]
+    with database.SessionLocal() as db:
+        stats = {
+            queue_stats.priority: queue_stats
+            for queue_stats in crud.get_run_dispatch_stats(db)
+        }
+    assert stats["batch"].pending >= 2
+    assert stats["interactive"].claimed >= 8
+
+
+class FakeBroker:
+    def __init__(self, fail: bool = False, depth: int = 0):
+        self.fail = fail
+        self.depth = depth
+        self.messages = []
+
+    def queue_depth(self, queue_name: str):
+        return self.depth, 1
+
+    def publish_confirmed(self, queue_name: str, messages: list):
+        if self.fail:
+            raise RuntimeError("broker unavailable")
+        self.messages += [json.loads(message) for message in messages]
+
+    def close_connection(self):
+        pass
+
+
+def pending_dispatches(prefix: str) -> list:
+    with database.SessionLocal() as db:
+        return (
+            db.query(models.RunDispatch)
+            .filter(models.RunDispatch.run_id.startswith(prefix))
+            .all()
+        )
+
+
+def test_relay_publishes_and_deletes_dispatches(run_prefix):
+    with database.SessionLocal() as db:
+        if db.query(models.RunDispatch).count():
+            pytest.skip("dispatches of other runs are waiting")
+    add_dispatches(run_prefix, 3)
+    relay = RunDispatchRelay()
+
+    # a failed publish gives the batch back right away
+    relay.broker = FakeBroker(fail=True)
+    with pytest.raises(RuntimeError):
+        relay.relay_batch()
+    assert relay.broker is None
+    dispatches = pending_dispatches(run_prefix)
+    assert len(dispatches) == 3
+    assert all(dispatch.claimed_by is None for dispatch in dispatches)
+
+    # nothing is published while the queue is full
+    relay.broker = FakeBroker(depth=MAX_QUEUE_DEPTH)
+    assert relay.relay_batch() == 0
+    assert relay.queue_depths["interactive"] == (MAX_QUEUE_DEPTH, 1)
+
+    relay.broker = broker = FakeBroker()
+    assert relay.relay_batch() == 3
+    assert [message["run_id"] for message in broker.messages] == [
+        f"{run_prefix}{i}" for i in range(3)
+    ]
+    assert pending_dispatches(run_prefix) == []
+    assert relay.relay_batch() == 0
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import uuid
+
+import pytest
+from sqlalchemy import delete, text
+from sqlalchemy.exc import OperationalError
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+for name, value in [("POSTGRES_HOST", "localhost"), ("POSTGRES_PORT", "5432")]:
+    os.environ.setdefault(name, value)
+
+from lib.db import crud, database, models  # noqa: E402
+
+
+@pytest.fixture
+def thread_id():
+    """A thread of its own on the Postgres of the dev environment."""
+    try:
+        with database.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except OperationalError:
+        pytest.skip("Postgres is not reachable")
+    models.Base.metadata.create_all(bind=database.engine)
+    thread_id = f"thread_test{uuid.uuid4().hex[:8]}"
+    with database.SessionLocal() as db:
+        db.add(models.Thread(id=thread_id, created_at=int(time.time())))
+        db.commit()
+    yield thread_id
+    with database.SessionLocal() as db:
+        run_ids = [
+            run.id
+            for run in db.query(models.Run).filter(
+                models.Run.thread_id == thread_id
+            )
+        ]
+        db.execute(
+            delete(models.RunDispatch).where(
+                models.RunDispatch.run_id.in_(run_ids)
+            )
+        )
+        db.execute(delete(models.Run).where(models.Run.id.in_(run_ids)))
+        db.execute(delete(models.Thread).where(models.Thread.id == thread_id))
+        db.commit()
+
+
+def add_run(thread_id: str, status: str, expires_at: int = None) -> str:
+    run_id = f"run_test{uuid.uuid4().hex[:8]}"
+    now = int(time.time())
+    with database.SessionLocal() as db:
+        db.add(
+            models.Run(
+                id=run_id,
+                thread_id=thread_id,
+                assistant_id="asst_test",
+                created_at=now,
+                expires_at=expires_at or now + 3600,
+                model="gpt-3.5-turbo",
+                status=status,
+            )
+        )
+        if status == "queued":
+            crud.add_run_dispatch(db, thread_id, run_id, "interactive", "")
+        db.commit()
+    return run_id
+
+
+def run_status(thread_id: str, run_id: str) -> str:
+    with database.SessionLocal() as db:
+        return crud.get_run(db, thread_id, run_id).status
+
+
+@pytest.mark.parametrize(
+    "status, cancelled",
+    [
+        ("queued", "cancelled"),
+        ("requires_action", "cancelled"),
+        ("in_progress", "cancelling"),
+    ],
+)
+def test_cancel_active_run(thread_id, status, cancelled):
+    run_id = add_run(thread_id, status)
+    with database.SessionLocal() as db:
+        db_run = crud.cancel_run(db, thread_id, run_id)
+        assert db_run.status == cancelled
+        assert (db_run.cancelled_at is not None) == (cancelled == "cancelled")
+        # a queued run is not dispatched anymore
+        assert (
+            db.query(models.RunDispatch)
+            .filter(models.RunDispatch.run_id == run_id)
+            .count()
+            == 0
+        )
+
+
+@pytest.mark.parametrize(
+    "status", ["completed", "failed", "expired", "cancelled", "cancelling"]
+)
+def test_cancel_finished_run_is_rejected(thread_id, status):
+    run_id = add_run(thread_id, status)
+    with database.SessionLocal() as db:
+        with pytest.raises(ValueError):
+            crud.cancel_run(db, thread_id, run_id)
+        assert crud.cancel_run(db, thread_id, "run_missing") is None
+    assert run_status(thread_id, run_id) == status
+    if status != "cancelling":
+        # the thread is free for a new run
+        add_run(thread_id, "queued")
+
+
+def test_sweep_expires_or_cancels_runs_past_expiry(thread_id):
+    now = int(time.time())
+    # a run cancelling when its worker died holds the thread until expiry
+    cancelling = add_run(thread_id, "cancelling", expires_at=now - 1)
+    with database.SessionLocal() as db:
+        assert cancelling in crud.expire_runs(db, now)
+        db_run = crud.get_run(db, thread_id, cancelling)
+        assert db_run.status == "cancelled"
+        assert db_run.cancelled_at == now
+
+    in_progress = add_run(thread_id, "in_progress", expires_at=now - 1)
+    with database.SessionLocal() as db:
+        assert in_progress in crud.expire_runs(db, now)
+    assert run_status(thread_id, in_progress) == "expired"
+
+    # not expired yet
+    queued = add_run(thread_id, "queued", expires_at=now + 60)
+    with database.SessionLocal() as db:
+        assert queued not in crud.expire_runs(db, now)
+    assert run_status(thread_id, queued) == "queued"
@@ -3,13 +3,30 @@ from utils.weaviate_utils import retrieve_file_chunks
 from utils.ops_api_handler import create_retrieval_runstep
 from utils.openai_clients import litellm_client, assistants_client
 from openai.types.beta.vector_store import VectorStore
+from utils.pagination import iter_all
 from data_models import run
-import json
+from openai.types import FileObject
 import os
 
 # import coala
 from agents import coala
 
+FILE_IDS_PER_REQUEST = 100  # most ids the API looks up at once
+
+
+def retrieve_files(file_ids: List[str]) -> List[FileObject]:
+    """
+    Looks up the metadata of many files with one request per
+    FILE_IDS_PER_REQUEST ids instead of one request per file.
+    """
+    files = []
+    for i in range(0, len(file_ids), FILE_IDS_PER_REQUEST):
+        page = assistants_client.files.list(
+            extra_query={"ids": file_ids[i : i + FILE_IDS_PER_REQUEST]}
+        )
+        files.extend(page.data)
+    return files
+
 
 class FileSearch:
     def __init__(
@@ -76,29 +93,34 @@ Only respond with the query iteself NOTHING ELSE.
     def compose_file_list(
         self,
     ) -> str:
-        files_names = []
-
-        print
-
-        file_ids = (
-            []
-        )  # NOTE: this only work natively with OpenGPTs-platform/assistants-api otherwise you need to make sure to manually manage the metadata["_file_ids"] inside the vector stores # noqa
-
+        file_ids = []
         for vector_store in self.vector_stores:
-            vector_store_file_ids = (
-                json.loads(vector_store.metadata["_file_ids"])
-                if "_file_ids" in vector_store.metadata
-                else []
+            file_ids.extend(
+                vector_store_file.id
+                for vector_store_file in iter_all(
+                    assistants_client.beta.vector_stores.files.list,
+                    vector_store_id=vector_store.id,
+                    filter="completed",
+                    order="asc",
+                )
             )
-            file_ids.extend(vector_store_file_ids)
 
+        file_ids = list(dict.fromkeys(file_ids))  # stores can share files
         if not file_ids:
             print("\n\nNO FILES AVAILABLE: ", file_ids)
             return ""
-        for file_id in file_ids:
-            file = assistants_client.files.retrieve(file_id)
-            files_names.append(f"- {file.filename}")
-        return "\n".join(files_names)
+        file_names = self.coala_class.file_names
+        missing_file_ids = [
+            file_id for file_id in file_ids if file_id not in file_names
+        ]
+        if missing_file_ids:
+            for file in retrieve_files(missing_file_ids):
+                file_names[file.id] = file.filename
+        return "\n".join(
+            f"- {file_names[file_id]}"
+            for file_id in file_ids
+            if file_id in file_names
+        )
 
     def compose_query_system_prompt(self) -> str:
         composed_instruction = ""
@@ -107,7 +129,7 @@ Only respond with the query iteself NOTHING ELSE.
         file_list_str = self.compose_file_list()
         if file_list_str:
             composed_instruction += f"""The files currently available to you are:
-{self.compose_file_list()}
+{file_list_str}
 
 """
 
@@ -13,6 +13,7 @@ from utils.openai_clients import (
     fc_client,
     ChatCompletion,
 )
+from utils.pagination import list_all
 from data_models import run
 import os
 from openai.types.beta import Assistant
@@ -68,6 +69,9 @@ class CoALA:
         self.react_steps: List[ReactStep] = []
         self.run_executor = run_executor
 
+        # file id -> file name, looked up once per run by file_search
+        self.file_names: dict[str, str] = {}
+
     def generate_question(self) -> ReactStep:
         tools_prompt = "\n".join(
             f"- {tool.type} ({tool.description})"
@@ -392,7 +396,7 @@ Final Answer: the final answer to the original input question"""
 
     def load_trace(self) -> List[ReactStep]:
         new_trace = []
-        for step in self.runsteps:
+        for step in self.runsteps.data:
             if step.type == "tool_calls":
                 new_trace.append(
                     ReactStep(
@@ -428,16 +432,48 @@ Final Answer: the final answer to the original input question"""
         self.react_steps = new_trace
         return self.react_steps
 
-    def retrieve_assistant(self) -> Assistant:
-        assistant = assistants_client.beta.assistants.retrieve(
-            assistant_id=self.assistant_id
+    def resume_trace(self) -> List[ReactStep]:
+        """
+        Rebuilds the trace of a run executed again after a failure from its
+        persisted steps, so they are not generated again. Only the question,
+        which is not persisted, is asked again, from the messages before the
+        ones created by the run.
+        """
+        run_message_ids = {
+            step.step_details.message_creation.message_id
+            for step in self.runsteps.data
+            if step.type == "message_creation"
+        }
+        messages = self.messages
+        self.messages = SyncCursorPage(
+            data=[
+                message
+                for message in messages.data
+                if message.id not in run_message_ids
+            ]
         )
+        try:
+            question = self.generate_question()
+        finally:
+            self.messages = messages
+        self.react_steps = [question] + self.load_trace()
+        return self.react_steps
+
+    def retrieve_assistant(self) -> Assistant:
+        # the run executor already retrieved it when routing the run
+        assistant = getattr(self.run_executor, "assistant", None)
+        if assistant is None or assistant.id != self.assistant_id:
+            assistant = assistants_client.beta.assistants.retrieve(
+                assistant_id=self.assistant_id
+            )
         self.assistant = assistant
         return assistant
 
     def retrieve_messages(self) -> SyncCursorPage[Message]:
-        messages = assistants_client.beta.threads.messages.list(
-            thread_id=self.thread_id, order="asc"
+        messages = list_all(
+            assistants_client.beta.threads.messages.list,
+            thread_id=self.thread_id,
+            order="asc",
         )
         self.messages = messages
         return messages
@@ -450,8 +486,11 @@ Final Answer: the final answer to the original input question"""
         return run
 
     def retrieve_runsteps(self) -> SyncCursorPage[run.RunStep]:
-        runsteps = assistants_client.beta.threads.runs.steps.list(
-            thread_id=self.thread_id, run_id=self.run_id, order="asc"
+        runsteps = list_all(
+            assistants_client.beta.threads.runs.steps.list,
+            thread_id=self.thread_id,
+            run_id=self.run_id,
+            order="asc",
         )
         self.runsteps = runsteps
         return runsteps
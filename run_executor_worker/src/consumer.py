@@ -1,8 +1,21 @@
+from collections import Counter, deque
 from concurrent.futures import ThreadPoolExecutor
+import functools
 import pika
 import os
+import socket
+import threading
+import uuid
 from dotenv import load_dotenv
 from run_executor.main import ExecuteRun
+from utils.ops_api_handler import (
+    ack_run_dispatch,
+    claim_run_dispatches,
+    nack_run_dispatch,
+)
+from utils.retry import MAX_ATTEMPTS, is_transient, retry_delay
+from utils.scheduling import RUN_QUEUES, WeightedRoundRobin
+from utils.thread_lease import ThreadBusy
 import json
 import time
 
@@ -13,12 +26,79 @@ RABBITMQ_DEFAULT_USER = os.getenv("RABBITMQ_DEFAULT_USER")
 RABBITMQ_DEFAULT_PASS = os.getenv("RABBITMQ_DEFAULT_PASS")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5672))
+# "rabbitmq" consumes the run queues, "postgres" claims the runs dispatched
+# in the run_dispatches table
+RUN_DISPATCH = os.getenv("RUN_DISPATCH", "rabbitmq")
+# claimed runs are claimed again if not acked by then, runs expire after an
+# hour so a run being executed is not
+DISPATCH_LEASE_SECONDS = int(os.getenv("RUN_DISPATCH_LEASE_SECONDS", 3600))
+DISPATCH_POLL_SECONDS = float(os.getenv("RUN_DISPATCH_POLL_SECONDS", 0.5))
+# runs of a busy thread are executed again after this delay, without
+# counting as a failed attempt
+DISPATCH_RETRY_SECONDS = 5
+SETTLE_ATTEMPTS = 3
+
+
+def retry_queue(queue_name: str, attempt: int) -> str:
+    return f"{queue_name}.retry.{attempt}"
+
+
+def busy_queue(queue_name: str) -> str:
+    return f"{queue_name}.retry.busy"
+
+
+def dead_queue(queue_name: str) -> str:
+    return f"{queue_name}.dead"
+
+
+def declare_retry_queues(channel, queue_name: str):
+    """
+    One retry queue per attempt, and one for the runs of busy threads, so
+    the messages of a queue have about the same TTL and expire in order, and
+    a dead queue.
+    """
+    retry_queues = [
+        retry_queue(queue_name, attempt)
+        for attempt in range(2, MAX_ATTEMPTS + 1)
+    ]
+    for name in retry_queues + [busy_queue(queue_name)]:
+        channel.queue_declare(
+            queue=name,
+            durable=True,
+            arguments={
+                # expired messages go back to the run queue
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            },
+        )
+    channel.queue_declare(queue=dead_queue(queue_name), durable=True)
 
 
 class RabbitMQConsumer:
+    """
+    Consumes the queues of all the run priorities and starts the delivered
+    runs as workers become free, picking the priority by weighted round
+    robin, so a backlog of batch runs does not hold up interactive ones
+    while batch runs still get the workers interactive ones leave idle.
+    pika connections are not thread safe, so everything touching the channel
+    or the scheduling state happens in the connection thread, worker threads
+    hand their acks over to it.
+
+    Runs failing on transient errors are published to the retry queue of
+    their next attempt, where they wait for their (jittered) delay before
+    being dead-lettered back to their queue, runs of a thread busy with
+    another run likewise through the busy retry queue. Messages failing
+    otherwise, or out of attempts, go to the dead queue of their priority
+    rather than being dropped.
+    """
+
     def __init__(self, max_workers=4):
         self.max_workers = max_workers
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.scheduler = WeightedRoundRobin()
+        # runs being executed, across reconnections
+        self.running = 0
+        self.running_lock = threading.Lock()
         self.connect()
 
     def connect(self):
@@ -36,42 +116,136 @@ class RabbitMQConsumer:
                     )
                 )
                 self.channel = self.connection.channel()
+                # per consumer, each priority can keep all workers busy
                 self.channel.basic_qos(prefetch_count=self.max_workers)
                 break
             except pika.exceptions.AMQPConnectionError as e:
                 print(f"Connection error: {e}, retrying in 5 seconds...")
                 time.sleep(5)
+        # deliveries not started yet, the broker redelivers them if the
+        # connection is lost
+        self.waiting = {priority: deque() for priority in RUN_QUEUES}
 
-    def process_message(self, body):
-        try:
-            message = body.decode("utf-8")
-            data = json.loads(message)
-            print(f"\n\nProcessing {data}")
-            run = ExecuteRun(data["thread_id"], data["run_id"])
-            run.execute()
-        except json.JSONDecodeError as e:
-            print(f"Failed to decode JSON: {e}")
+    def process_message(self, body, attempt: int):
+        message = body.decode("utf-8")
+        data = json.loads(message)
+        print(f"\n\nProcessing {data}, attempt {attempt}")
+        run = ExecuteRun(data["thread_id"], data["run_id"], attempt=attempt)
+        run.execute()
 
-    def callback(self, ch, method, properties, body):
-        self.executor.submit(self.process_message_and_ack, body, ch, method)
+    def callback(self, priority, ch, method, properties, body):
+        self.waiting[priority].append((ch, method, properties, body))
+        self.schedule()
 
-    def process_message_and_ack(self, body, ch, method):
+    def schedule(self):
+        while True:
+            with self.running_lock:
+                if self.running >= self.max_workers:
+                    return
+                priority = self.scheduler.next(
+                    priority for priority, runs in self.waiting.items() if runs
+                )
+                if priority is None:
+                    return
+                self.running += 1
+            self.executor.submit(
+                self.process_message_and_ack,
+                priority,
+                *self.waiting[priority].popleft(),
+            )
+
+    def finish(self, ch, settle):
+        # in the connection thread, messages of a channel closed since are
+        # not settled, the broker redelivers them
+        if ch is self.channel and ch.is_open:
+            settle()
+        self.schedule()
+
+    def retry(
+        self, ch, method, body, queue_name: str, delay: float, attempt: int
+    ):
+        ch.basic_publish(
+            exchange='',
+            routing_key=queue_name,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.DeliveryMode.Persistent,
+                expiration=str(int(delay * 1000)),
+                headers={"x-attempt": attempt},
+            ),
+        )
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def dead_letter(self, priority, ch, method, body, attempt: int, error):
+        ch.basic_publish(
+            exchange='',
+            routing_key=dead_queue(RUN_QUEUES[priority]),
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.DeliveryMode.Persistent,
+                headers={"x-attempt": attempt, "x-error": str(error)[:1000]},
+            ),
+        )
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+    def process_message_and_ack(self, priority, ch, method, properties, body):
+        attempt = (properties.headers or {}).get("x-attempt", 1)
+        settle = functools.partial(
+            ch.basic_ack, delivery_tag=method.delivery_tag
+        )
         try:
-            self.process_message(body)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
+            self.process_message(body, attempt)
+        except ThreadBusy as e:
+            print(f"Postponing {body}: {e}")
+            settle = functools.partial(
+                self.retry,
+                ch,
+                method,
+                body,
+                busy_queue(RUN_QUEUES[priority]),
+                DISPATCH_RETRY_SECONDS,
+                attempt,
+            )
         except Exception as e:
-            print(f"Failed to process message {body}: {e}")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            if is_transient(e) and attempt < MAX_ATTEMPTS:
+                print(f"Retrying {body}: {e}")
+                settle = functools.partial(
+                    self.retry,
+                    ch,
+                    method,
+                    body,
+                    retry_queue(RUN_QUEUES[priority], attempt + 1),
+                    retry_delay(attempt + 1),
+                    attempt + 1,
+                )
+            else:
+                print(f"Failed to process message {body}: {e}")
+                settle = functools.partial(
+                    self.dead_letter, priority, ch, method, body, attempt, e
+                )
+        with self.running_lock:
+            self.running -= 1
+        try:
+            self.connection.add_callback_threadsafe(
+                functools.partial(self.finish, ch, settle)
+            )
+        except pika.exceptions.AMQPError as e:
+            # reconnecting, the run is redelivered
+            print(f"Failed to ack {body}: {e}")
 
-    def start_consuming(self, queue_name):
+    def start_consuming(self):
         while True:
             try:
-                self.channel.queue_declare(queue=queue_name, durable=True)
-                self.channel.basic_consume(
-                    queue=queue_name,
-                    on_message_callback=self.callback,
-                    auto_ack=False,
-                )
+                for priority, queue_name in RUN_QUEUES.items():
+                    self.channel.queue_declare(queue=queue_name, durable=True)
+                    declare_retry_queues(self.channel, queue_name)
+                    self.channel.basic_consume(
+                        queue=queue_name,
+                        on_message_callback=functools.partial(
+                            self.callback, priority
+                        ),
+                        auto_ack=False,
+                    )
                 print("Waiting for messages. To exit press CTRL+C")
                 self.channel.start_consuming()
             except pika.exceptions.ConnectionClosedByBroker:
@@ -85,6 +259,110 @@ class RabbitMQConsumer:
                 self.connect()
 
 
+class PostgresConsumer:
+    """
+    Claims the runs dispatched through Postgres from the ops API, as many as
+    there are idle workers, and polls every DISPATCH_POLL_SECONDS while none
+    are dispatched. The idle workers are shared among the priorities by
+    weighted round robin, those a priority has no runs for take runs of any.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.scheduler = WeightedRoundRobin()
+        self.idle_workers = threading.Semaphore(max_workers)
+        self.worker = f"{socket.gethostname()}:{uuid.uuid4().hex[:8]}"
+
+    def claim(self) -> list:
+        # waits for an idle worker, then takes the others idle as well
+        self.idle_workers.acquire()
+        limit = 1
+        while limit < self.max_workers and self.idle_workers.acquire(
+            blocking=False
+        ):
+            limit += 1
+        shares = Counter(self.scheduler.next(RUN_QUEUES) for _ in range(limit))
+        dispatches = []
+        try:
+            for priority, share in shares.items():
+                dispatches += claim_run_dispatches(
+                    self.worker, share, DISPATCH_LEASE_SECONDS, priority
+                )
+            if len(dispatches) < limit:
+                dispatches += claim_run_dispatches(
+                    self.worker,
+                    limit - len(dispatches),
+                    DISPATCH_LEASE_SECONDS,
+                )
+        except Exception as e:
+            print(f"Failed to claim runs: {e}")
+        for _ in range(limit - len(dispatches)):
+            self.idle_workers.release()
+        return dispatches
+
+    def process_dispatch_and_ack(self, dispatch: dict):
+        attempt = dispatch.get("attempts", 0) + 1
+        settle = functools.partial(
+            ack_run_dispatch, dispatch["id"], self.worker
+        )
+        try:
+            print(f"\n\nProcessing {dispatch}")
+            run = ExecuteRun(
+                dispatch["thread_id"], dispatch["run_id"], attempt=attempt
+            )
+            run.execute()
+        except ThreadBusy as e:
+            print(f"Postponing {dispatch}: {e}")
+            settle = functools.partial(
+                nack_run_dispatch,
+                dispatch["id"],
+                self.worker,
+                DISPATCH_RETRY_SECONDS,
+            )
+        except Exception as e:
+            if is_transient(e) and attempt < MAX_ATTEMPTS:
+                print(f"Retrying {dispatch}: {e}")
+                settle = functools.partial(
+                    nack_run_dispatch,
+                    dispatch["id"],
+                    self.worker,
+                    round(retry_delay(attempt + 1)),
+                    failed=True,
+                )
+            else:
+                # the run was marked failed, its dispatch is done with
+                print(f"Failed to process dispatch {dispatch}: {e}")
+        try:
+            self.settle(dispatch, settle)
+        finally:
+            self.idle_workers.release()
+
+    def settle(self, dispatch: dict, settle):
+        # only the ack or nack is retried, the run is not executed again.
+        # Dispatches left unsettled are claimed again after their lease and
+        # skipped by ExecuteRun if their run finished.
+        for attempt in range(SETTLE_ATTEMPTS):
+            try:
+                settle()
+                return
+            except Exception as e:
+                print(f"Failed to settle dispatch {dispatch['id']}: {e}")
+                if attempt + 1 < SETTLE_ATTEMPTS:
+                    time.sleep(2**attempt)
+
+    def start_consuming(self):
+        print("Claiming dispatched runs. To exit press CTRL+C")
+        while True:
+            dispatches = self.claim()
+            for dispatch in dispatches:
+                self.executor.submit(self.process_dispatch_and_ack, dispatch)
+            if not dispatches:
+                time.sleep(DISPATCH_POLL_SECONDS)
+
+
 if __name__ == "__main__":
-    consumer = RabbitMQConsumer(max_workers=MAX_WORKERS)
-    consumer.start_consuming("runs_queue")
+    if RUN_DISPATCH == "postgres":
+        PostgresConsumer(max_workers=MAX_WORKERS).start_consuming()
+    else:
+        RabbitMQConsumer(max_workers=MAX_WORKERS).start_consuming()
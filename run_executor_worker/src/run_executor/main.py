@@ -3,9 +3,13 @@ from constants import PromptKeys
 from utils.weaviate_utils import get_web_retrieval_description
 from utils.tools import ActionItem, Actions, tools_to_map
 from utils.ops_api_handler import create_message_runstep, update_run
+from utils.retry import MAX_ATTEMPTS, is_transient
+from utils.run_guard import RunGuard, RunInterrupted, guard_run
+from utils.thread_lease import ThreadLease
 from data_models import run
 from openai.types.beta.threads.message import Message
 from utils.openai_clients import assistants_client
+from utils.pagination import list_all
 from openai.types.beta.thread import Thread
 from openai.types.beta import Assistant
 from openai.pagination import SyncCursorPage
@@ -13,16 +17,32 @@ from agents import router, coala
 from actions import function_calling_tool
 import json
 import datetime
+import openai
 
 # TODO: add assistant and base tools off of assistant
 
 
+def run_error(error: Exception) -> dict:
+    code = (
+        "rate_limit_exceeded"
+        if isinstance(error, openai.RateLimitError)
+        else "server_error"
+    )
+    return {"code": code, "message": str(error)}
+
+
 class ExecuteRun:
     def __init__(
-        self, thread_id: str, run_id: str, run_config: Dict[str, Any] = {}
+        self,
+        thread_id: str,
+        run_id: str,
+        run_config: Dict[str, Any] = {},
+        attempt: int = 1,
     ):
         self.run_id = run_id
         self.thread_id = thread_id
+        # retried after transient errors until MAX_ATTEMPTS
+        self.attempt = attempt
         self.assistant_id: Optional[str] = None
         self.run_config = run_config
 
@@ -33,9 +53,37 @@ class ExecuteRun:
         self.tools_map: Optional[dict[str, ActionItem]] = None
         self.runsteps: Optional[SyncCursorPage[run.RunStep]] = None
         self.web_retrieval_description: Optional[str] = None
+        self.guard = RunGuard(thread_id, run_id)
         # TODO: add assistant and base tools off of assistant
 
     def execute(self):
+        # runs of the same thread are executed one at a time
+        with ThreadLease(self.thread_id, self.run_id), guard_run(self.guard):
+            try:
+                # runs cancelled or expired while queued are not started
+                self.guard.check(force=True)
+            except RunInterrupted:
+                self.stop_interrupted()
+                return
+            # runs are dispatched at least once, a run delivered again after
+            # it finished or started waiting for tool outputs is skipped
+            if self.guard.status not in (None, "queued", "in_progress"):
+                print(f"\n\nSkipping run {self.run_id}, {self.guard.status}.")
+                return
+            self.execute_steps()
+
+    def stop_interrupted(self):
+        now = int(datetime.datetime.now().timestamp())
+        if self.guard.interrupted == "cancelled":
+            run_update = run.RunUpdate(
+                status=run.RunStatus.CANCELLED.value, cancelled_at=now
+            )
+        else:
+            run_update = run.RunUpdate(status=run.RunStatus.EXPIRED.value)
+        update_run(self.thread_id, self.run_id, run_update)
+        print(f"\n\nStopped executing run, it is {run_update.status}.")
+
+    def execute_steps(self):
         # Create an instance of the RunUpdate schema with the new status
         run_update = run.RunUpdate(status=run.RunStatus.IN_PROGRESS.value)
 
@@ -50,8 +98,13 @@ class ExecuteRun:
 
         try:
             self.run = updated_run
+            self.guard.expires_at = updated_run.expires_at
+            # only the latest step is needed here
             self.runsteps = assistants_client.beta.threads.runs.steps.list(
-                run_id=self.run_id, thread_id=self.thread_id, order="desc"
+                run_id=self.run_id,
+                thread_id=self.thread_id,
+                order="desc",
+                limit=1,
             )
             print("\n\nExecuting run: ", self.run, "\n\n")
 
@@ -73,8 +126,10 @@ class ExecuteRun:
                 self.assistant.tools, self.web_retrieval_description
             )
 
-            messages = assistants_client.beta.threads.messages.list(
-                thread_id=self.thread_id, order="asc"
+            messages = list_all(
+                assistants_client.beta.threads.messages.list,
+                thread_id=self.thread_id,
+                order="asc",
             )
             self.messages = messages
 
@@ -86,13 +141,18 @@ class ExecuteRun:
                 == "function"
             ):
                 router_response = "tool_response"
+            elif self.attempt > 1 and len(self.runsteps.data):
+                # steps persisted by an attempt that failed, the run goes on
+                # from them rather than starting over
+                router_response = "resume"
             else:
                 router_agent = router.RouterAgent(self)  # semantic router
                 router_response = router_agent.generate()
 
-            if (
-                router_response != PromptKeys.TRANSITION.value
-                and router_response != "tool_response"
+            if router_response not in (
+                PromptKeys.TRANSITION.value,
+                "tool_response",
+                "resume",
             ):
                 create_message_runstep(
                     self.thread_id,
@@ -130,6 +190,10 @@ class ExecuteRun:
             if router_response == "tool_response":
                 coala_class.load_trace()
 
+            if router_response == "resume":
+                coala_class.resume_trace()
+                router_response = PromptKeys.TRANSITION.value
+
             max_steps = 8
             curr_step = 0
 
@@ -138,6 +202,7 @@ class ExecuteRun:
                 coala_class.react_steps[-1].step_type
                 != coala.ReactStepType.FINAL_ANSWER
             ):
+                self.guard.check(force=True)
                 if router_response == "tool_response":
                     router_response = PromptKeys.TRANSITION.value
                     fc_tool = function_calling_tool.FunctionCallingTool(
@@ -204,10 +269,20 @@ class ExecuteRun:
                 f"""\n\nFinished executing run with status {run_update.status} after {curr_step} steps."""  # noqa
             )
         except Exception as e:
+            if self.guard.interrupted:
+                # raised by the guard, possibly from a request of the openai
+                # client which wraps it in an APIConnectionError
+                self.stop_interrupted()
+                return
+            if is_transient(e) and self.attempt < MAX_ATTEMPTS:
+                # the consumer executes the run again after a delay
+                print(f"Error executing run, attempt {self.attempt}: {e}")
+                raise
             print(f"Error executing run: {e}")
             run_update = run.RunUpdate(
                 status=run.RunStatus.FAILED.value,
                 failed_at=int(datetime.datetime.now().timestamp()),
+                last_error=run_error(e),
             )
             updated_run = update_run(self.thread_id, self.run_id, run_update)
             print(f"Run failed: {updated_run}")
@@ -31,7 +31,7 @@ class CoALA:
         Compose the trace prompt of the current task
         """
         trace_prompt = []
-        for step in self.runsteps:
+        for step in self.runsteps.data:
             if step.type == "tool_calls":
                 trace_prompt.append(
                     f"Action: {step.step_details.tool_calls[0].type}"
@@ -1,4 +1,4 @@
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
 from openai.types.chat import (
     completion_create_params,
     chat_completion_tool_choice_option_param,
@@ -19,6 +19,7 @@ import os
 import json
 from dateutil.parser import isoparse
 import re
+from utils.run_guard import guard_llm_request
 
 # raise error if LITELLM_API_URL or ASSISTANTS_API_URL or FC_API_URL is not set
 if not os.getenv("LITELLM_API_URL"):
@@ -29,15 +30,23 @@ if not os.getenv("ASSISTANTS_API_URL"):
 if not os.getenv("FC_API_URL"):
     print("FC_API_URL is not set. Defaulting to OpenAI inference.")
 
+
+def guarded_http_client() -> DefaultHttpxClient:
+    """HTTP client of the LLM clients, stopping requests of stopped runs."""
+    return DefaultHttpxClient(event_hooks={"request": [guard_llm_request]})
+
+
 litellm_client = None
 if os.getenv("LITELLM_API_URL"):
     litellm_client = OpenAI(
         api_key=os.getenv("LITELLM_API_KEY"),
         base_url=os.getenv("LITELLM_API_URL", None),
+        http_client=guarded_http_client(),
     )
 else:
     litellm_client = OpenAI(
         api_key=os.getenv("LITELLM_API_KEY"),
+        http_client=guarded_http_client(),
     )
 
 assistants_client = OpenAI(
@@ -48,10 +57,12 @@ if os.getenv("FC_API_URL"):
     fc_client = OpenAI(
         base_url=os.getenv("FC_API_URL"),
         api_key=os.getenv("FC_API_KEY"),
+        http_client=guarded_http_client(),
     )
 else:
     fc_client = OpenAI(
         api_key=os.getenv("FC_API_KEY"),
+        http_client=guarded_http_client(),
     )
 
 
@@ -1,8 +1,9 @@
 # api_handler.py
-from typing import List, Literal
+from typing import List, Literal, Optional
 import uuid
 import requests
 import os
+from pydantic import BaseModel
 from data_models import run
 from openai.types.beta.threads.message import Message
 from openai.types.beta.threads.runs import FileSearchToolCall
@@ -18,6 +19,20 @@ from utils.openai_clients import assistants_client
 BASE_URL = os.getenv("ASSISTANTS_API_URL")
 
 
+def post_ops(url: str, payload: BaseModel) -> requests.Response:
+    """
+    Posts a payload to an ops endpoint, encoded by pydantic-core rather than
+    dumped to a dict and encoded again by the json module, which is slow for
+    steps holding large retrieval observations. Responses are parsed the same
+    way, with `model_validate_json`.
+    """
+    return requests.post(
+        url,
+        data=payload.model_dump_json(exclude_none=True),
+        headers={"Content-Type": "application/json"},
+    )
+
+
 def update_run(
     thread_id: str, run_id: str, run_update: run.RunUpdate
 ) -> run.Run:
@@ -33,16 +48,71 @@ def update_run(
     bool: True if the status was successfully updated, False otherwise.
     """
     update_url = f"{BASE_URL}/ops/threads/{thread_id}/runs/{run_id}"
-    update_data = run_update.model_dump(exclude_none=True)
-
-    response = requests.post(update_url, json=update_data)
+    response = post_ops(update_url, run_update)
 
     if response.status_code == 200:
-        return run.Run(**response.json())
+        return run.Run.model_validate_json(response.content)
     else:
         return None
 
 
+def claim_thread_lease(thread_id: str, holder: str, ttl: int) -> bool:
+    """Leases the thread to `holder`, False while someone else holds it."""
+    response = requests.post(
+        f"{BASE_URL}/ops/threads/{thread_id}/lease",
+        json={"holder": holder, "ttl": ttl},
+    )
+    if response.status_code == 409:
+        return False
+    if response.status_code != 200:
+        raise Exception(f"Failed to lease thread: {response.text}")
+    return True
+
+
+def release_thread_lease(thread_id: str, holder: str) -> bool:
+    response = requests.post(
+        f"{BASE_URL}/ops/threads/{thread_id}/lease/release",
+        json={"holder": holder},
+    )
+    return response.status_code == 200
+
+
+def claim_run_dispatches(
+    worker: str, limit: int, lease: int, priority: Optional[str] = None
+) -> List[dict]:
+    """
+    Claims up to `limit` runs dispatched through Postgres, of `priority` or
+    of any priority.
+    """
+    claim = {"worker": worker, "limit": limit, "lease": lease}
+    if priority is not None:
+        claim["priority"] = priority
+    response = requests.post(
+        f"{BASE_URL}/ops/run_dispatches/claim", json=claim
+    )
+    if response.status_code != 200:
+        raise Exception(f"Failed to claim runs: {response.text}")
+    return response.json()["data"]
+
+
+def ack_run_dispatch(dispatch_id: int, worker: str) -> bool:
+    response = requests.post(
+        f"{BASE_URL}/ops/run_dispatches/{dispatch_id}/ack",
+        json={"worker": worker},
+    )
+    return response.status_code == 200
+
+
+def nack_run_dispatch(
+    dispatch_id: int, worker: str, delay: int, failed: bool = False
+) -> bool:
+    response = requests.post(
+        f"{BASE_URL}/ops/run_dispatches/{dispatch_id}/nack",
+        json={"worker": worker, "delay": delay, "failed": failed},
+    )
+    return response.status_code == 200
+
+
 def create_message(
     thread_id: str, content: str, role: Literal["user", "assistant"]
 ) -> Message:
@@ -69,19 +139,17 @@ def create_message_runstep(
         "type": "message_creation",
         "status": "completed",
     }
-    run_step_details = run.RunStepCreate(**run_step_details).model_dump(
-        exclude_none=True
-    )
+    run_step_details = run.RunStepCreate(**run_step_details)
 
     # Post request to create a run step
-    response = requests.post(
+    response = post_ops(
         f"{BASE_URL}/ops/threads/{thread_id}/runs/{run_id}/steps",
-        json=run_step_details,
+        run_step_details,
     )
     if response.status_code != 200:
         raise Exception(f"Failed to create run step: {response.text}")
 
-    return run.RunStep(**response.json())
+    return run.RunStep.model_validate_json(response.content)
 
 
 def create_retrieval_runstep(
@@ -108,19 +176,17 @@ def create_retrieval_runstep(
     }
 
     # This model dumping part would be dependent on how you're handling Pydantic models, showing a conceptual example: # noqa
-    run_step_details = run.RunStepCreate(**run_step_details).model_dump(
-        exclude_none=True
-    )
+    run_step_details = run.RunStepCreate(**run_step_details)
 
     # Post request to create a run step
-    response = requests.post(
+    response = post_ops(
         f"{BASE_URL}/ops/threads/{thread_id}/runs/{run_id}/steps",
-        json=run_step_details,
+        run_step_details,
     )
     if response.status_code != 200:
         raise Exception(f"Failed to create run step: {response.text}")
 
-    return run.RunStep(**response.json())
+    return run.RunStep.model_validate_json(response.content)
 
 
 def create_web_retrieval_runstep(
@@ -154,19 +220,17 @@ def create_web_retrieval_runstep(
     }
 
     # This model dumping part would be dependent on how you're handling Pydantic models, showing a conceptual example: # noqa
-    run_step_details = run.RunStepCreate(**run_step_details).model_dump(
-        exclude_none=True
-    )
+    run_step_details = run.RunStepCreate(**run_step_details)
 
     # Post request to create a run step
-    response = requests.post(
+    response = post_ops(
         f"{BASE_URL}/ops/threads/{thread_id}/runs/{run_id}/steps",
-        json=run_step_details,
+        run_step_details,
     )
     if response.status_code != 200:
         raise Exception(f"Failed to create run step: {response.text}")
 
-    return run.RunStep(**response.json())
+    return run.RunStep.model_validate_json(response.content)
 
 
 def create_function_runstep(
@@ -194,16 +258,14 @@ def create_function_runstep(
     }
 
     # This model dumping part would be dependent on how you're handling Pydantic models, showing a conceptual example: # noqa
-    run_step_details = run.RunStepCreate(**run_step_details).model_dump(
-        exclude_none=True
-    )
+    run_step_details = run.RunStepCreate(**run_step_details)
 
     # Post request to create a run step
-    response = requests.post(
+    response = post_ops(
         f"{BASE_URL}/ops/threads/{thread_id}/runs/{run_id}/steps",
-        json=run_step_details,
+        run_step_details,
     )
     if response.status_code != 200:
         raise Exception(f"Failed to create run step: {response.text}")
 
-    return run.RunStep(**response.json())
+    return run.RunStep.model_validate_json(response.content)
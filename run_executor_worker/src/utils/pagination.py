@@ -0,0 +1,26 @@
+from typing import Callable, Iterator, TypeVar
+from openai.pagination import SyncCursorPage
+
+PAGE_SIZE = 100  # largest page the API serves
+
+T = TypeVar("T")
+
+
+def iter_all(
+    list_method: Callable[..., SyncCursorPage[T]], **params
+) -> Iterator[T]:
+    """
+    Yields every item of a list endpoint, following the `after` cursor and
+    stopping at the first page that is not full so no extra request is made
+    """
+    page = list_method(limit=PAGE_SIZE, **params)
+    yield from page.data
+    while len(page.data) == PAGE_SIZE:
+        page = list_method(limit=PAGE_SIZE, after=page.data[-1].id, **params)
+        yield from page.data
+
+
+def list_all(
+    list_method: Callable[..., SyncCursorPage[T]], **params
+) -> SyncCursorPage[T]:
+    return SyncCursorPage(data=list(iter_all(list_method, **params)))
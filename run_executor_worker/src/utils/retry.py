@@ -0,0 +1,41 @@
+import os
+import random
+import httpx
+import openai
+import requests
+
+# runs failing on transient errors are executed again after these delays,
+# attempts past them fail the run
+RETRY_DELAYS_SECONDS = [
+    int(delay)
+    for delay in os.getenv("RUN_RETRY_DELAYS_SECONDS", "5,30,120").split(",")
+]
+MAX_ATTEMPTS = len(RETRY_DELAYS_SECONDS) + 1
+# delays are spread by up to this fraction, so runs failing together (an LLM
+# outage) are not retried together
+RETRY_JITTER = 0.2
+
+TRANSIENT_ERRORS = (
+    # connection errors and timeouts of the LLM and assistants API clients
+    openai.APIConnectionError,
+    httpx.TransportError,
+    requests.ConnectionError,
+    requests.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether executing the run again may succeed."""
+    if isinstance(error, openai.APIStatusError):
+        # rate limits, timeouts and server errors. Conflicts are not retried,
+        # the assistants API answers 409 when another run holds the thread
+        return error.status_code in (408, 429) or error.status_code >= 500
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def retry_delay(attempt: int) -> float:
+    """Seconds to wait before `attempt`, the first retry being attempt 2."""
+    delay = RETRY_DELAYS_SECONDS[attempt - 2]
+    return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import os
+import threading
+import time
+import httpx
+import requests
+
+BASE_URL = os.getenv("ASSISTANTS_API_URL")
+
+# the run is fetched again to look for cancellations at most this often
+CHECK_INTERVAL_SECONDS = float(os.getenv("RUN_CHECK_INTERVAL_SECONDS", 2))
+# a lookup of a hanging API gives up after this, the next check tries again
+CHECK_TIMEOUT_SECONDS = 5
+
+
+class RunInterrupted(Exception):
+    def __init__(self, status: str):
+        super().__init__(f"Run {status}")
+        self.status = status
+
+
+class RunGuard:
+    """
+    Tells whether a run was cancelled or has expired while it is executed.
+    Cancellations are looked up on the API, at most every
+    CHECK_INTERVAL_SECONDS, expiry is checked against the run's expires_at.
+    """
+
+    def __init__(self, thread_id: str, run_id: str):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.expires_at: Optional[int] = None
+        # status of the run when it was last looked up
+        self.status: Optional[str] = None
+        self.checked_at = 0.0
+        # "cancelled" or "expired" once the run has to be stopped
+        self.interrupted: Optional[str] = None
+
+    def check(self, force: bool = False):
+        """Raises RunInterrupted if the run must not go on."""
+        if not self.interrupted:
+            self.interrupted = self.lookup(force)
+        if self.interrupted:
+            raise RunInterrupted(self.interrupted)
+
+    def lookup(self, force: bool) -> Optional[str]:
+        now = time.time()
+        if self.expires_at is not None and now >= self.expires_at:
+            return "expired"
+        if not force and now - self.checked_at < CHECK_INTERVAL_SECONDS:
+            return None
+        self.checked_at = now
+        try:
+            response = requests.get(
+                f"{BASE_URL}/threads/{self.thread_id}/runs/{self.run_id}",
+                timeout=CHECK_TIMEOUT_SECONDS,
+            )
+        except requests.RequestException as e:
+            print(f"Error looking up run {self.run_id}: {e}")
+            return None  # the next check tries again
+        if response.status_code != 200:
+            return None
+        run = response.json()
+        self.status = run["status"]
+        self.expires_at = run.get("expires_at")
+        if run["status"] in ("cancelling", "cancelled"):
+            return "cancelled"
+        if run["status"] == "expired" or (
+            self.expires_at is not None and now >= self.expires_at
+        ):
+            return "expired"
+        return None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the run expires."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.time(), 0)
+
+
+# runs are executed one per thread
+_current = threading.local()
+
+
+@contextmanager
+def guard_run(guard: RunGuard) -> Iterator[RunGuard]:
+    """Makes `guard` check the LLM requests sent by this thread."""
+    _current.guard = guard
+    try:
+        yield guard
+    finally:
+        _current.guard = None
+
+
+def guard_llm_request(request: httpx.Request):
+    """
+    httpx request hook of the LLM clients: requests are not sent for runs
+    that were cancelled or have expired, and the timeout of the others is
+    capped to the time left before the run expires, so a pending completion
+    does not outlive the run.
+    """
+    guard: Optional[RunGuard] = getattr(_current, "guard", None)
+    if guard is None:
+        return
+    guard.check()
+    remaining = guard.remaining()
+    if remaining is None:
+        return
+    timeout = request.extensions.get("timeout", {})
+    request.extensions["timeout"] = {
+        key: remaining if value is None else min(value, remaining)
+        for key, value in timeout.items()
+    }
@@ -0,0 +1,39 @@
+from typing import Dict, Iterable, Optional
+import os
+
+# run priorities, their queue and their share of the workers when runs of
+# several priorities are waiting
+RUN_QUEUES = {
+    "interactive": "runs_queue",
+    "batch": "runs_queue.batch",
+}
+PRIORITY_WEIGHTS = {
+    "interactive": int(os.getenv("INTERACTIVE_RUN_WEIGHT", 4)),
+    "batch": int(os.getenv("BATCH_RUN_WEIGHT", 1)),
+}
+
+
+class WeightedRoundRobin:
+    """
+    Smooth weighted round robin: picks among the priorities with runs
+    waiting, each in proportion to its weight and interleaved rather than
+    in bursts. Priorities with nothing waiting do not build up credit.
+    """
+
+    def __init__(self, weights: Dict[str, int] = PRIORITY_WEIGHTS):
+        self.weights = weights
+        self.current = {priority: 0 for priority in weights}
+
+    def next(self, waiting: Iterable[str]) -> Optional[str]:
+        waiting = [
+            priority for priority in waiting if priority in self.weights
+        ]
+        if not waiting:
+            return None
+        total = 0
+        for priority in waiting:
+            self.current[priority] += self.weights[priority]
+            total += self.weights[priority]
+        picked = max(waiting, key=lambda priority: self.current[priority])
+        self.current[picked] -= total
+        return picked
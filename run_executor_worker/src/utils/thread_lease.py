@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+import uuid
+from utils.ops_api_handler import claim_thread_lease, release_thread_lease
+
+LEASE_SECONDS = int(os.getenv("THREAD_LEASE_SECONDS", 60))
+# how long a run waits for the run holding its thread before being
+# postponed, short so a busy thread does not hold up a worker
+LEASE_WAIT_SECONDS = float(os.getenv("THREAD_LEASE_WAIT_SECONDS", 2))
+LEASE_RETRY_SECONDS = 1.0
+
+
+class ThreadBusy(Exception):
+    pass
+
+
+class ThreadLease:
+    """
+    Holds the lease of a thread while one of its runs executes, so the runs
+    of a thread execute one at a time across workers while other threads
+    run in parallel. The lease is renewed in the background and expires on
+    its own if the worker dies.
+    """
+
+    def __init__(self, thread_id: str, run_id: str):
+        self.thread_id = thread_id
+        # unique per execution, a redelivered run does not share the lease
+        self.holder = f"{run_id}:{uuid.uuid4().hex[:8]}"
+        self.stopped = threading.Event()
+        self.heartbeat = threading.Thread(target=self.renew, daemon=True)
+
+    def __enter__(self) -> "ThreadLease":
+        deadline = time.monotonic() + LEASE_WAIT_SECONDS
+        while not claim_thread_lease(
+            self.thread_id, self.holder, LEASE_SECONDS
+        ):
+            if time.monotonic() >= deadline:
+                raise ThreadBusy(
+                    f"Thread {self.thread_id} is leased by another run"
+                )
+            time.sleep(LEASE_RETRY_SECONDS)
+        self.heartbeat.start()
+        return self
+
+    def renew(self):
+        while not self.stopped.wait(LEASE_SECONDS / 3):
+            try:
+                if not claim_thread_lease(
+                    self.thread_id, self.holder, LEASE_SECONDS
+                ):
+                    print(f"Lost the lease of thread {self.thread_id}")
+                    return
+            except Exception as e:
+                print(f"Error renewing lease of {self.thread_id}: {e}")
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.heartbeat.join()
+        release_thread_lease(self.thread_id, self.holder)